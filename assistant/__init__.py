@@ -1,5 +1,12 @@
+import time
+
+_import_started = time.perf_counter()
+
 from .assistant import OpenAIChat
+from .deps import record_import_time
 from redbot.core.bot import Red
 
+record_import_time("assistant (cog package)", time.perf_counter() - _import_started)
+
 async def setup(bot: Red):
     await bot.add_cog(OpenAIChat(bot))
@@ -1,8 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple
 
 import discord
 import re
+import time
 from redbot.core import commands
 
 
@@ -21,6 +22,7 @@ AGENT_MODE_PROMPT = (
     "15. 若你判定這一輪不需要對使用者顯示任何訊息，可在最後單獨一行輸出 NO_REPLY，系統會視為隱藏結束，不發送任何訊息。\n"
     "16. 若有 safe_exec 工具可用，它只允許白名單 command/action；不可要求任意 shell、破壞性操作或超出白名單的指令。\n"
     "17. 在 agent 模式中，凡是使用者詢問目前日期、時間、時區、數學計算或隨機數，必須呼叫 safe_exec 取得結果，不可心算、憑模型知識或自行推測。\n"
+    "18. 需要同時閱讀或比較多個網頁時，請用 web_fetch_many 一次讀取所有網址，不要逐一呼叫 web_fetch。\n"
 )
 
 AGENT_SEARCH_TOOL_NAME = "agent_search_web"
@@ -28,8 +30,16 @@ AGENT_SEARCH_MAX_CALLS = 25
 CHAT_SEARCH_TOOL_NAME = "search_web"
 CHAT_SEARCH_MAX_CALLS = 4
 WEB_FETCH_TOOL_NAME = "web_fetch"
+WEB_FETCH_MANY_TOOL_NAME = "web_fetch_many"
+WEB_FETCH_MANY_MAX_URLS = 8
+WEB_FETCH_MANY_PER_HOST = 2
+WEB_FETCH_MANY_DEADLINE_SECONDS = 25.0
+WEB_FETCH_MANY_CHAR_BUDGET = 24000
 SAFE_EXEC_TOOL_NAME = "safe_exec"
 
+REQUEST_PRIORITY_DIRECT = 0
+REQUEST_PRIORITY_PASSIVE = 1
+
 _AGENT_CONTROL_MAP = {
     "END": "end",
     "[END]": "end",
@@ -47,6 +57,18 @@ class AgentChatRequest:
     message: discord.Message
     user_input: str
     agent_mode: bool = False
+    priority: int = REQUEST_PRIORITY_PASSIVE
+    enqueued_at: float = field(default_factory=time.monotonic)
+    merged_messages: List[discord.Message] = field(default_factory=list)
+
+    def merge(self, other: "AgentChatRequest"):
+        """Fold a newer request of the same user/channel into this one; the reply goes to the newest message."""
+        self.merged_messages.append(self.message)
+        self.merged_messages.extend(other.merged_messages)
+        self.message = other.message
+        self.user_input = f"{self.user_input}\n{other.user_input}".strip()
+        self.priority = min(self.priority, other.priority)
+        self.enqueued_at = max(self.enqueued_at, other.enqueued_at)
 
 
 class AgentRuntimeMixin:
@@ -113,7 +135,22 @@ class AgentRuntimeMixin:
         if not user_input:
             return None
 
-        return AgentChatRequest(message=message, user_input=user_input, agent_mode=True)
+        return AgentChatRequest(
+            message=message,
+            user_input=user_input,
+            agent_mode=True,
+            priority=REQUEST_PRIORITY_DIRECT,
+        )
+
+    def _is_direct_request(self, message: discord.Message) -> bool:
+        """Cheap check (no REST call) for mentions of the bot or replies to one of its messages."""
+        if self.bot.user is None:
+            return False
+        if self.bot.user in message.mentions:
+            return True
+        reference = message.reference
+        resolved = getattr(reference, "resolved", None) if reference is not None else None
+        return isinstance(resolved, discord.Message) and resolved.author.id == self.bot.user.id
 
     @staticmethod
     def _format_interaction_input(
@@ -188,6 +225,28 @@ class AgentRuntimeMixin:
             ),
         ]
 
+        if agent_mode:
+            declarations.append(
+                types_module.FunctionDeclaration(
+                    name=WEB_FETCH_MANY_TOOL_NAME,
+                    description=(
+                        "Fetch several web pages concurrently in one call and extract readable text from each. "
+                        f"Up to {WEB_FETCH_MANY_MAX_URLS} URLs; the combined text is limited, so each page may be shortened."
+                    ),
+                    parameters=types_module.Schema(
+                        type=types_module.Type.OBJECT,
+                        properties={
+                            "urls": types_module.Schema(
+                                type=types_module.Type.ARRAY,
+                                items=types_module.Schema(type=types_module.Type.STRING),
+                                description="The absolute http/https URLs to fetch.",
+                            )
+                        },
+                        required=["urls"],
+                    ),
+                )
+            )
+
         if safe_exec_enabled:
             declarations.append(
                 types_module.FunctionDeclaration(
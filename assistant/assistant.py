@@ -2,20 +2,16 @@ import asyncio
 import base64
 import io
 import logging
-from ddgs import DDGS
 import os
 import json
 import aiofiles
 import time
 import discord
 import pathlib
-import httpx
 import re
 import math
-import array
 import hashlib
 import html
-import aiosqlite
 import shlex
 import datetime
 import zoneinfo
@@ -23,26 +19,60 @@ import operator
 import ast
 import random
 import textwrap
-from google import genai
-from google.genai import types
-from dataclasses import dataclass
+import urllib.parse
+from collections import deque
+from dataclasses import dataclass, field
 from redbot.core import Config, commands, data_manager
 from redbot.core.bot import Red
 from .agent import (
     AGENT_GUILD_DEFAULTS,
     AgentChatRequest,
     AgentRuntimeMixin,
+    REQUEST_PRIORITY_DIRECT,
     SAFE_EXEC_TOOL_NAME,
+    WEB_FETCH_MANY_CHAR_BUDGET,
+    WEB_FETCH_MANY_DEADLINE_SECONDS,
+    WEB_FETCH_MANY_MAX_URLS,
+    WEB_FETCH_MANY_PER_HOST,
+    WEB_FETCH_MANY_TOOL_NAME,
     WEB_FETCH_TOOL_NAME,
 )
 from .c_assistant import AssistantCommands
-from typing import Optional, List, Dict, Tuple, Any, Callable, Awaitable
+from .consolidation import CONSOLIDATION_GLOBAL_DEFAULTS, MemoryConsolidationMixin
+from .deps import (
+    import_timings,
+    load_aiosqlite,
+    load_api_exceptions,
+    load_ddgs,
+    load_genai,
+    load_httpx,
+    preload_all,
+)
+from .embeddings import (
+    EMBEDDING_FORMAT_FLOAT32,
+    EMBEDDING_FORMATS,
+    blob_cosine,
+    blob_format,
+    decode_embedding,
+    encode_embedding,
+    recall_benchmark,
+    unit_vector,
+)
+from .hedging import HEDGING_GLOBAL_DEFAULTS, KEY_QUOTA_WINDOW_SECONDS, LatencyTracker
+from .tool_compaction import TOOL_COMPACTION_GLOBAL_DEFAULTS, ToolOutputCompactor
+from .request_queue import (
+    QUEUE_GLOBAL_DEFAULTS,
+    QUEUE_STATUS_COALESCED,
+    QUEUE_STATUS_REJECTED,
+    RequestQueue,
+)
+from typing import Optional, List, Dict, Tuple, Any, Callable, Awaitable, Deque
 from concurrent.futures import ThreadPoolExecutor
-from google.api_core import exceptions as api_exc
 
 
 
 def _exc_classes(*names: str):
+    api_exc = load_api_exceptions()
     if api_exc is None:
         return ()
     classes = []
@@ -61,8 +91,6 @@ logging.getLogger("google_genai").setLevel(logging.WARNING)
 logging.getLogger("google_genai.models").setLevel(logging.WARNING)
 
 
-SEARCH_TOOL = types.Tool(google_search=types.GoogleSearch())
-
 MEMORY_ITEM_SCHEMA: Dict[str, Any] = {
     "type": "object",
     "properties": {
@@ -237,6 +265,16 @@ def _safe_json_loads(text: str) -> Any:
 class _APIKeyState:
     cooldown_until: float = 0.0
     failures: int = 0
+    # Start times of requests sent with this key in the last quota window (primary + hedged).
+    request_times: Deque[float] = field(default_factory=deque)
+    hedge_times: Deque[float] = field(default_factory=deque)
+
+    def requests_in_window(self, now: float) -> int:
+        cutoff = now - KEY_QUOTA_WINDOW_SECONDS
+        for times in (self.request_times, self.hedge_times):
+            while times and times[0] < cutoff:
+                times.popleft()
+        return len(self.request_times)
 
 
 GENAI_REQUEST_RETRIES_PER_KEY = 3
@@ -247,6 +285,7 @@ USER_FACING_BUSY_MESSAGE = "目前 Gemini 服務暫時繁忙，系統已自動
 USER_FACING_API_ERROR_MESSAGE = "目前 Gemini API 暫時無法使用，請稍後再試。"
 RECEIVED_REACTION = "👀"
 DONE_REACTION = "✅"
+DROPPED_REACTION = "⏭️"
 SAFE_EXEC_COMMAND_LIMIT = 500
 SAFE_MATH_EXPRESSION_LIMIT = 240
 SAFE_MATH_ABS_LIMIT = 10 ** 12
@@ -325,7 +364,7 @@ AGENT_SKILL_PATHS = (
 )
 
 
-class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
+class OpenAIChat(commands.Cog, AgentRuntimeMixin, MemoryConsolidationMixin, AssistantCommands):
     """A RedBot cog for Google Gemini API integration with advanced features,
     including a layered memory system where the AI decides which memories to store."""
     
@@ -357,7 +396,12 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             "memory_guild_upgrade_min_score": 4,
             "memory_embedding_model": "gemini-embedding-2-preview",
             "memory_embedding_top_k": 6,
+            "memory_embedding_storage": EMBEDDING_FORMAT_FLOAT32,
             "memory_opt_out_user_ids": [],
+            **CONSOLIDATION_GLOBAL_DEFAULTS,
+            **QUEUE_GLOBAL_DEFAULTS,
+            **HEDGING_GLOBAL_DEFAULTS,
+            **TOOL_COMPACTION_GLOBAL_DEFAULTS,
         }
         default_guild = {
             "channels": {},
@@ -367,18 +411,84 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         self.config.register_global(**default_global)
         self.config.register_guild(**default_guild)
 
-        self.queue = asyncio.Queue()
-        self.queue_task = asyncio.create_task(self.process_queue())
+        self.queue = RequestQueue()
+        self.queue_task: Optional[asyncio.Task] = None
         self.executor = ThreadPoolExecutor(max_workers=4)
-        self._async_http = httpx.AsyncClient()
-        self._http_options = types.HttpOptions(httpx_async_client=self._async_http)
+        # HTTP / SDK clients are created by the warm-up task (or on first use), see cog_load.
+        self._async_http = None
+        self._http_options = None
+        self._genai_clients: Dict[str, Any] = {}
+        self._ready = asyncio.Event()
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._warmup_seconds: Optional[float] = None
         self._api_key_lock = asyncio.Lock()
         self._api_key_states: Dict[str, _APIKeyState] = {}
         self._rr_index = 0
+        self._latency = LatencyTracker()
         self._history_locks: Dict[int, asyncio.Lock] = {}
         self._memory_db_lock = asyncio.Lock()
         self._memory_db_exec_lock = asyncio.Lock()
         self._memory_db = None
+        self._embedding_storage: Optional[str] = None
+        self._consolidation_task: Optional[asyncio.Task] = None
+
+    async def cog_load(self):
+        self._warmup_task = asyncio.create_task(self._warm_up())
+        self.queue_task = asyncio.create_task(self.process_queue())
+        self._start_consolidation_task()
+
+    async def _warm_up(self):
+        """
+        Import the heavy SDKs off the event loop, open the memory DB (creating tables/indexes)
+        and pre-create HTTP / Gemini clients. Sets the readiness event even if a step fails,
+        so requests fall back to lazy initialization instead of waiting forever.
+        """
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(preload_all)
+            self._get_async_http()
+            for encoded_key in await self._get_encoded_api_keys():
+                self._get_genai_client(self.decode_key(encoded_key))
+            await self._get_embedding_storage()
+            await self._get_memory_db()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error(f"Error during assistant warm-up: {e}")
+        finally:
+            self._warmup_seconds = time.perf_counter() - started
+            self._ready.set()
+            log.debug("Assistant warm-up finished in %.2fs", self._warmup_seconds)
+
+    def startup_report(self) -> Dict[str, Any]:
+        return {
+            "ready": self._ready.is_set(),
+            "warmup_seconds": self._warmup_seconds,
+            "imports": import_timings(),
+        }
+
+    def _get_async_http(self):
+        if self._async_http is None:
+            httpx = load_httpx()
+            if httpx is None:
+                raise RuntimeError("httpx is not available (missing dependency).")
+            self._async_http = httpx.AsyncClient()
+        return self._async_http
+
+    def _get_genai_client(self, api_key: str):
+        """Returns: (client, types module). Clients are cached per API key and share one HTTP client."""
+        genai, types = load_genai()
+        if genai is None or types is None:
+            raise RuntimeError(
+                "google-genai is not available. Please install/enable the Google GenAI Python SDK (google-genai)."
+            )
+        client = self._genai_clients.get(api_key)
+        if client is None:
+            if self._http_options is None:
+                self._http_options = types.HttpOptions(httpx_async_client=self._get_async_http())
+            client = genai.Client(api_key=api_key, http_options=self._http_options)
+            self._genai_clients[api_key] = client
+        return client, types
     
     def encode_key(self, key: str) -> str:
         return base64.b64encode(key.encode()).decode()
@@ -397,6 +507,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
 
     @staticmethod
     def _is_retryable_error(error: Exception) -> bool:
+        api_exc = load_api_exceptions()
         if api_exc is None:
             return True
 
@@ -530,6 +641,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         operation_name: str,
         max_attempts_per_key: int,
         request_factory: Callable[[str], Awaitable[Any]],
+        hedge: bool = False,
     ) -> Tuple[Any, Optional[Exception]]:
         if not encoded_keys:
             return None, RuntimeError("No API keys configured")
@@ -537,12 +649,26 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         attempts_used = 0
         total_attempts = max(1, len(encoded_keys) * max(1, max_attempts_per_key))
         last_error: Optional[Exception] = None
+        rpm_limit = max(0, self._coerce_int(await self.config.api_key_requests_per_minute(), default=0))
+        hedge_delay = await self._hedge_deadline(operation_name, encoded_keys) if hedge else None
 
         for attempt in range(total_attempts):
             attempts_used = attempt + 1
-            encoded_key, api_key = await self._pick_api_key(encoded_keys)
+            encoded_key, api_key = await self._pick_api_key(encoded_keys, rpm_limit=rpm_limit)
             try:
-                result = await request_factory(api_key)
+                if hedge_delay is not None:
+                    result, encoded_key = await self._run_hedged_request(
+                        encoded_keys,
+                        operation_name=operation_name,
+                        primary=(encoded_key, api_key),
+                        request_factory=request_factory,
+                        delay=hedge_delay,
+                        rpm_limit=rpm_limit,
+                    )
+                else:
+                    started = time.monotonic()
+                    result = await request_factory(api_key)
+                    self._latency.record(operation_name, time.monotonic() - started)
                 await self._mark_key_success(encoded_key)
                 return result, None
             except Exception as e:
@@ -572,9 +698,154 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             log.error("%s failed after %s attempt(s): %s", operation_name, attempts_used, last_error)
         return None, last_error
 
-    async def _pick_api_key(self, encoded_keys: List[str]) -> Tuple[str, str]:
+    async def _hedge_deadline(self, operation_name: str, encoded_keys: List[str]) -> Optional[float]:
+        """Seconds to wait before hedging ``operation_name``, or ``None`` when hedging is off or impossible."""
+        if len(encoded_keys) <= 1 or not await self.config.hedge_enabled():
+            return None
+        return self._latency.deadline(
+            operation_name,
+            pct=max(50.0, min(self._coerce_float(await self.config.hedge_percentile(), default=90.0), 99.9)),
+            min_delay=max(0.1, self._coerce_float(await self.config.hedge_min_delay_seconds(), default=2.0)),
+            max_delay=max(0.1, self._coerce_float(await self.config.hedge_max_delay_seconds(), default=15.0)),
+        )
+
+    async def _run_hedged_call(
+        self,
+        encoded_keys: List[str],
+        *,
+        operation_name: str,
+        primary: Tuple[str, str],
+        request_factory: Callable[[str], Awaitable[Any]],
+    ) -> Any:
         """
-        Round-robin pick with cooldown skipping.
+        Run a single model call on the primary key, hedged on another key when it is slow.
+        Used inside multi-turn requests, where retrying the whole run would repeat every tool call.
+        """
+        delay = await self._hedge_deadline(operation_name, encoded_keys)
+        if delay is None:
+            started = time.monotonic()
+            result = await request_factory(primary[1])
+            self._latency.record(operation_name, time.monotonic() - started)
+            return result
+        rpm_limit = max(0, self._coerce_int(await self.config.api_key_requests_per_minute(), default=0))
+        result, _ = await self._run_hedged_request(
+            encoded_keys,
+            operation_name=operation_name,
+            primary=primary,
+            request_factory=request_factory,
+            delay=delay,
+            rpm_limit=rpm_limit,
+        )
+        return result
+
+    async def _note_key_request(self, encoded_key: str):
+        """Count one more request against a key's per-minute quota (follow-up turns of a run)."""
+        async with self._api_key_lock:
+            self._api_key_states.setdefault(encoded_key, _APIKeyState()).request_times.append(time.monotonic())
+
+    async def _run_hedged_request(
+        self,
+        encoded_keys: List[str],
+        *,
+        operation_name: str,
+        primary: Tuple[str, str],
+        request_factory: Callable[[str], Awaitable[Any]],
+        delay: float,
+        rpm_limit: int,
+    ) -> Tuple[Any, str]:
+        """
+        Run one attempt; if it has not answered after ``delay`` seconds, start a second attempt on a
+        different key and keep whichever finishes first. The loser is cancelled.
+        Returns: (result, encoded_key_that_answered). Raises the primary error if both attempts fail.
+        """
+        primary_key, primary_api_key = primary
+        tasks: Dict[asyncio.Task, Tuple[str, float]] = {}
+
+        def launch(encoded: str, api_key: str) -> asyncio.Task:
+            task = asyncio.create_task(request_factory(api_key))
+            # Retrieve exceptions of losers so they are never reported as unhandled.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            tasks[task] = (encoded, time.monotonic())
+            return task
+
+        primary_task = launch(primary_key, primary_api_key)
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+            if not done:
+                hedge_pick = await self._pick_hedge_key(encoded_keys, exclude=primary_key, rpm_limit=rpm_limit)
+                if hedge_pick is not None:
+                    log.debug("%s exceeded %.1fs; hedging on another key", operation_name, delay)
+                    launch(*hedge_pick)
+
+            pending = set(tasks)
+            primary_error: Optional[BaseException] = None
+            failed: List[Tuple[str, BaseException]] = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    encoded, started = tasks[task]
+                    error = task.exception()
+                    if error is None:
+                        self._latency.record(operation_name, time.monotonic() - started)
+                        if len(tasks) > 1:
+                            self._latency.note_hedge(operation_name, won=task is not primary_task)
+                        for failed_key, failed_error in failed:
+                            if failed_key != encoded:
+                                await self._mark_key_failure(failed_key, failed_error)
+                        return task.result(), encoded
+                    if task is primary_task:
+                        primary_error = error
+                    else:
+                        failed.append((encoded, error))
+
+            if len(tasks) > 1:
+                self._latency.note_hedge(operation_name, won=False)
+            # The caller marks the primary key; only the hedge key is marked here.
+            for failed_key, failed_error in failed:
+                await self._mark_key_failure(failed_key, failed_error)
+            raise primary_error or failed[0][1]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _pick_hedge_key(
+        self, encoded_keys: List[str], *, exclude: str, rpm_limit: int
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Pick a second key for a hedged attempt, or ``None`` when no other key is healthy, within its
+        per-minute quota, and the pool-wide hedge budget (``hedge_max_fraction`` of recent requests) is left.
+        """
+        max_fraction = max(0.0, min(self._coerce_float(await self.config.hedge_max_fraction(), default=0.1), 1.0))
+        now = time.monotonic()
+        async with self._api_key_lock:
+            states = [self._api_key_states.setdefault(encoded, _APIKeyState()) for encoded in encoded_keys]
+            total_requests = sum(state.requests_in_window(now) for state in states)
+            total_hedges = sum(len(state.hedge_times) for state in states)
+            # Always allow a single hedge in a quiet window; beyond that stay within the fraction.
+            if max_fraction <= 0 or total_hedges + 1 > max(1.0, max_fraction * total_requests):
+                return None
+
+            best: Optional[str] = None
+            best_load = 0
+            for encoded, state in zip(encoded_keys, states):
+                if encoded == exclude or state.cooldown_until > now:
+                    continue
+                load = len(state.request_times)
+                if rpm_limit > 0 and load >= rpm_limit:
+                    continue
+                if best is None or load < best_load:
+                    best, best_load = encoded, load
+            if best is None:
+                return None
+            state = self._api_key_states[best]
+            state.request_times.append(now)
+            state.hedge_times.append(now)
+            return best, self.decode_key(best)
+
+    async def _pick_api_key(self, encoded_keys: List[str], *, rpm_limit: int = 0) -> Tuple[str, str]:
+        """
+        Round-robin pick with cooldown and per-minute quota skipping.
         Returns: (encoded_key, decoded_key)
         """
         if not encoded_keys:
@@ -594,12 +865,19 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             for offset in range(len(encoded_keys)):
                 idx = (start + offset) % len(encoded_keys)
                 encoded = encoded_keys[idx]
-                if self._api_key_states[encoded].cooldown_until <= now:
-                    self._rr_index = (idx + 1) % len(encoded_keys)
-                    return encoded, self.decode_key(encoded)
+                state = self._api_key_states[encoded]
+                in_window = state.requests_in_window(now)
+                if state.cooldown_until > now:
+                    continue
+                if rpm_limit > 0 and in_window >= rpm_limit:
+                    continue
+                self._rr_index = (idx + 1) % len(encoded_keys)
+                state.request_times.append(now)
+                return encoded, self.decode_key(encoded)
 
             encoded = encoded_keys[start]
             self._rr_index = (start + 1) % len(encoded_keys)
+            self._api_key_states[encoded].request_times.append(now)
             return encoded, self.decode_key(encoded)
 
     async def _mark_key_success(self, encoded_key: str):
@@ -672,25 +950,19 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             guild = discord.Object(id=guild_id)
         return self.config.guild(guild)
 
+    async def _get_embedding_storage(self) -> str:
+        if self._embedding_storage is None:
+            fmt = str(await self.config.memory_embedding_storage() or EMBEDDING_FORMAT_FLOAT32).lower()
+            self._embedding_storage = fmt if fmt in EMBEDDING_FORMATS else EMBEDDING_FORMAT_FLOAT32
+        return self._embedding_storage
+
     @staticmethod
-    def _embedding_to_blob(values: List[float]) -> bytes:
-        arr = array.array("f", (float(v) for v in values))
-        return arr.tobytes()
+    def _embedding_to_blob(values: List[float], fmt: str = EMBEDDING_FORMAT_FLOAT32) -> bytes:
+        return encode_embedding(values, fmt)
 
     @staticmethod
     def _embedding_from_blob(blob: Any) -> Optional[List[float]]:
-        if not blob:
-            return None
-        if isinstance(blob, memoryview):
-            blob = blob.tobytes()
-        if not isinstance(blob, (bytes, bytearray)):
-            return None
-        arr = array.array("f")
-        try:
-            arr.frombytes(blob)
-        except Exception:
-            return None
-        return arr.tolist()
+        return decode_embedding(blob)
 
     @staticmethod
     def _cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
@@ -707,6 +979,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         return (dot / denom) if denom else 0.0
 
     async def _get_memory_db(self):
+        aiosqlite = load_aiosqlite()
         if aiosqlite is None:
             raise RuntimeError("aiosqlite is not available (missing dependency).")
 
@@ -886,7 +1159,9 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             if retention_days > 0:
                 expires_at = created_at + (float(retention_days) * 86400.0)
 
-            embedding_blob = self._embedding_to_blob(embedding) if embedding else None
+            embedding_blob = (
+                self._embedding_to_blob(embedding, await self._get_embedding_storage()) if embedding else None
+            )
             facts_json = json.dumps(facts, ensure_ascii=False, separators=(",", ":"))
 
             cursor = await db.execute(
@@ -1002,7 +1277,9 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             if retention_days > 0:
                 expires_at = created_at + (float(retention_days) * 86400.0)
 
-            embedding_blob = self._embedding_to_blob(embedding) if embedding else None
+            embedding_blob = (
+                self._embedding_to_blob(embedding, await self._get_embedding_storage()) if embedding else None
+            )
             facts_json = json.dumps(facts, ensure_ascii=False, separators=(",", ":"))
             content_hash = self._guild_memory_content_hash(summary, facts)
 
@@ -1139,6 +1416,106 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             await db.commit()
             return int(cursor.rowcount or 0)
 
+    def _memory_tables(self) -> List[str]:
+        return [
+            table(scope)
+            for scope in ("chat", "agent")
+            for table in (self._user_memory_table, self._guild_memory_table)
+        ]
+
+    async def migrate_embedding_storage(self, fmt: str, *, batch_size: int = 500) -> Dict[str, int]:
+        """
+        Switch the embedding storage format and rewrite every stored embedding into it.
+        Rows are converted in id-ordered batches so chat requests can interleave, then the DB is vacuumed.
+        """
+        fmt = str(fmt or "").lower()
+        if fmt not in EMBEDDING_FORMATS:
+            raise ValueError(f"Unknown embedding storage format: {fmt}")
+
+        # New rows are written in the target format from now on.
+        await self.config.memory_embedding_storage.set(fmt)
+        self._embedding_storage = fmt
+
+        stats = {"rows": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0}
+        for table_name in self._memory_tables():
+            last_id = 0
+            while True:
+                async with self._memory_db_exec_lock:
+                    db = await self._get_memory_db()
+                    async with db.execute(
+                        f"""
+                        SELECT id, embedding FROM {table_name}
+                        WHERE id > ? AND embedding IS NOT NULL
+                        ORDER BY id
+                        LIMIT ?
+                        """,
+                        (last_id, batch_size),
+                    ) as cursor:
+                        rows = await cursor.fetchall()
+                    if not rows:
+                        break
+
+                    updates: List[Tuple[bytes, int]] = []
+                    for mem_id, blob in rows:
+                        stats["rows"] += 1
+                        stats["bytes_before"] += len(blob)
+                        if blob_format(blob) == fmt:
+                            stats["bytes_after"] += len(blob)
+                            continue
+                        values = decode_embedding(blob)
+                        if not values:
+                            stats["bytes_after"] += len(blob)
+                            continue
+                        new_blob = encode_embedding(values, fmt)
+                        stats["bytes_after"] += len(new_blob)
+                        updates.append((new_blob, int(mem_id)))
+
+                    if updates:
+                        await db.executemany(f"UPDATE {table_name} SET embedding = ? WHERE id = ?", updates)
+                        await db.commit()
+                        stats["converted"] += len(updates)
+                    last_id = int(rows[-1][0])
+                await asyncio.sleep(0)
+
+        if stats["converted"]:
+            async with self._memory_db_exec_lock:
+                db = await self._get_memory_db()
+                await db.execute("VACUUM")
+        return stats
+
+    async def benchmark_embedding_storage(self, *, sample: int = 500, top_k: int = 6) -> List[Dict[str, Any]]:
+        """
+        Measure recall@k and score error of each storage format against float32,
+        using a sample of stored embeddings as both corpus and queries.
+        """
+        vectors: List[List[float]] = []
+        per_table = max(1, sample // len(self._memory_tables()))
+        async with self._memory_db_exec_lock:
+            db = await self._get_memory_db()
+            for table_name in self._memory_tables():
+                async with db.execute(
+                    f"SELECT embedding FROM {table_name} WHERE embedding IS NOT NULL ORDER BY id DESC LIMIT ?",
+                    (per_table,),
+                ) as cursor:
+                    rows = await cursor.fetchall()
+                for (blob,) in rows:
+                    values = decode_embedding(blob)
+                    if values:
+                        vectors.append(values)
+
+        dims = max(set(map(len, vectors)), key=[len(v) for v in vectors].count) if vectors else 0
+        vectors = [v for v in vectors if len(v) == dims]
+        loop = asyncio.get_running_loop()
+        results: List[Dict[str, Any]] = []
+        for fmt in EMBEDDING_FORMATS:
+            started = time.perf_counter()
+            result = await loop.run_in_executor(
+                self.executor, lambda f=fmt: recall_benchmark(vectors, f, top_k=top_k)
+            )
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            results.append(result)
+        return results
+
     def _prune_chat_history(
         self,
         history: List[Dict[str, Any]],
@@ -1593,6 +1970,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             encoded_keys,
             operation_name="Gemini request",
             max_attempts_per_key=GENAI_REQUEST_RETRIES_PER_KEY,
+            # each model turn is hedged on its own inside _genai_request, not the whole tool loop
             request_factory=lambda api_key: self._genai_request(
                 api_key,
                 model,
@@ -1600,6 +1978,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
                 guild_history,
                 formatted_user_input,
                 agent_mode=agent_mode,
+                hedge_keys=encoded_keys,
             ),
         )
         if last_error is None:
@@ -1612,6 +1991,9 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         """Perform a web search using DuckDuckGo"""
         try:
             # duckduckgo_search is synchronous; run it in a thread to avoid blocking the event loop.
+            DDGS = load_ddgs()
+            if DDGS is None:
+                return "(Search failed: ddgs is not available)"
             results = await asyncio.to_thread(lambda: list(DDGS().text(query, max_results=6)))
             if not results:
                 return "(No search results found)"
@@ -1624,7 +2006,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             log.error(f"Web search error: {e}")
             return f"(Search failed: {e})"
 
-    async def _web_fetch(self, url: str) -> str:
+    async def _web_fetch(self, url: str, *, char_limit: int = 12000) -> str:
         """Fetch a webpage and extract readable text."""
         raw_url = str(url or "").strip()
         if not raw_url:
@@ -1633,7 +2015,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             return "(Fetch failed: URL must start with http:// or https://)"
 
         try:
-            response = await self._async_http.get(
+            response = await self._get_async_http().get(
                 raw_url,
                 follow_redirects=True,
                 timeout=20.0,
@@ -1662,7 +2044,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
                 lines = [re.sub(r"\s+", " ", line).strip() for line in text.splitlines()]
                 lines = [line for line in lines if line]
                 body = "\n".join(lines[:200])
-                body = body[:12000]
+                body = body[:char_limit]
                 if title:
                     return f"URL: {final_url}\nTitle: {title}\nContent:\n{body}"
                 return f"URL: {final_url}\nContent:\n{body}"
@@ -1670,11 +2052,78 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             text = text.strip()
             if not text:
                 return f"URL: {final_url}\n(Content is empty)"
-            return f"URL: {final_url}\nContent-Type: {content_type or 'unknown'}\nContent:\n{text[:12000]}"
+            return f"URL: {final_url}\nContent-Type: {content_type or 'unknown'}\nContent:\n{text[:char_limit]}"
         except Exception as e:
             log.error(f"Web fetch error for {raw_url}: {e}")
             return f"(Fetch failed: {e})"
 
+    @staticmethod
+    def _share_char_budget(lengths: List[int], budget: int) -> List[int]:
+        """Split a character budget fairly: short pages keep their full text, the rest share what is left."""
+        allowance = [0] * len(lengths)
+        remaining = budget
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        for position, idx in enumerate(order):
+            share = remaining // (len(order) - position)
+            allowance[idx] = min(lengths[idx], share)
+            remaining -= allowance[idx]
+        return allowance
+
+    async def _web_fetch_many(self, urls: Any) -> Tuple[str, List[str]]:
+        """
+        Fetch several pages concurrently (limited per host, bounded by an overall deadline)
+        and return each page's text within a shared character budget, with the URLs that were
+        actually fetched (skipped, late and failed ones excluded).
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        cleaned: List[str] = []
+        for url in urls or []:
+            url = str(url or "").strip()
+            if url and url not in cleaned:
+                cleaned.append(url)
+        if not cleaned:
+            return "(Fetch failed: no URLs given)", []
+        skipped = cleaned[WEB_FETCH_MANY_MAX_URLS:]
+        cleaned = cleaned[:WEB_FETCH_MANY_MAX_URLS]
+
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+
+        async def fetch_one(url: str) -> str:
+            host = (urllib.parse.urlsplit(url).hostname or "").lower()
+            limit = host_limits.setdefault(host, asyncio.Semaphore(WEB_FETCH_MANY_PER_HOST))
+            async with limit:
+                return await self._web_fetch(url, char_limit=WEB_FETCH_MANY_CHAR_BUDGET)
+
+        tasks = [asyncio.create_task(fetch_one(url)) for url in cleaned]
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=WEB_FETCH_MANY_DEADLINE_SECONDS)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        results = [
+            f"(Fetch failed: not finished within {WEB_FETCH_MANY_DEADLINE_SECONDS:.0f}s)"
+            if task in pending
+            else task.result()
+            for task in tasks
+        ]
+        fetched = [
+            url
+            for url, task, result in zip(cleaned, tasks, results)
+            if task not in pending and not result.startswith("(Fetch failed")
+        ]
+        allowance = self._share_char_budget([len(r) for r in results], WEB_FETCH_MANY_CHAR_BUDGET)
+        sections = []
+        for index, (url, result, limit) in enumerate(zip(cleaned, results, allowance), start=1):
+            if len(result) > limit:
+                result = result[: max(0, limit - 3)] + "..."
+            sections.append(f"=== [{index}] {url} ===\n{result}")
+        if skipped:
+            sections.append(f"(Skipped {len(skipped)} URL(s): at most {WEB_FETCH_MANY_MAX_URLS} per call)")
+        return "\n\n".join(sections), fetched
+
     async def _load_agent_skills_text(self) -> str:
         sections: List[str] = []
         for skill_path in AGENT_SKILL_PATHS:
@@ -1999,14 +2448,14 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         prompt: str, guild_history: str, user_input: str,
         *,
         agent_mode: bool = False,
+        hedge_keys: Optional[List[str]] = None,
     ) -> Optional[str]:
-        """Async call to Google Gemini API using google-genai with function calling for search."""
-        if genai is None or types is None:
-            raise RuntimeError(
-                "google-genai is not available. Please install/enable the Google GenAI Python SDK (google-genai)."
-            )
-
-        client = genai.Client(api_key=api_key, http_options=self._http_options)
+        """
+        Async call to Google Gemini API using google-genai with function calling for search.
+        With ``hedge_keys``, each model turn may be hedged on another key of the pool.
+        """
+        _, types = self._get_genai_client(api_key)
+        primary = (self.encode_key(api_key), api_key)
         content = (
             "Chat histories:\n"
             + (guild_history or "(none)")
@@ -2023,17 +2472,61 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         allowed_tool_names = {search_tool_name, WEB_FETCH_TOOL_NAME}
         if agent_mode:
             allowed_tool_names.add(SAFE_EXEC_TOOL_NAME)
+            allowed_tool_names.add(WEB_FETCH_MANY_TOOL_NAME)
+
+        # The conversation is kept here (instead of a chat session) so older tool outputs can be
+        # compacted before each turn is resent.
+        gen_config = types.GenerateContentConfig(
+            system_instruction=prompt,
+            tools=tools,
+            temperature=0.7,
+        )
+        contents: List[Any] = [types.Content(role="user", parts=[types.Part.from_text(text=content)])]
+        compactor = ToolOutputCompactor(
+            user_query=user_input,
+            max_chars=self._coerce_int(await self.config.agent_tool_compaction_chars(), default=16000),
+            summary_chars=self._coerce_int(await self.config.agent_tool_summary_chars(), default=1200),
+        )
 
-        chat = client.aio.chats.create(
-            model=model,
-            config=types.GenerateContentConfig(
-                system_instruction=prompt,
-                tools=tools,
-                temperature=0.7,
+        turns = 0
+
+        async def generate():
+            nonlocal turns
+            turns += 1
+            if turns > 1:
+                # the pool only counted the first turn against the key's quota
+                await self._note_key_request(primary[0])
+            turn_contents = list(contents)
+
+            def call(key: str):
+                client, _ = self._get_genai_client(key)
+                return client.aio.models.generate_content(model=model, contents=turn_contents, config=gen_config)
+
+            # first turns and tool follow-ups have different latencies, keep separate percentiles
+            result = await self._run_hedged_call(
+                hedge_keys or [primary[0]],
+                operation_name="Gemini turn" if turns == 1 else "Gemini tool turn",
+                primary=primary,
+                request_factory=call,
             )
-        )
-        
-        response = await chat.send_message(content)
+            candidates = getattr(result, "candidates", None) or []
+            model_content = getattr(candidates[0], "content", None) if candidates else None
+            if model_content is not None:
+                contents.append(model_content)
+            return result
+
+        async def send_tool_result(name: str, payload: Dict[str, Any]):
+            contents.append(
+                types.Content(role="user", parts=[types.Part.from_function_response(name=name, response=payload)])
+            )
+            for index, tool_name, compacted in compactor.plan():
+                contents[index] = types.Content(
+                    role="user",
+                    parts=[types.Part.from_function_response(name=tool_name, response=compacted)],
+                )
+            return await generate()
+
+        response = await generate()
 
         tool_calls_used = 0
         while True:
@@ -2049,12 +2542,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
                         f"(Web tool call limit reached: {search_cap}. Continue without further web access.)",
                         source=fc.name,
                     )
-                    response = await chat.send_message(
-                        types.Part.from_function_response(
-                            name=fc.name,
-                            response=limit_payload,
-                        )
-                    )
+                    response = await send_tool_result(fc.name, limit_payload)
                     limit_response_sent = True
                     break
                 log.warning(
@@ -2068,34 +2556,60 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
 
             handled = False
             for fc in function_calls:
+                args = fc.args or {}
+                tool_query = ""
+                fetched_urls: List[str] = []
                 if fc.name == search_tool_name:
-                    query = str((fc.args or {}).get("query", "")).strip()
+                    query = str(args.get("query", "")).strip()
+                    tool_query = query
                     log.debug(f"Executing custom web search for: {query}")
                     result_payload = await self._search_web(query) if query else "(Search query is empty)"
                 elif fc.name == WEB_FETCH_TOOL_NAME:
-                    url = str((fc.args or {}).get("url", "")).strip()
-                    log.debug(f"Executing web fetch for: {url}")
-                    result_payload = await self._web_fetch(url)
+                    url = str(args.get("url", "")).strip()
+                    seen = compactor.seen(url) if url else None
+                    if seen is not None:
+                        result_payload = f"(Already fetched {url} in tool output #{seen}; use that result.)"
+                    else:
+                        log.debug(f"Executing web fetch for: {url}")
+                        result_payload = await self._web_fetch(url)
+                        if not result_payload.startswith("(Fetch failed"):
+                            fetched_urls = [url]
+                elif fc.name == WEB_FETCH_MANY_TOOL_NAME and agent_mode:
+                    urls = args.get("urls") or []
+                    if isinstance(urls, str):
+                        urls = [urls]
+                    fresh, duplicates = compactor.split_seen(str(u or "").strip() for u in urls)
+                    log.debug(f"Executing batch web fetch for: {fresh}")
+                    parts = []
+                    if fresh:
+                        fetched_text, fetched_urls = await self._web_fetch_many(fresh)
+                        parts.append(fetched_text)
+                    parts.extend(
+                        f"(Already fetched {url} in tool output #{number}; use that result.)"
+                        for url, number in duplicates
+                    )
+                    result_payload = "\n\n".join(parts) or "(Fetch failed: no URLs given)"
                 elif fc.name == SAFE_EXEC_TOOL_NAME and agent_mode:
-                    log.debug(f"Executing safe exec action: {(fc.args or {}).get('action')}")
-                    result_payload = await self._safe_exec(fc.args or {})
+                    log.debug(f"Executing safe exec action: {args.get('action')}")
+                    result_payload = await self._safe_exec(args)
                 else:
                     continue
 
                 tool_calls_used += 1
                 tool_payload = self._build_tool_response_payload(result_payload, source=fc.name)
-                response = await chat.send_message(
-                    types.Part.from_function_response(
-                        name=fc.name,
-                        response=tool_payload,
-                    )
+                tool_payload["tool_output_id"] = compactor.record(
+                    len(contents), fc.name, tool_payload, query=tool_query, urls=fetched_urls
                 )
+                response = await send_tool_result(fc.name, tool_payload)
                 handled = True
                 break
 
             if not handled:
                 break
 
+        if compactor.compacted_chars:
+            log.debug("Compacted %s characters of tool output in this run", compactor.compacted_chars)
+
         text = getattr(response, "text", None)
         if text:
             return text
@@ -2108,22 +2622,52 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
                 return getattr(parts[0], "text", None)
         return None
 
+    async def _apply_queue_settings(self):
+        global_settings = await self.config.all()
+        try:
+            self.queue.configure(
+                max_size=self._coerce_int(global_settings.get("queue_max_size"), default=200),
+                guild_max_pending=self._coerce_int(global_settings.get("queue_guild_max_pending"), default=50),
+                user_max_pending=self._coerce_int(global_settings.get("queue_user_max_pending"), default=3),
+                overflow_policy=str(global_settings.get("queue_overflow_policy") or "drop_oldest"),
+                max_age_seconds=self._coerce_float(global_settings.get("queue_max_age_seconds"), default=120.0),
+            )
+        except ValueError as e:
+            log.error(f"Invalid queue settings: {e}")
+
+    async def _enqueue_request(self, request: AgentChatRequest):
+        status, dropped = self.queue.put(request)
+        for dropped_request in dropped:
+            await self._mark_request_dropped(dropped_request)
+        if status == QUEUE_STATUS_REJECTED:
+            log.debug(
+                "Queue full; rejected request from user %s in guild %s",
+                request.message.author.id,
+                request.message.guild.id,
+            )
+            await self._mark_message_dropped(request.message)
+            return
+        await self._mark_message_received(request.message)
+        if status == QUEUE_STATUS_COALESCED:
+            log.debug("Coalesced request from user %s into a pending request", request.message.author.id)
+
     async def process_queue(self):
         """Background task: process messages in queue"""
+        # Requests that arrive during warm-up simply stay queued until the cog is ready.
+        await self._ready.wait()
         delay = await self.config.default_delay()
+        await self._apply_queue_settings()
         while True:
             request: Optional[AgentChatRequest] = None
             try:
-                item = await self.queue.get()
-                if item is None:
+                request = await self.queue.get()
+                if request is None:
                     break
-                if isinstance(item, AgentChatRequest):
-                    request = item
-                else:
-                    request = AgentChatRequest(
-                        message=item,
-                        user_input=str(getattr(item, "content", "") or "").strip(),
-                    )
+                if self.queue.is_stale(request):
+                    # Too old to be useful; do not spend any model work on it.
+                    stale_request, request = request, None
+                    await self._mark_request_dropped(stale_request)
+                    continue
 
                 response = await self.query_genai(
                     request.message,
@@ -2146,6 +2690,8 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
                 log.error(f"Error processing queue: {e}")
             finally:
                 if request is not None:
+                    for merged_message in request.merged_messages:
+                        await self._mark_message_done(merged_message)
                     await self._mark_message_done(request.message)
 
     async def _mark_message_received(self, message: discord.Message):
@@ -2154,6 +2700,22 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         except (discord.Forbidden, discord.NotFound, discord.HTTPException) as e:
             log.debug(f"Unable to add received reaction: {e}")
 
+    async def _mark_message_dropped(self, message: discord.Message):
+        try:
+            if self.bot.user is not None:
+                await message.remove_reaction(RECEIVED_REACTION, self.bot.user)
+        except (discord.Forbidden, discord.NotFound, discord.HTTPException) as e:
+            log.debug(f"Unable to remove received reaction: {e}")
+
+        try:
+            await message.add_reaction(DROPPED_REACTION)
+        except (discord.Forbidden, discord.NotFound, discord.HTTPException) as e:
+            log.debug(f"Unable to add dropped reaction: {e}")
+
+    async def _mark_request_dropped(self, request: AgentChatRequest):
+        for message in (*request.merged_messages, request.message):
+            await self._mark_message_dropped(message)
+
     async def _mark_message_done(self, message: discord.Message):
         try:
             if self.bot.user is not None:
@@ -2365,18 +2927,17 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         if str(message.channel.id) in channels:
             user_input = str(message.content or "").strip()
             if user_input:
-                await self._mark_message_received(message)
-                await self.queue.put(
-                    AgentChatRequest(message=message, user_input=user_input, agent_mode=True)
-                )
+                request = AgentChatRequest(message=message, user_input=user_input, agent_mode=True)
+                if self._is_direct_request(message):
+                    request.priority = REQUEST_PRIORITY_DIRECT
+                await self._enqueue_request(request)
             return
 
         request = await self._build_agent_request(message, config)
         if request is None:
             return
 
-        await self._mark_message_received(message)
-        await self.queue.put(request)
+        await self._enqueue_request(request)
 
     async def load_chat_history(self, guild_id: int, *, scope: str = "chat") -> List[Dict]:
         """Asynchronously load chat history for specified guild"""
@@ -2401,6 +2962,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
             encoded_keys,
             operation_name="Gemini embedding",
             max_attempts_per_key=EMBED_RETRIES_PER_KEY,
+            hedge=True,
             request_factory=lambda api_key: self._embed_text(
                 api_key,
                 embed_model,
@@ -2410,14 +2972,10 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         return result
 
     async def _embed_text(self, api_key: str, model: str, text: str) -> Optional[List[float]]:
-        if genai is None or types is None:
-            raise RuntimeError(
-                "google-genai is not available. Please install/enable the Google GenAI Python SDK (google-genai)."
-            )
         if not text.strip():
             return None
 
-        client = genai.Client(api_key=api_key, http_options=self._http_options)
+        client, _ = self._get_genai_client(api_key)
         response = await client.aio.models.embed_content(model=model, contents=text)
         embeddings = getattr(response, "embeddings", None) or []
         if not embeddings:
@@ -2596,13 +3154,13 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
         def is_memory(entry: Dict[str, Any]) -> bool:
             return kind(entry) == "memory"
 
+        # Normalize the query once and score against the stored (possibly quantized) components directly.
+        query_unit = unit_vector(user_input_embedding) if user_input_embedding else None
+
         def similarity(entry: Dict[str, Any]) -> float:
-            if not user_input_embedding:
-                return 0.0
-            emb = self._embedding_from_blob(entry.get("embedding"))
-            if not emb:
+            if query_unit is None:
                 return 0.0
-            return self._cosine_similarity(user_input_embedding, emb)
+            return blob_cosine(query_unit, entry.get("embedding"))
 
         short_term_cap = (
             max(1, short_term_max_records) if short_term_max_records > 0 else max(1, max_records // 2)
@@ -2773,12 +3331,7 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
     async def _analyze_memory_all(self, api_key: str, model: str,
                                      user_message: str, bot_response: str,
                                      long_term_enabled: bool, guild_long_term_enabled: bool) -> Dict[str, Any]:
-        if genai is None or types is None:
-            raise RuntimeError(
-                "google-genai is not available. Please install/enable the Google GenAI Python SDK (google-genai)."
-            )
-
-        client = genai.Client(api_key=api_key, http_options=self._http_options)
+        client, types = self._get_genai_client(api_key)
         
         system_instruction = f"""
 你是「AI 記憶總管」，負責評估使用者對話的記憶價值，並在有價值時一併萃取適合長期保存的資訊。請輸出結構化的 JSON 資料。
@@ -2829,6 +3382,10 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
 
     async def cog_unload(self):
         """Stop background tasks when Cog is unloaded"""
+        self.queue.close()
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        await self._stop_consolidation_task()
         if self.queue_task and not self.queue_task.done():
             # 取消隊列任務而不是等待它完成
             self.queue_task.cancel()
@@ -2838,15 +3395,14 @@ class OpenAIChat(commands.Cog, AgentRuntimeMixin, AssistantCommands):
                 pass
         
         # 清空隊列中的待處理消息
-        while not self.queue.empty():
-            try:
-                self.queue.get_nowait()
-            except asyncio.QueueEmpty:
-                break
+        self.queue.drain()
         
         self.executor.shutdown(wait=False)
+        self._genai_clients.clear()
         try:
-            await self._async_http.aclose()
+            if self._async_http is not None:
+                await self._async_http.aclose()
+                self._async_http = None
         except Exception:
             pass
         try:
@@ -12,6 +12,8 @@ from .agent import (
     send_agent_status,
     set_agent_mention_trigger,
 )
+from .embeddings import EMBEDDING_FORMATS
+from .request_queue import QUEUE_OVERFLOW_POLICIES
 
 log = logging.getLogger("red.BadwolfCogs.c_assistant")
 
@@ -199,6 +201,29 @@ class AssistantCommands():
             return
         await set_agent_mention_trigger(self.bot, ctx, value)
 
+    @agent_group.command(name="compaction")
+    @commands.is_owner()
+    async def agent_compaction(self, ctx: commands.Context, max_chars: int = None, summary_chars: int = None):
+        """設定或查看工具輸出壓縮（全域）：超過 max_chars 後，較舊的工具輸出改為 summary_chars 的摘要（0 = 停用）。"""
+        conf = self.bot.get_cog("OpenAIChat").config
+        if max_chars is None:
+            await ctx.send(
+                "工具輸出壓縮設定：\n"
+                f"- max_chars: {await conf.agent_tool_compaction_chars()} (0 = 停用)\n"
+                f"- summary_chars: {await conf.agent_tool_summary_chars()}"
+            )
+            return
+        if max_chars < 0:
+            await ctx.send("max_chars 必須 >= 0。")
+            return
+        if summary_chars is not None and summary_chars < 200:
+            await ctx.send("summary_chars 至少 200。")
+            return
+        await conf.agent_tool_compaction_chars.set(max_chars)
+        if summary_chars is not None:
+            await conf.agent_tool_summary_chars.set(summary_chars)
+        await ctx.send(f"已更新工具輸出壓縮：max_chars = {max_chars}" + (f"、summary_chars = {summary_chars}" if summary_chars is not None else ""))
+
     @openai.command(name="listagentguilds")
     @commands.is_owner()
     async def listagentguilds(self, ctx: commands.Context):
@@ -232,7 +257,13 @@ class AssistantCommands():
         embedding_model = await conf.memory_embedding_model()
         embedding_top_k = await conf.memory_embedding_top_k()
         guild_embedding_top_k = await conf.memory_guild_embedding_top_k()
+        embedding_storage = await conf.memory_embedding_storage()
         opt_out_ids = await conf.memory_opt_out_user_ids()
+        consolidation_enabled = await conf.memory_consolidation_enabled()
+        consolidation_interval_seconds = await conf.memory_consolidation_interval_seconds()
+        consolidation_similarity = await conf.memory_consolidation_similarity()
+        consolidation_cpu_budget = await conf.memory_consolidation_cpu_budget()
+        consolidation_scan_limit = await conf.memory_consolidation_scan_limit()
 
         await ctx.send(
             "記憶系統設定：\n"
@@ -256,7 +287,13 @@ class AssistantCommands():
             f"- embedding_model: {embedding_model}\n"
             f"- embedding_top_k: {embedding_top_k}\n"
             f"- guild_embedding_top_k: {guild_embedding_top_k}\n"
+            f"- embedding_storage: {embedding_storage}（以 `[p]openai migrateembeddings` 變更）\n"
             f"- opt_out_users: {len(opt_out_ids) if isinstance(opt_out_ids, list) else 0}\n"
+            f"- consolidation_enabled: {consolidation_enabled}\n"
+            f"- consolidation_interval_seconds: {consolidation_interval_seconds}\n"
+            f"- consolidation_similarity: {consolidation_similarity}\n"
+            f"- consolidation_cpu_budget: {consolidation_cpu_budget} (0.01~1)\n"
+            f"- consolidation_scan_limit: {consolidation_scan_limit}\n"
             "\n"
             "設定方式：`[p]openai setmemory <key> <value>`"
         )
@@ -290,6 +327,11 @@ class AssistantCommands():
             "embedding_model": ("memory_embedding_model", "str"),
             "embedding_top_k": ("memory_embedding_top_k", "int"),
             "guild_embedding_top_k": ("memory_guild_embedding_top_k", "int"),
+            "consolidation_enabled": ("memory_consolidation_enabled", "bool"),
+            "consolidation_interval_seconds": ("memory_consolidation_interval_seconds", "int"),
+            "consolidation_similarity": ("memory_consolidation_similarity", "float"),
+            "consolidation_cpu_budget": ("memory_consolidation_cpu_budget", "float"),
+            "consolidation_scan_limit": ("memory_consolidation_scan_limit", "int"),
         }
 
         field_info = key_map.get(key)
@@ -318,6 +360,12 @@ class AssistantCommands():
             except ValueError:
                 await ctx.send("此 key 需要整數 value。")
                 return
+        elif kind == "float":
+            try:
+                parsed_value = float(raw_value)
+            except ValueError:
+                await ctx.send("此 key 需要數字 value。")
+                return
         elif kind == "bool":
             parsed_value = parse_bool(raw_value)
             if parsed_value is None:
@@ -338,6 +386,15 @@ class AssistantCommands():
         if field == "memory_guild_upgrade_min_score" and not (0 <= int(parsed_value) <= 5):
             await ctx.send("guild_upgrade_min_score 必須在 0~5。")
             return
+        if field == "memory_consolidation_similarity" and not (0.5 <= parsed_value <= 1.0):
+            await ctx.send("consolidation_similarity 必須在 0.5~1。")
+            return
+        if field == "memory_consolidation_cpu_budget" and not (0.01 <= parsed_value <= 1.0):
+            await ctx.send("consolidation_cpu_budget 必須在 0.01~1。")
+            return
+        if field == "memory_consolidation_interval_seconds" and int(parsed_value) < 300:
+            await ctx.send("consolidation_interval_seconds 至少 300。")
+            return
         if field == "memory_max_field_chars" and int(parsed_value) < 80:
             await ctx.send("max_field_chars 建議至少 80。")
             return
@@ -356,6 +413,7 @@ class AssistantCommands():
             "memory_guild_long_term_fetch_limit",
             "memory_embedding_top_k",
             "memory_guild_embedding_top_k",
+            "memory_consolidation_scan_limit",
         ) and kind == "int" and int(parsed_value) < 0:
             await ctx.send(f"{key} 必須 >= 0。")
             return
@@ -363,6 +421,81 @@ class AssistantCommands():
         await getattr(conf, field).set(parsed_value)
         await ctx.send(f"已更新 `{key}` = {parsed_value}")
 
+    @openai.command(name="consolidatememory")
+    @commands.is_owner()
+    async def consolidatememory(self, ctx: commands.Context, scope: str = "guild"):
+        """立即合併近似重複的長期記憶（scope: guild = 此伺服器、all = 全部）。"""
+        cog = self.bot.get_cog("OpenAIChat")
+        scope = (scope or "").strip().lower()
+        if scope not in ("guild", "all"):
+            await ctx.send("scope 必須是 guild 或 all。")
+            return
+        if scope == "guild" and ctx.guild is None:
+            await ctx.send("請在伺服器內使用，或指定 scope 為 all。")
+            return
+
+        async with ctx.typing():
+            try:
+                stats = await cog.consolidate_long_term_memories(
+                    guild_id=ctx.guild.id if scope == "guild" else None
+                )
+            except Exception as e:
+                await ctx.send(f"合併失敗：{e}")
+                return
+        await ctx.send(
+            f"記憶合併完成：檢查 {stats.get('groups', 0)} 組、合併 {stats.get('clusters', 0)} 群"
+            f"（共 {stats.get('merged_rows', 0)} 筆原始記憶）。"
+        )
+
+    @openai.command(name="migrateembeddings")
+    @commands.is_owner()
+    async def migrateembeddings(self, ctx: commands.Context, fmt: str):
+        """切換長期記憶 embedding 的儲存格式並改寫既有資料（float32 / float16 / int8）。"""
+        cog = self.bot.get_cog("OpenAIChat")
+        fmt = (fmt or "").strip().lower()
+        if fmt not in EMBEDDING_FORMATS:
+            await ctx.send("格式必須是：" + " / ".join(EMBEDDING_FORMATS))
+            return
+
+        async with ctx.typing():
+            try:
+                stats = await cog.migrate_embedding_storage(fmt)
+            except Exception as e:
+                await ctx.send(f"轉換失敗：{e}")
+                return
+        before = stats.get("bytes_before", 0)
+        after = stats.get("bytes_after", 0)
+        ratio = f"{before / after:.2f}x" if after else "-"
+        await ctx.send(
+            f"已切換為 `{fmt}`：檢查 {stats.get('rows', 0)} 筆、改寫 {stats.get('converted', 0)} 筆；"
+            f"embedding 大小 {before} → {after} bytes（{ratio}）。"
+        )
+
+    @openai.command(name="benchembeddings")
+    @commands.is_owner()
+    async def benchembeddings(self, ctx: commands.Context, sample: int = 500, top_k: int = 6):
+        """以已儲存的 embedding 比較各儲存格式與 float32 的 recall@k。"""
+        cog = self.bot.get_cog("OpenAIChat")
+        sample = max(10, min(sample, 5000))
+        top_k = max(1, min(top_k, 50))
+
+        async with ctx.typing():
+            try:
+                results = await cog.benchmark_embedding_storage(sample=sample, top_k=top_k)
+            except Exception as e:
+                await ctx.send(f"測試失敗：{e}")
+                return
+        if not results or not results[0].get("vectors"):
+            await ctx.send("沒有可用的 embedding 資料。")
+            return
+        lines = [f"Embedding 儲存格式測試（{results[0]['vectors']} 筆，recall@{top_k}）："]
+        for r in results:
+            lines.append(
+                f"- {r['format']}: recall {r['recall']:.3f}、平均分數誤差 {r['score_error']:.5f}、"
+                f"大小 {r['size_ratio']:.2f}x 較小、耗時 {r['seconds']}s"
+            )
+        await ctx.send("\n".join(lines))
+
     @openai.command(name="optout")
     async def optout(self, ctx: commands.Context):
         """使用者選擇退出記憶系統（不再儲存你的對話/記憶）。"""
@@ -457,6 +590,161 @@ class AssistantCommands():
             return
         await ctx.send(f"已清空 guild memory，共刪除 {removed} 筆。")
 
+    @openai.command(name="queue")
+    @commands.is_owner()
+    async def queue_settings(self, ctx: commands.Context):
+        """顯示目前的請求佇列設定與狀態。"""
+        cog = self.bot.get_cog("OpenAIChat")
+        conf = cog.config
+        queue = cog.queue
+
+        await ctx.send(
+            "請求佇列設定：\n"
+            f"- max_size: {await conf.queue_max_size()} (0 = 不限制)\n"
+            f"- guild_max_pending: {await conf.queue_guild_max_pending()} (0 = 不限制)\n"
+            f"- user_max_pending: {await conf.queue_user_max_pending()} (0 = 不限制)\n"
+            f"- overflow_policy: {await conf.queue_overflow_policy()} (drop_oldest / coalesce / reject)\n"
+            f"- max_age_seconds: {await conf.queue_max_age_seconds()} (0 = 不丟棄過期請求)\n"
+            "\n"
+            f"目前待處理：全域 {len(queue)} 筆、此伺服器 {queue.pending_for_guild(ctx.guild.id) if ctx.guild else 0} 筆\n"
+            "設定方式：`[p]openai setqueue <key> <value>`"
+        )
+
+    @openai.command(name="setqueue")
+    @commands.is_owner()
+    async def setqueue(self, ctx: commands.Context, key: str, *, value: str):
+        """調整請求佇列設定（僅限機器人擁有者）。例如：`[p]openai setqueue user_max_pending 3`"""
+        cog = self.bot.get_cog("OpenAIChat")
+        conf = cog.config
+
+        key = (key or "").strip().lower()
+        key_map = {
+            "max_size": "queue_max_size",
+            "guild_max_pending": "queue_guild_max_pending",
+            "user_max_pending": "queue_user_max_pending",
+            "overflow_policy": "queue_overflow_policy",
+            "max_age_seconds": "queue_max_age_seconds",
+        }
+        field = key_map.get(key)
+        if not field:
+            await ctx.send("不支援的 key。可用 key：\n" + "\n".join(f"- {k}" for k in key_map.keys()))
+            return
+
+        raw_value = (value or "").strip().lower()
+        if field == "queue_overflow_policy":
+            if raw_value not in QUEUE_OVERFLOW_POLICIES:
+                await ctx.send("overflow_policy 必須是：" + ", ".join(QUEUE_OVERFLOW_POLICIES))
+                return
+            parsed_value = raw_value
+        else:
+            try:
+                parsed_value = int(raw_value)
+            except ValueError:
+                await ctx.send("此 key 需要整數 value。")
+                return
+            if parsed_value < 0:
+                await ctx.send(f"{key} 必須 >= 0。")
+                return
+
+        await getattr(conf, field).set(parsed_value)
+        await cog._apply_queue_settings()
+        await ctx.send(f"已更新 `{key}` = {parsed_value}")
+
+    @openai.command(name="hedge")
+    @commands.is_owner()
+    async def hedge_settings(self, ctx: commands.Context):
+        """顯示模型請求的 hedging 設定與延遲統計。"""
+        cog = self.bot.get_cog("OpenAIChat")
+        conf = cog.config
+
+        lines = [
+            "Hedging 設定：",
+            f"- enabled: {await conf.hedge_enabled()}",
+            f"- percentile: {await conf.hedge_percentile()}（以此百分位延遲作為啟動第二次請求的時限）",
+            f"- min_delay_seconds: {await conf.hedge_min_delay_seconds()}",
+            f"- max_delay_seconds: {await conf.hedge_max_delay_seconds()}（樣本不足時使用）",
+            f"- max_fraction: {await conf.hedge_max_fraction()}（每分鐘 hedging 請求占比上限）",
+            f"- key_rpm: {await conf.api_key_requests_per_minute()}（每把 key 每分鐘請求上限，0 = 不限制）",
+        ]
+        stats = cog._latency.summary()
+        if stats:
+            lines.append("")
+            lines.append("延遲統計：")
+            for operation, row in stats.items():
+                lines.append(
+                    f"- {operation}: {row['samples']} 筆、p50 {row['p50']:.2f}s、p90 {row['p90']:.2f}s、"
+                    f"hedge {row['hedges']} 次（勝出 {row['hedge_wins']} 次）"
+                )
+        lines.append("")
+        lines.append("設定方式：`[p]openai sethedge <key> <value>`")
+        await ctx.send("\n".join(lines))
+
+    @openai.command(name="sethedge")
+    @commands.is_owner()
+    async def sethedge(self, ctx: commands.Context, key: str, *, value: str):
+        """調整 hedging 設定（僅限機器人擁有者）。例如：`[p]openai sethedge enabled true`"""
+        cog = self.bot.get_cog("OpenAIChat")
+        conf = cog.config
+
+        key = (key or "").strip().lower()
+        key_map = {
+            "enabled": ("hedge_enabled", "bool"),
+            "percentile": ("hedge_percentile", "float"),
+            "min_delay_seconds": ("hedge_min_delay_seconds", "float"),
+            "max_delay_seconds": ("hedge_max_delay_seconds", "float"),
+            "max_fraction": ("hedge_max_fraction", "float"),
+            "key_rpm": ("api_key_requests_per_minute", "int"),
+        }
+        field_info = key_map.get(key)
+        if not field_info:
+            await ctx.send("不支援的 key。可用 key：\n" + "\n".join(f"- {k}" for k in key_map.keys()))
+            return
+
+        field, kind = field_info
+        raw_value = (value or "").strip().lower()
+        if kind == "bool":
+            if raw_value in ("1", "true", "on", "yes", "y"):
+                parsed_value = True
+            elif raw_value in ("0", "false", "off", "no", "n"):
+                parsed_value = False
+            else:
+                await ctx.send("此 key 需要布林 value（0/1/true/false/on/off）。")
+                return
+        else:
+            try:
+                parsed_value = int(raw_value) if kind == "int" else float(raw_value)
+            except ValueError:
+                await ctx.send("此 key 需要數字 value。")
+                return
+            if parsed_value < 0:
+                await ctx.send(f"{key} 必須 >= 0。")
+                return
+            if field == "hedge_percentile" and not (50 <= parsed_value < 100):
+                await ctx.send("percentile 必須在 50~99.9。")
+                return
+            if field == "hedge_max_fraction" and parsed_value > 1:
+                await ctx.send("max_fraction 必須在 0~1。")
+                return
+
+        await getattr(conf, field).set(parsed_value)
+        await ctx.send(f"已更新 `{key}` = {parsed_value}")
+
+    @openai.command(name="startup")
+    @commands.is_owner()
+    async def startup_report(self, ctx: commands.Context):
+        """顯示 cog 載入與暖機耗時（各依賴套件的 import 時間）。"""
+        cog = self.bot.get_cog("OpenAIChat")
+        report = cog.startup_report()
+        warmup = report.get("warmup_seconds")
+        lines = [
+            f"暖機狀態：{'完成' if report.get('ready') else '進行中'}"
+            + (f"（{warmup:.2f}s）" if warmup is not None else ""),
+            "Import 耗時：",
+        ]
+        for name, seconds in sorted(report.get("imports", {}).items(), key=lambda kv: kv[1], reverse=True):
+            lines.append(f"- {name}: {seconds * 1000:.1f} ms")
+        await ctx.send("\n".join(lines))
+
     @openai.command()
     @commands.is_owner()
     async def setdelay(self, ctx: commands.Context, delay: float):
@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import math
+import operator
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+log = logging.getLogger("red.BadwolfCogs.consolidation")
+
+
+CONSOLIDATION_GLOBAL_DEFAULTS = {
+    "memory_consolidation_enabled": True,
+    "memory_consolidation_interval_seconds": 21600,
+    "memory_consolidation_similarity": 0.9,
+    "memory_consolidation_cpu_budget": 0.1,
+    "memory_consolidation_scan_limit": 200,
+}
+
+CONSOLIDATION_MAX_FACTS = 12
+CONSOLIDATION_SLICE_SECONDS = 0.02
+CONSOLIDATION_IDLE_POLL_SECONDS = 1.0
+# A chat queue that never drains must not stall consolidation forever.
+CONSOLIDATION_MAX_IDLE_WAIT_SECONDS = 60.0
+
+
+class _CPUBudget:
+    """
+    Cooperative duty-cycle limiter: after each ~20 ms slice of work on the event loop,
+    sleep long enough that the job uses at most ``fraction`` of wall time.
+    While the chat queue is busy the job waits, but at most ``CONSOLIDATION_MAX_IDLE_WAIT_SECONDS``
+    per slice so it still makes progress under constant load.
+    """
+
+    def __init__(self, fraction: float, *, is_busy=None):
+        self.fraction = max(0.01, min(float(fraction), 1.0))
+        self._is_busy = is_busy
+        self._slice_start = time.perf_counter()
+        self.cpu_seconds = 0.0
+
+    async def checkpoint(self, *, force: bool = False):
+        elapsed = time.perf_counter() - self._slice_start
+        if not force and elapsed < CONSOLIDATION_SLICE_SECONDS:
+            return
+        self.cpu_seconds += elapsed
+        await asyncio.sleep(elapsed * (1.0 - self.fraction) / self.fraction)
+        # Foreground requests win: wait until the chat queue is idle, up to the max wait.
+        deadline = time.monotonic() + CONSOLIDATION_MAX_IDLE_WAIT_SECONDS
+        while self._is_busy is not None and self._is_busy():
+            if time.monotonic() >= deadline:
+                log.debug(
+                    "Chat queue still busy after %.0fs, running a consolidation slice anyway",
+                    CONSOLIDATION_MAX_IDLE_WAIT_SECONDS,
+                )
+                break
+            await asyncio.sleep(CONSOLIDATION_IDLE_POLL_SECONDS)
+        self._slice_start = time.perf_counter()
+
+
+def _normalize(vec: List[float]) -> Optional[List[float]]:
+    norm = math.sqrt(sum(map(operator.mul, vec, vec)))
+    if not norm:
+        return None
+    return [v / norm for v in vec]
+
+
+def _dot(vec_a: List[float], vec_b: List[float]) -> float:
+    return sum(map(operator.mul, vec_a, vec_b))
+
+
+class MemoryConsolidationMixin:
+    """
+    Background job that merges near-duplicate long-term memories.
+
+    Each user's (and each guild's) memories are clustered greedily by embedding similarity.
+    A cluster is replaced by one row holding the most important summary, the union of facts,
+    the maximum importance and a fresh embedding; originals are deleted in the same transaction.
+    """
+
+    def _start_consolidation_task(self):
+        task = getattr(self, "_consolidation_task", None)
+        if task is None or task.done():
+            self._consolidation_task = asyncio.create_task(self._consolidation_loop())
+
+    async def _stop_consolidation_task(self):
+        task = getattr(self, "_consolidation_task", None)
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _consolidation_loop(self):
+        while True:
+            interval = self._coerce_int(await self.config.memory_consolidation_interval_seconds(), default=21600)
+            await asyncio.sleep(max(300, interval))
+            if not await self.config.memory_consolidation_enabled():
+                continue
+            try:
+                stats = await self.consolidate_long_term_memories()
+                log.debug("Memory consolidation finished: %s", stats)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Error during memory consolidation: {e}")
+
+    async def consolidate_long_term_memories(self, *, guild_id: Optional[int] = None) -> Dict[str, Any]:
+        """Run one consolidation pass over every memory table. Returns counters for reporting."""
+        global_settings = await self.config.all()
+        threshold = self._coerce_float(global_settings.get("memory_consolidation_similarity"), default=0.9)
+        threshold = max(0.5, min(threshold, 1.0))
+        scan_limit = max(2, self._coerce_int(global_settings.get("memory_consolidation_scan_limit"), default=200))
+        embedding_model = str(global_settings.get("memory_embedding_model") or "gemini-embedding-2-preview")
+        budget = _CPUBudget(
+            self._coerce_float(global_settings.get("memory_consolidation_cpu_budget"), default=0.1),
+            is_busy=lambda: not self.queue.empty(),
+        )
+
+        stats = {"groups": 0, "clusters": 0, "merged_rows": 0, "cpu_seconds": 0.0}
+        for scope in ("chat", "agent"):
+            for table_name, user_scoped in (
+                (self._user_memory_table(scope), True),
+                (self._guild_memory_table(scope), False),
+            ):
+                for key in await self._consolidation_groups(table_name, user_scoped=user_scoped, guild_id=guild_id):
+                    stats["groups"] += 1
+                    clusters, merged = await self._consolidate_group(
+                        table_name,
+                        key,
+                        user_scoped=user_scoped,
+                        threshold=threshold,
+                        scan_limit=scan_limit,
+                        embedding_model=embedding_model,
+                        budget=budget,
+                    )
+                    stats["clusters"] += clusters
+                    stats["merged_rows"] += merged
+                    await budget.checkpoint(force=True)
+        stats["cpu_seconds"] = round(budget.cpu_seconds, 3)
+        return stats
+
+    async def _consolidation_groups(
+        self, table_name: str, *, user_scoped: bool, guild_id: Optional[int]
+    ) -> List[Tuple[int, ...]]:
+        columns = "guild_id, user_id" if user_scoped else "guild_id"
+        where = "WHERE embedding IS NOT NULL"
+        params: Tuple[Any, ...] = ()
+        if guild_id is not None:
+            where += " AND guild_id = ?"
+            params = (guild_id,)
+        async with self._memory_db_exec_lock:
+            db = await self._get_memory_db()
+            async with db.execute(
+                f"SELECT {columns} FROM {table_name} {where} GROUP BY {columns} HAVING COUNT(*) >= 2",
+                params,
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [tuple(row) for row in rows]
+
+    async def _consolidate_group(
+        self,
+        table_name: str,
+        key: Tuple[int, ...],
+        *,
+        user_scoped: bool,
+        threshold: float,
+        scan_limit: int,
+        embedding_model: str,
+        budget: _CPUBudget,
+    ) -> Tuple[int, int]:
+        where = "guild_id = ? AND user_id = ?" if user_scoped else "guild_id = ?"
+        async with self._memory_db_exec_lock:
+            db = await self._get_memory_db()
+            async with db.execute(
+                f"""
+                SELECT id, created_at, importance, summary, facts_json, embedding, expires_at
+                FROM {table_name}
+                WHERE {where} AND embedding IS NOT NULL
+                ORDER BY importance DESC, created_at DESC
+                LIMIT ?
+                """,
+                (*key, scan_limit),
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        items: List[Dict[str, Any]] = []
+        for mem_id, created_at, importance, summary, facts_json, embedding_blob, expires_at in rows:
+            vec = self._embedding_from_blob(embedding_blob)
+            vec = _normalize(vec) if vec else None
+            if vec is None:
+                continue
+            try:
+                facts = json.loads(facts_json) if facts_json else []
+            except Exception:
+                facts = []
+            items.append(
+                {
+                    "id": int(mem_id),
+                    "created_at": float(created_at or 0.0),
+                    "importance": self._coerce_int(importance, default=1),
+                    "summary": str(summary or "").strip(),
+                    "facts": [str(f).strip() for f in facts if str(f).strip()] if isinstance(facts, list) else [],
+                    "embedding_blob": embedding_blob,
+                    "expires_at": expires_at,
+                    "vec": vec,
+                }
+            )
+            await budget.checkpoint()
+
+        # Greedy clustering: rows are ordered by importance then recency, so each seed is the
+        # best representative of its cluster.
+        clusters: List[List[Dict[str, Any]]] = []
+        assigned = [False] * len(items)
+        for i, seed in enumerate(items):
+            if assigned[i]:
+                continue
+            assigned[i] = True
+            cluster = [seed]
+            for j in range(i + 1, len(items)):
+                if assigned[j] or len(items[j]["vec"]) != len(seed["vec"]):
+                    continue
+                if _dot(seed["vec"], items[j]["vec"]) >= threshold:
+                    assigned[j] = True
+                    cluster.append(items[j])
+                await budget.checkpoint()
+            if len(cluster) > 1:
+                clusters.append(cluster)
+
+        merged_rows = 0
+        for cluster in clusters:
+            if await self._merge_memory_cluster(
+                table_name, key, cluster, user_scoped=user_scoped, embedding_model=embedding_model
+            ):
+                merged_rows += len(cluster)
+            await budget.checkpoint(force=True)
+        return len(clusters), merged_rows
+
+    @staticmethod
+    def _merge_cluster_facts(cluster: List[Dict[str, Any]]) -> List[str]:
+        facts: List[str] = []
+        seen = set()
+        for item in cluster:
+            for fact in item["facts"]:
+                norm = fact.lower()
+                if norm in seen:
+                    continue
+                seen.add(norm)
+                facts.append(fact)
+        return facts[:CONSOLIDATION_MAX_FACTS]
+
+    async def _merge_memory_cluster(
+        self,
+        table_name: str,
+        key: Tuple[int, ...],
+        cluster: List[Dict[str, Any]],
+        *,
+        user_scoped: bool,
+        embedding_model: str,
+    ) -> bool:
+        seed = cluster[0]
+        summary = seed["summary"] or next((c["summary"] for c in cluster if c["summary"]), "")
+        facts = self._merge_cluster_facts(cluster)
+        importance = max(c["importance"] for c in cluster)
+        created_at = max(c["created_at"] for c in cluster)
+        expires = [c["expires_at"] for c in cluster]
+        expires_at = None if any(e is None for e in expires) else max(float(e) for e in expires)
+
+        embedding_blob = seed["embedding_blob"]
+        try:
+            embedding = await self.embed_text((summary + "\n" + "\n".join(facts)).strip(), embedding_model)
+        except Exception as e:
+            log.error(f"Error re-embedding consolidated memory: {e}")
+            embedding = None
+        if embedding:
+            embedding_blob = self._embedding_to_blob(embedding, await self._get_embedding_storage())
+
+        ids = [c["id"] for c in cluster]
+        placeholders = ",".join("?" for _ in ids)
+        facts_json = json.dumps(facts, ensure_ascii=False, separators=(",", ":"))
+
+        async with self._memory_db_exec_lock:
+            db = await self._get_memory_db()
+            try:
+                # Rows may have been deleted (forgetme, retention) while we were embedding;
+                # never resurrect data that is gone.
+                async with db.execute(
+                    f"SELECT COUNT(*) FROM {table_name} WHERE id IN ({placeholders})",
+                    ids,
+                ) as cursor:
+                    (remaining,) = await cursor.fetchone()
+                if remaining != len(ids):
+                    return False
+
+                await db.execute(f"DELETE FROM {table_name} WHERE id IN ({placeholders})", ids)
+                if user_scoped:
+                    await db.execute(
+                        f"""
+                        INSERT INTO {table_name}
+                            (guild_id, user_id, created_at, importance, summary, facts_json, embedding, expires_at)
+                        VALUES
+                            (?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        (*key, created_at, importance, summary, facts_json, embedding_blob, expires_at),
+                    )
+                else:
+                    await db.execute(
+                        f"""
+                        INSERT INTO {table_name}
+                            (guild_id, created_at, importance, summary, facts_json, content_hash, embedding, expires_at)
+                        VALUES
+                            (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(guild_id, content_hash) DO UPDATE SET
+                            created_at = MAX({table_name}.created_at, excluded.created_at),
+                            importance = MAX({table_name}.importance, excluded.importance),
+                            embedding = COALESCE(excluded.embedding, {table_name}.embedding)
+                        """,
+                        (
+                            *key,
+                            created_at,
+                            importance,
+                            summary,
+                            facts_json,
+                            self._guild_memory_content_hash(summary, facts),
+                            embedding_blob,
+                            expires_at,
+                        ),
+                    )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        return True
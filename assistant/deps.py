@@ -0,0 +1,70 @@
+import functools
+import importlib
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+log = logging.getLogger("red.BadwolfCogs.deps")
+
+# Heavy third-party SDKs are imported on first use (or by the cog's warm-up task) instead of at
+# module import, so loading the cog does not block bot startup. Import durations are recorded
+# for `[p]openai startup`.
+_IMPORT_TIMINGS: Dict[str, float] = {}
+
+
+def record_import_time(name: str, seconds: float):
+    _IMPORT_TIMINGS[name] = seconds
+
+
+def import_timings() -> Dict[str, float]:
+    return dict(_IMPORT_TIMINGS)
+
+
+def _timed_import(module_name: str) -> Optional[Any]:
+    started = time.perf_counter()
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        log.warning("Optional dependency %s is not available: %s", module_name, e)
+        module = None
+    record_import_time(module_name, time.perf_counter() - started)
+    return module
+
+
+@functools.lru_cache(maxsize=None)
+def load_genai() -> Tuple[Optional[Any], Optional[Any]]:
+    """Returns: (google.genai, google.genai.types), either may be ``None`` when missing."""
+    genai = _timed_import("google.genai")
+    types = _timed_import("google.genai.types") if genai is not None else None
+    return genai, types
+
+
+@functools.lru_cache(maxsize=None)
+def load_api_exceptions() -> Optional[Any]:
+    return _timed_import("google.api_core.exceptions")
+
+
+@functools.lru_cache(maxsize=None)
+def load_httpx() -> Optional[Any]:
+    return _timed_import("httpx")
+
+
+@functools.lru_cache(maxsize=None)
+def load_aiosqlite() -> Optional[Any]:
+    return _timed_import("aiosqlite")
+
+
+@functools.lru_cache(maxsize=None)
+def load_ddgs() -> Optional[Any]:
+    """Returns the ``DDGS`` class, or ``None`` when ddgs is missing."""
+    module = _timed_import("ddgs")
+    return getattr(module, "DDGS", None) if module is not None else None
+
+
+def preload_all():
+    """Import every heavy dependency. Meant to run in a worker thread during warm-up."""
+    load_httpx()
+    load_aiosqlite()
+    load_api_exceptions()
+    load_genai()
+    load_ddgs()
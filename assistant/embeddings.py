@@ -0,0 +1,168 @@
+import array
+import functools
+import math
+import operator
+import struct
+from typing import Any, Dict, List, Optional, Sequence
+
+# Blob layout:
+# - legacy / "float32": raw native float32 values, no header.
+# - tagged: EMBEDDING_BLOB_MAGIC + 1 format byte, followed by
+#     float16: little-endian half floats
+#     int8:    little-endian float32 scale, then one signed byte per dimension (value = q * scale)
+EMBEDDING_BLOB_MAGIC = b"EMBQ"
+EMBEDDING_FORMAT_FLOAT32 = "float32"
+EMBEDDING_FORMAT_FLOAT16 = "float16"
+EMBEDDING_FORMAT_INT8 = "int8"
+EMBEDDING_FORMATS = (EMBEDDING_FORMAT_FLOAT32, EMBEDDING_FORMAT_FLOAT16, EMBEDDING_FORMAT_INT8)
+
+_FORMAT_TAGS = {EMBEDDING_FORMAT_FLOAT16: 2, EMBEDDING_FORMAT_INT8: 3}
+_TAG_FORMATS = {tag: fmt for fmt, tag in _FORMAT_TAGS.items()}
+_HEADER_SIZE = len(EMBEDDING_BLOB_MAGIC) + 1
+_INT8_SCALE = struct.Struct("<f")
+
+
+@functools.lru_cache(maxsize=16)
+def _half_struct(dims: int) -> struct.Struct:
+    return struct.Struct(f"<{dims}e")
+
+
+def _as_bytes(blob: Any) -> Optional[bytes]:
+    if not blob:
+        return None
+    if isinstance(blob, memoryview):
+        return blob.tobytes()
+    if isinstance(blob, (bytes, bytearray)):
+        return bytes(blob)
+    return None
+
+
+def blob_format(blob: Any) -> Optional[str]:
+    """Storage format of an embedding blob, or ``None`` if it is not a valid blob."""
+    data = _as_bytes(blob)
+    if data is None:
+        return None
+    if data.startswith(EMBEDDING_BLOB_MAGIC) and len(data) > _HEADER_SIZE:
+        return _TAG_FORMATS.get(data[len(EMBEDDING_BLOB_MAGIC)])
+    if len(data) % 4 == 0:
+        return EMBEDDING_FORMAT_FLOAT32
+    return None
+
+
+def encode_embedding(values: Sequence[float], fmt: str = EMBEDDING_FORMAT_FLOAT32) -> bytes:
+    if fmt == EMBEDDING_FORMAT_FLOAT16:
+        clipped = [max(-65504.0, min(float(v), 65504.0)) for v in values]
+        header = EMBEDDING_BLOB_MAGIC + bytes((_FORMAT_TAGS[fmt],))
+        return header + _half_struct(len(clipped)).pack(*clipped)
+
+    if fmt == EMBEDDING_FORMAT_INT8:
+        floats = [float(v) for v in values]
+        peak = max((abs(v) for v in floats), default=0.0)
+        scale = (peak / 127.0) if peak else 1.0
+        quantized = array.array("b", (max(-127, min(127, round(v / scale))) for v in floats))
+        header = EMBEDDING_BLOB_MAGIC + bytes((_FORMAT_TAGS[fmt],))
+        return header + _INT8_SCALE.pack(scale) + quantized.tobytes()
+
+    return array.array("f", (float(v) for v in values)).tobytes()
+
+
+def _raw_components(data: bytes, fmt: str) -> Optional[Sequence[float]]:
+    """
+    Components in their stored domain without rescaling.
+    For int8 the per-vector scale is dropped, which does not change cosine similarity.
+    """
+    try:
+        if fmt == EMBEDDING_FORMAT_FLOAT32:
+            arr = array.array("f")
+            arr.frombytes(data)
+            return arr
+        payload = data[_HEADER_SIZE:]
+        if fmt == EMBEDDING_FORMAT_FLOAT16:
+            return _half_struct(len(payload) // 2).unpack(payload)
+        if fmt == EMBEDDING_FORMAT_INT8:
+            arr = array.array("b")
+            arr.frombytes(payload[_INT8_SCALE.size:])
+            return arr
+    except (struct.error, ValueError):
+        return None
+    return None
+
+
+def decode_embedding(blob: Any) -> Optional[List[float]]:
+    data = _as_bytes(blob)
+    fmt = blob_format(data)
+    if data is None or fmt is None:
+        return None
+    components = _raw_components(data, fmt)
+    if components is None:
+        return None
+    if fmt == EMBEDDING_FORMAT_INT8:
+        (scale,) = _INT8_SCALE.unpack_from(data, _HEADER_SIZE)
+        return [q * scale for q in components]
+    return list(components)
+
+
+def unit_vector(values: Sequence[float]) -> Optional[List[float]]:
+    norm = math.sqrt(sum(map(operator.mul, values, values)))
+    if not norm:
+        return None
+    return [v / norm for v in values]
+
+
+def blob_cosine(query_unit: Sequence[float], blob: Any) -> float:
+    """Cosine similarity between a pre-normalized query and a stored blob, read in its stored format."""
+    data = _as_bytes(blob)
+    fmt = blob_format(data)
+    if not query_unit or data is None or fmt is None:
+        return 0.0
+    components = _raw_components(data, fmt)
+    if not components or len(components) != len(query_unit):
+        return 0.0
+    norm_sq = sum(map(operator.mul, components, components))
+    if not norm_sq:
+        return 0.0
+    return sum(map(operator.mul, query_unit, components)) / math.sqrt(norm_sq)
+
+
+def recall_benchmark(vectors: List[List[float]], fmt: str, *, top_k: int = 6, queries: int = 50) -> Dict[str, Any]:
+    """
+    Compare top-k retrieval over ``fmt`` blobs against float32 using the vectors themselves as queries.
+    Returns recall@k, mean absolute score error and the storage size ratio.
+    """
+    vectors = [v for v in vectors if v]
+    if len(vectors) < 2:
+        return {"format": fmt, "vectors": len(vectors), "recall": 1.0, "score_error": 0.0, "size_ratio": 1.0}
+
+    baseline = [encode_embedding(v, EMBEDDING_FORMAT_FLOAT32) for v in vectors]
+    candidate = [encode_embedding(v, fmt) for v in vectors]
+    step = max(1, len(vectors) // max(1, queries))
+    k = max(1, min(top_k, len(vectors) - 1))
+
+    hits = 0
+    total = 0
+    error_sum = 0.0
+    error_count = 0
+    for qi in range(0, len(vectors), step):
+        query = unit_vector(vectors[qi])
+        if query is None:
+            continue
+        base_scores = [blob_cosine(query, b) for b in baseline]
+        cand_scores = [blob_cosine(query, b) for b in candidate]
+        # the query always ranks itself first, leave it out or it inflates recall
+        others = [i for i in range(len(vectors)) if i != qi]
+        base_top = set(sorted(others, key=base_scores.__getitem__, reverse=True)[:k])
+        cand_top = set(sorted(others, key=cand_scores.__getitem__, reverse=True)[:k])
+        hits += len(base_top & cand_top)
+        total += k
+        error_sum += sum(abs(a - b) for a, b in zip(base_scores, cand_scores))
+        error_count += len(vectors)
+
+    base_bytes = sum(len(b) for b in baseline)
+    cand_bytes = sum(len(b) for b in candidate)
+    return {
+        "format": fmt,
+        "vectors": len(vectors),
+        "recall": (hits / total) if total else 1.0,
+        "score_error": (error_sum / error_count) if error_count else 0.0,
+        "size_ratio": (base_bytes / cand_bytes) if cand_bytes else 1.0,
+    }
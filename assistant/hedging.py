@@ -0,0 +1,67 @@
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+HEDGING_GLOBAL_DEFAULTS = {
+    "hedge_enabled": False,
+    "hedge_percentile": 90,
+    "hedge_min_delay_seconds": 2.0,
+    "hedge_max_delay_seconds": 15.0,
+    "hedge_max_fraction": 0.1,
+    "api_key_requests_per_minute": 0,
+}
+
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW_SAMPLES = 200
+KEY_QUOTA_WINDOW_SECONDS = 60.0
+
+
+class LatencyTracker:
+    """
+    Rolling window of successful call durations per operation, used to derive the hedge deadline.
+    Until enough samples exist the deadline falls back to the configured maximum.
+    """
+
+    def __init__(self, window: int = HEDGE_WINDOW_SAMPLES):
+        self._window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self.hedges: Dict[str, int] = {}
+        self.hedge_wins: Dict[str, int] = {}
+
+    def record(self, operation: str, seconds: float):
+        samples = self._samples.get(operation)
+        if samples is None:
+            samples = self._samples[operation] = deque(maxlen=self._window)
+        samples.append(max(0.0, float(seconds)))
+
+    def percentile(self, operation: str, pct: float) -> Optional[float]:
+        samples = self._samples.get(operation)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered: List[float] = sorted(samples)
+        rank = max(0, min(len(ordered) - 1, int(round((pct / 100.0) * (len(ordered) - 1)))))
+        return ordered[rank]
+
+    def deadline(self, operation: str, *, pct: float, min_delay: float, max_delay: float) -> float:
+        value = self.percentile(operation, pct)
+        if value is None:
+            return max_delay
+        return max(min_delay, min(value, max_delay))
+
+    def note_hedge(self, operation: str, *, won: bool):
+        self.hedges[operation] = self.hedges.get(operation, 0) + 1
+        if won:
+            self.hedge_wins[operation] = self.hedge_wins.get(operation, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out: Dict[str, Dict[str, float]] = {}
+        for operation, samples in self._samples.items():
+            ordered = sorted(samples)
+            out[operation] = {
+                "samples": len(ordered),
+                "p50": ordered[len(ordered) // 2] if ordered else 0.0,
+                "p90": self.percentile(operation, 90) or 0.0,
+                "hedges": self.hedges.get(operation, 0),
+                "hedge_wins": self.hedge_wins.get(operation, 0),
+            }
+        return out
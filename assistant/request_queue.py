@@ -0,0 +1,264 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .agent import AgentChatRequest
+
+
+QUEUE_OVERFLOW_DROP_OLDEST = "drop_oldest"
+QUEUE_OVERFLOW_COALESCE = "coalesce"
+QUEUE_OVERFLOW_REJECT = "reject"
+QUEUE_OVERFLOW_POLICIES = (
+    QUEUE_OVERFLOW_DROP_OLDEST,
+    QUEUE_OVERFLOW_COALESCE,
+    QUEUE_OVERFLOW_REJECT,
+)
+
+QUEUE_STATUS_QUEUED = "queued"
+QUEUE_STATUS_COALESCED = "coalesced"
+QUEUE_STATUS_REJECTED = "rejected"
+
+QUEUE_GLOBAL_DEFAULTS = {
+    "queue_max_size": 200,
+    "queue_guild_max_pending": 50,
+    "queue_user_max_pending": 3,
+    "queue_overflow_policy": QUEUE_OVERFLOW_DROP_OLDEST,
+    "queue_max_age_seconds": 120,
+}
+
+
+class _Entry:
+    __slots__ = ("priority", "seq", "request", "alive")
+
+    def __init__(self, priority: int, seq: int, request: AgentChatRequest):
+        self.priority = priority
+        self.seq = seq
+        self.request = request
+        self.alive = True
+
+    def __lt__(self, other: "_Entry") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RequestQueue:
+    """
+    Bounded priority queue for pending chat requests.
+
+    - Direct requests (mentions / replies to the bot) are served before passive channel chatter,
+      FIFO within the same priority.
+    - Pending requests are capped globally, per guild and per user; the overflow policy decides
+      whether the oldest lower-priority request is dropped, the new text is merged into a pending
+      request of the same user, or the new request is rejected.
+    - Requests older than ``max_age_seconds`` are reported as stale so no model work is spent on them.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_size: int = QUEUE_GLOBAL_DEFAULTS["queue_max_size"],
+        guild_max_pending: int = QUEUE_GLOBAL_DEFAULTS["queue_guild_max_pending"],
+        user_max_pending: int = QUEUE_GLOBAL_DEFAULTS["queue_user_max_pending"],
+        overflow_policy: str = QUEUE_GLOBAL_DEFAULTS["queue_overflow_policy"],
+        max_age_seconds: float = QUEUE_GLOBAL_DEFAULTS["queue_max_age_seconds"],
+    ):
+        self._heap: List[_Entry] = []
+        self._seq = itertools.count()
+        self._size = 0
+        # Insertion-ordered so the first item is always the oldest pending entry of that scope.
+        self._live: Dict[int, _Entry] = {}
+        self._by_guild: Dict[int, Dict[int, _Entry]] = {}
+        self._by_user: Dict[Tuple[int, int], Dict[int, _Entry]] = {}
+        self._not_empty = asyncio.Event()
+        self._closed = False
+        self.max_size = max_size
+        self.guild_max_pending = guild_max_pending
+        self.user_max_pending = user_max_pending
+        self.overflow_policy = overflow_policy
+        self.max_age_seconds = max_age_seconds
+
+    def configure(
+        self,
+        *,
+        max_size: Optional[int] = None,
+        guild_max_pending: Optional[int] = None,
+        user_max_pending: Optional[int] = None,
+        overflow_policy: Optional[str] = None,
+        max_age_seconds: Optional[float] = None,
+    ):
+        if max_size is not None:
+            self.max_size = max(0, int(max_size))
+        if guild_max_pending is not None:
+            self.guild_max_pending = max(0, int(guild_max_pending))
+        if user_max_pending is not None:
+            self.user_max_pending = max(0, int(user_max_pending))
+        if overflow_policy is not None:
+            if overflow_policy not in QUEUE_OVERFLOW_POLICIES:
+                raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+            self.overflow_policy = overflow_policy
+        if max_age_seconds is not None:
+            self.max_age_seconds = max(0.0, float(max_age_seconds))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def pending_for_guild(self, guild_id: int) -> int:
+        return len(self._by_guild.get(guild_id) or ())
+
+    def pending_for_user(self, guild_id: int, user_id: int) -> int:
+        return len(self._by_user.get((guild_id, user_id)) or ())
+
+    @staticmethod
+    def _request_keys(request: AgentChatRequest) -> Tuple[int, Tuple[int, int]]:
+        message = request.message
+        guild_id = message.guild.id if message.guild else 0
+        return guild_id, (guild_id, message.author.id)
+
+    def _scope_entries(self, scope: str, request: AgentChatRequest) -> Dict[int, _Entry]:
+        guild_id, user_key = self._request_keys(request)
+        if scope == "user":
+            return self._by_user.get(user_key) or {}
+        if scope == "guild":
+            return self._by_guild.get(guild_id) or {}
+        return self._live
+
+    def _overflowing_scope(self, request: AgentChatRequest) -> Optional[str]:
+        guild_id, user_key = self._request_keys(request)
+        if self.user_max_pending > 0 and self.pending_for_user(*user_key) >= self.user_max_pending:
+            return "user"
+        if self.guild_max_pending > 0 and self.pending_for_guild(guild_id) >= self.guild_max_pending:
+            return "guild"
+        if self.max_size > 0 and self._size >= self.max_size:
+            return "global"
+        return None
+
+    def _add(self, request: AgentChatRequest):
+        entry = _Entry(request.priority, next(self._seq), request)
+        heapq.heappush(self._heap, entry)
+        self._live[entry.seq] = entry
+        guild_id, user_key = self._request_keys(request)
+        self._by_guild.setdefault(guild_id, {})[entry.seq] = entry
+        self._by_user.setdefault(user_key, {})[entry.seq] = entry
+        self._size += 1
+        self._not_empty.set()
+
+    def _discard(self, entry: _Entry):
+        if not entry.alive:
+            return
+        entry.alive = False
+        self._size -= 1
+        self._live.pop(entry.seq, None)
+        if len(self._heap) > 2 * len(self._live):
+            # Discarded entries stay in the heap until popped; rebuild it once they outnumber live ones.
+            self._heap = list(self._live.values())
+            heapq.heapify(self._heap)
+        guild_id, user_key = self._request_keys(entry.request)
+        for index, key in ((self._by_guild, guild_id), (self._by_user, user_key)):
+            bucket = index.get(key)
+            if bucket is None:
+                continue
+            bucket.pop(entry.seq, None)
+            if not bucket:
+                del index[key]
+
+    def _pick_victim(self, scope: str, request: AgentChatRequest) -> Optional[_Entry]:
+        # Oldest entry among the least important ones; never evict a more important request.
+        victim: Optional[_Entry] = None
+        for entry in self._scope_entries(scope, request).values():
+            if victim is None or entry.priority > victim.priority:
+                victim = entry
+        if victim is None or victim.priority < request.priority:
+            return None
+        return victim
+
+    def _pick_coalesce_target(self, request: AgentChatRequest) -> Optional[_Entry]:
+        target: Optional[_Entry] = None
+        for entry in self._scope_entries("user", request).values():
+            pending = entry.request
+            if pending.message.channel.id != request.message.channel.id:
+                continue
+            if pending.agent_mode != request.agent_mode:
+                continue
+            target = entry  # keep the newest matching entry
+        return target
+
+    def put(self, request: AgentChatRequest) -> Tuple[str, List[AgentChatRequest]]:
+        """
+        Enqueue a request according to the configured caps and overflow policy.
+        Returns: (status, dropped_requests)
+        """
+        if self._closed:
+            return QUEUE_STATUS_REJECTED, []
+
+        dropped: List[AgentChatRequest] = []
+        scope = self._overflowing_scope(request)
+        while scope is not None:
+            if self.overflow_policy == QUEUE_OVERFLOW_COALESCE:
+                target = self._pick_coalesce_target(request)
+                if target is None:
+                    return QUEUE_STATUS_REJECTED, dropped
+                target.request.merge(request)
+                if request.priority < target.priority:
+                    # Re-queue with the higher priority of the merged request.
+                    self._discard(target)
+                    self._add(target.request)
+                return QUEUE_STATUS_COALESCED, dropped
+
+            if self.overflow_policy == QUEUE_OVERFLOW_DROP_OLDEST:
+                victim = self._pick_victim(scope, request)
+                if victim is None:
+                    return QUEUE_STATUS_REJECTED, dropped
+                self._discard(victim)
+                dropped.append(victim.request)
+                scope = self._overflowing_scope(request)
+                continue
+
+            return QUEUE_STATUS_REJECTED, dropped
+
+        self._add(request)
+        return QUEUE_STATUS_QUEUED, dropped
+
+    def is_stale(self, request: AgentChatRequest, *, now: Optional[float] = None) -> bool:
+        if self.max_age_seconds <= 0:
+            return False
+        now = time.monotonic() if now is None else now
+        return (now - request.enqueued_at) > self.max_age_seconds
+
+    def get_nowait(self) -> AgentChatRequest:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if not entry.alive:
+                continue
+            self._discard(entry)
+            if self._size == 0:
+                self._not_empty.clear()
+            return entry.request
+        self._not_empty.clear()
+        raise asyncio.QueueEmpty
+
+    async def get(self) -> Optional[AgentChatRequest]:
+        """Wait for the next request. Returns ``None`` once the queue is closed."""
+        while True:
+            if self._closed:
+                return None
+            try:
+                return self.get_nowait()
+            except asyncio.QueueEmpty:
+                await self._not_empty.wait()
+
+    def drain(self) -> List[AgentChatRequest]:
+        """Remove and return every pending request, highest priority first."""
+        pending: List[AgentChatRequest] = []
+        while True:
+            try:
+                pending.append(self.get_nowait())
+            except asyncio.QueueEmpty:
+                return pending
+
+    def close(self):
+        self._closed = True
+        self._not_empty.set()
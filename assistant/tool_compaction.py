@@ -0,0 +1,159 @@
+import math
+import re
+import urllib.parse
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+TOOL_COMPACTION_GLOBAL_DEFAULTS = {
+    "agent_tool_compaction_chars": 16000,
+    "agent_tool_summary_chars": 1200,
+}
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?。！？；;])\s+|\n+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+")
+_URL_LINE_RE = re.compile(r"^(?:URL|Title|Content-Type):.*$", re.MULTILINE)
+
+
+def normalize_url(url: str) -> str:
+    """Key used to deduplicate fetches: lower-cased scheme/host, no fragment, no trailing slash."""
+    try:
+        parts = urllib.parse.urlsplit(str(url or "").strip())
+    except ValueError:
+        return str(url or "").strip()
+    path = parts.path.rstrip("/")
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+def _terms(text: str) -> Set[str]:
+    """Lower-cased words plus CJK character bigrams (CJK text has no spaces to split on)."""
+    text = str(text or "").lower()
+    terms = {w for w in _WORD_RE.findall(text) if len(w) > 1}
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            terms.add(run)
+        terms.update(run[i : i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def extractive_summary(text: str, query: str, limit: int) -> str:
+    """
+    Keep the sentences most relevant to ``query`` (term overlap, slightly favouring early sentences)
+    in their original order until ``limit`` characters are used. Header lines (URL/Title) are always kept.
+    """
+    text = str(text or "")
+    if len(text) <= limit:
+        return text
+
+    header = "\n".join(m.group(0) for m in _URL_LINE_RE.finditer(text))
+    body = _URL_LINE_RE.sub("", text)
+    sentences = [s.strip() for s in _SENTENCE_SPLIT_RE.split(body) if s and s.strip()]
+    query_terms = _terms(query)
+
+    scored: List[Tuple[float, int]] = []
+    for index, sentence in enumerate(sentences):
+        overlap = len(query_terms & _terms(sentence)) if query_terms else 0
+        position_bonus = 1.0 / (1.0 + index)
+        scored.append((overlap / math.sqrt(1.0 + len(sentence) / 80.0) + position_bonus, index))
+    scored.sort(reverse=True)
+
+    budget = max(0, limit - len(header) - 1)
+    picked: List[int] = []
+    used = 0
+    for _, index in scored:
+        cost = len(sentences[index]) + 1
+        if used + cost > budget:
+            continue
+        picked.append(index)
+        used += cost
+    picked.sort()
+
+    summary = " ".join(sentences[i] for i in picked)
+    return (header + "\n" + summary).strip() if header else summary
+
+
+@dataclass
+class _ToolOutput:
+    index: int
+    name: str
+    payload: Dict[str, Any]
+    query: str
+    compacted: bool = False
+
+    @property
+    def size(self) -> int:
+        return len(str(self.payload.get("result") or ""))
+
+
+class ToolOutputCompactor:
+    """
+    Tracks tool outputs of one agent run.
+
+    - Once the raw tool text kept in the conversation exceeds ``max_chars``, the oldest outputs
+      (never the newest one) are replaced by local extractive summaries of ``summary_chars``.
+    - URLs fetched earlier in the run are reported so they are not fetched and resent again,
+      unless their output was compacted since: the full page can then be fetched again.
+    """
+
+    def __init__(self, *, user_query: str, max_chars: int, summary_chars: int):
+        self.user_query = str(user_query or "")
+        self.max_chars = max(0, int(max_chars))
+        self.summary_chars = max(200, int(summary_chars))
+        self._outputs: List[_ToolOutput] = []
+        self._seen_urls: Dict[str, int] = {}
+        self.compacted_chars = 0
+
+    def seen(self, url: str) -> Optional[int]:
+        """Tool output number (1-based) that already contains ``url``, if any."""
+        return self._seen_urls.get(normalize_url(url))
+
+    def split_seen(self, urls: Iterable[str]) -> Tuple[List[str], List[Tuple[str, int]]]:
+        fresh: List[str] = []
+        duplicates: List[Tuple[str, int]] = []
+        for url in urls:
+            number = self.seen(url)
+            if number is None:
+                fresh.append(url)
+            else:
+                duplicates.append((url, number))
+        return fresh, duplicates
+
+    def record(self, index: int, name: str, payload: Dict[str, Any], *, query: str = "", urls: Iterable[str] = ()) -> int:
+        self._outputs.append(_ToolOutput(index=index, name=name, payload=payload, query=str(query or "")))
+        number = len(self._outputs)
+        for url in urls:
+            self._seen_urls.setdefault(normalize_url(url), number)
+        return number
+
+    def plan(self) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """Returns (contents_index, tool_name, compacted_payload) for every output that should be replaced now."""
+        if self.max_chars <= 0:
+            return []
+        raw_total = sum(o.size for o in self._outputs if not o.compacted)
+        replacements: List[Tuple[int, str, Dict[str, Any]]] = []
+        for number, output in enumerate(self._outputs[:-1], start=1):
+            if raw_total <= self.max_chars:
+                break
+            if output.compacted or output.size <= self.summary_chars:
+                continue
+            original = str(output.payload.get("result") or "")
+            summary = extractive_summary(original, f"{self.user_query}\n{output.query}", self.summary_chars)
+            payload = dict(output.payload)
+            payload["result"] = summary
+            payload["compacted"] = {
+                "original_chars": len(original),
+                "note": (
+                    "Older tool output replaced by a query-relevant extract to save context. "
+                    "Fetch its URLs again if the full content is needed."
+                ),
+            }
+            raw_total -= len(original)
+            self.compacted_chars += len(original) - len(summary)
+            output.payload = payload
+            output.compacted = True
+            # the full page is gone from the conversation, allow fetching it again
+            for url in [u for u, n in self._seen_urls.items() if n == number]:
+                del self._seen_urls[url]
+            replacements.append((output.index, output.name, payload))
+        return replacements
@@ -202,8 +202,10 @@ async def setup(bot: Red):
             "corrupted.** Contacting support is advised (Laggron's support server or official "
             "3rd party cog support server, #support_laggrons-dumb-cogs channel)."
         ) from e
+    await n.api.init_modlog_store()
     await bot.add_cog(n)
     await n.cache.init_automod_enabled()
+    await n.cache.init_temp_actions()
     n.task = bot.loop.create_task(n.api._loop_task())
     if n.cache.automod_enabled:
         n.api.enable_automod()
@@ -0,0 +1,102 @@
+import sys
+
+from array import array
+from typing import Dict, Optional, Tuple
+
+# how often idle entries are evicted, in seconds
+SWEEP_INTERVAL = 60
+
+
+class AntispamRecord:
+    """
+    Recent messages of a member in a channel.
+
+    ``times`` is a ring buffer holding the timestamps of the last ``max_messages + 1`` messages.
+    The slot at ``index`` is the oldest one and gets overwritten by the next message, so the
+    window check only compares two timestamps.
+    """
+
+    __slots__ = ("times", "index", "count", "warned", "expires")
+
+    def __init__(self, size: int):
+        self.times = array("d", bytes(8 * size))
+        self.index = 0
+        self.count = 0
+        self.warned = 0.0  # timestamp of the last text warning or action, 0 if none
+        self.expires = 0.0  # the record can be evicted after this timestamp
+
+    def add(self, timestamp: float, delay: float) -> bool:
+        """
+        Register a message and tell if the buffer is full of messages sent within ``delay``.
+        """
+        size = len(self.times)
+        self.times[self.index] = timestamp
+        self.index = (self.index + 1) % size
+        if self.count < size:
+            self.count += 1
+            if self.count < size:
+                return False
+        return timestamp - self.times[self.index] <= delay
+
+    def reset(self, warned: float):
+        self.index = 0
+        self.count = 0
+        self.warned = warned
+
+
+class AntispamTracker:
+    """
+    Antispam state of all guilds, keyed by ``(guild_id, channel_id, member_id)``.
+    """
+
+    def __init__(self):
+        self.records: Dict[Tuple[int, int, int], AntispamRecord] = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def add_message(
+        self,
+        key: Tuple[int, int, int],
+        timestamp: float,
+        *,
+        max_messages: int,
+        delay: float,
+        delay_before_action: float,
+    ) -> Optional[AntispamRecord]:
+        """
+        Register a message. Returns the member's record if they sent more than
+        ``max_messages`` messages within ``delay`` seconds, else :py:obj:`None`.
+        """
+        size = max(1, max_messages + 1)
+        record = self.records.get(key)
+        if record is None or len(record.times) != size:
+            # new member or the threshold was edited
+            warned = record.warned if record is not None else 0.0
+            record = self.records[key] = AntispamRecord(size)
+            record.warned = warned
+        record.expires = timestamp + max(delay, delay_before_action)
+        if record.add(timestamp, delay):
+            return record
+        return None
+
+    def sweep(self, now: float) -> int:
+        """
+        Evict records idle for longer than their window. Returns the number of evicted records.
+        """
+        expired = [key for key, record in self.records.items() if record.expires < now]
+        for key in expired:
+            del self.records[key]
+        return len(expired)
+
+    def guild_count(self, guild_id: int) -> int:
+        return sum(1 for key in self.records if key[0] == guild_id)
+
+    def memory_usage(self) -> int:
+        """
+        Approximate size of the state in bytes.
+        """
+        size = sys.getsizeof(self.records)
+        for key, record in self.records.items():
+            size += sys.getsizeof(key) + sys.getsizeof(record) + sys.getsizeof(record.times)
+        return size
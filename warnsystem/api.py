@@ -2,14 +2,10 @@ import asyncio
 import discord
 import logging
 import re
-import functools
 
 from copy import deepcopy
-from collections import namedtuple
-from typing import Union, Optional, Iterable, Callable, Awaitable
+from typing import Union, Optional, Iterable, Callable, Awaitable, Dict, FrozenSet, Hashable
 from datetime import datetime, timedelta, timezone
-from multiprocessing import TimeoutError
-from multiprocessing.pool import Pool
 from discord.asset import Asset
 
 from redbot.core import Config
@@ -19,10 +15,19 @@ from redbot.core.commands import BadArgument, MemberConverter
 
 try:
     from redbot.core.modlog import get_modlog_channel as get_red_modlog_channel
+    from redbot.core.data_manager import cog_data_path
 except RuntimeError:
     pass  # running sphinx-build raises an error when importing this module
 
+from .antispam import AntispamTracker, SWEEP_INTERVAL
+from .autowarn import AutowarnCounters
+from .bulk import ModlogDispatcher, OverwriteQueue, RouteBackoff
 from .cache import MemoryCache
+from .digests import content_digest
+from .cases import CaseRecord, UserMemo
+from .modlog_store import ConfigModlogStore, SQLiteModlogStore, StoreGate, migrate_modlogs
+from .regex_engine import RegexEngine, RegexTimeout
+from .stats import GuildRollup, WarnStats
 from . import errors
 
 log = logging.getLogger("red.laggron.warnsystem")
@@ -157,6 +162,17 @@ class UnavailableMember(discord.Object, discord.abc.Messageable):
         return channel
 
 
+class _Raised:
+    """
+    Exception raised by a concurrent warn, as opposed to the failures returned.
+    """
+
+    __slots__ = ("exception",)
+
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+
 class API:
     """
     Interact with WarnSystem from your cog.
@@ -182,12 +198,21 @@ class API:
         self.bot = bot
         self.data = config
         self.cache = cache
-        self.re_pool = Pool(maxtasksperchild=1000)
-        self.regex_timeout = 1
+        self.modlogs = ConfigModlogStore(config)  # see init_modlog_store
+        self.modlog_gate = StoreGate()  # see set_modlog_backend
+        self.autowarn_counters = AutowarnCounters()  # see automod_check_for_autowarn
+        self.warn_stats = WarnStats()  # see get_warn_stats
+        self.regex_engine = RegexEngine(timeout=1)  # see _automod_regex_matches
         self.warned_guilds = []  # see automod_check_for_autowarn
-        self.antispam = {}  # see automod_process_antispam
+        self.antispam = AntispamTracker()  # see automod_process_antispam
         self.antispam_warn_queue = {}  # see automod_warn
+        self.temp_action_guild_concurrency = 5  # see _check_endwarn
+        self.route_backoff = RouteBackoff()  # see warn
+        self.modlog_dispatcher = ModlogDispatcher(self.route_backoff)  # see _create_case
+        self.overwrite_queue = OverwriteQueue(self.route_backoff)  # see maybe_create_mute_role
+        self.masswarn_concurrency = 5  # see warnsystem.call_masswarn
         self.automod_warn_task: asyncio.Task
+        self.antispam_sweep_task: asyncio.Task
 
     def _get_datetime(self, time: int) -> datetime:
         return datetime.fromtimestamp(int(time), tz=timezone.utc)
@@ -293,8 +318,15 @@ class API:
         duration: Optional[timedelta] = None,
         roles: Optional[list] = None,
         modlog_message: Optional[discord.Message] = None,
+        modlog_embed_index: Optional[int] = None,
+        modlog_future: Optional[asyncio.Future] = None,
     ) -> dict:
-        """Create a new case for a member. Don't call this, call warn instead."""
+        """
+        Create a new case for a member. Don't call this, call warn instead.
+
+        ``modlog_future`` is the result of :meth:`ModlogDispatcher.dispatch`, the modlog message
+        is added to the case once it is posted.
+        """
         data = {
             "level": level,
             "author": author
@@ -310,10 +342,55 @@ class API:
                 "channel_id": modlog_message.channel.id,
                 "message_id": modlog_message.id,
             }
-        async with self.data.custom("MODLOGS", guild.id, user.id).x() as logs:
-            logs.append(data)
+            if modlog_embed_index is not None:
+                # the message holds the embeds of multiple cases
+                data["modlog_message"]["embed_index"] = modlog_embed_index
+        async with self.modlog_gate.write():
+            if modlog_future is None:
+                await self.modlogs.add_case(guild.id, user.id, data)
+            else:
+                ref = await self.modlogs.add_pending_case(guild.id, user.id, data)
+                # ref is only valid in this store, keep the switch waiting until it's used
+                self.modlog_gate.hold()
+                self.bot.loop.create_task(
+                    self._set_case_modlog_message(guild, user, ref, modlog_future)
+                )
+            self.autowarn_counters.add_case(guild.id, user.id, data["time"])
+            self.warn_stats.add_case(guild.id, user.id, data)
         return data
 
+    async def _set_case_modlog_message(
+        self,
+        guild: discord.Guild,
+        user: discord.User,
+        ref: Hashable,
+        modlog_future: asyncio.Future,
+    ):
+        # the case was stored before the message was posted, ref finds it back even if other
+        # cases of the member were deleted meanwhile
+        # _create_case took a write on modlog_gate for us, released once ref is used
+        try:
+            try:
+                modlog_message, modlog_embed_index = await modlog_future
+            except Exception as e:
+                log.warn(
+                    f"[Guild {guild.id}] Failed to send the modlog message of the case of "
+                    f"{user} (ID: {user.id}).",
+                    exc_info=e,
+                )
+                modlog = None
+            else:
+                modlog = {
+                    "channel_id": modlog_message.channel.id,
+                    "message_id": modlog_message.id,
+                }
+                if len(modlog_message.embeds) > 1:
+                    # the message holds the embeds of multiple cases
+                    modlog["embed_index"] = modlog_embed_index
+            await self.modlogs.set_case_modlog(guild.id, user.id, ref, modlog)
+        finally:
+            self.modlog_gate.release()
+
     async def get_case(
         self, guild: discord.Guild, user: Union[discord.User, discord.Member], index: int
     ) -> dict:
@@ -350,7 +427,7 @@ class API:
             The case requested doesn't exist.
         """
         try:
-            case = (await self.data.custom("MODLOGS", guild.id, user.id).x())[index - 1]
+            case = await self.modlogs.get_case(guild.id, user.id, index)
         except IndexError:
             raise errors.NotFound("The case requested doesn't exist.")
         else:
@@ -360,7 +437,11 @@ class API:
             return case
 
     async def get_all_cases(
-        self, guild: discord.Guild, user: Optional[Union[discord.User, discord.Member]] = None
+        self,
+        guild: discord.Guild,
+        user: Optional[Union[discord.User, discord.Member]] = None,
+        *,
+        resolve: bool = True,
     ) -> list:
         """
         Get all cases for a member of a guild.
@@ -372,6 +453,9 @@ class API:
         user: Optional[Union[discord.User, discord.Member]]
             The user you want to get the cases from. If this arguments is omitted, all cases of
             the guild are returned.
+        resolve: bool
+            If :py:obj:`False`, guild cases are returned as stored, with the ID of the member
+            in ``member``. Use this if you don't need the users.
 
         Returns
         -------
@@ -410,27 +494,150 @@ class API:
 
                     "member"    : discord.User,  # the member warned, this key is specific to guild
                 }
+
+            Guild cases are read-only :class:`~warnsystem.cases.CaseRecord` mappings, users and
+            dates are resolved when the keys are read. Use ``dict(case)`` for a mutable copy.
+        """
+        # sorted from oldest to newest
+        return await self.get_cases_page(guild, user, resolve=resolve)
+
+    async def get_cases_page(
+        self,
+        guild: discord.Guild,
+        user: Optional[Union[discord.User, discord.Member]] = None,
+        *,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        newest_first: bool = False,
+        resolve: bool = True,
+    ) -> list:
+        """
+        Get a slice of the cases of a member or a guild, without loading the other cases when
+        using the SQLite backend.
+
+        The cases have the same format as :func:`~warnsystem.api.API.get_all_cases`.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the cases from.
+        user: Optional[Union[discord.User, discord.Member]]
+            The user you want to get the cases from. If this arguments is omitted, cases of
+            the guild are returned.
+        offset: int
+            The number of cases to skip.
+        limit: Optional[int]
+            The maximum number of cases returned. All cases after the offset by default.
+        newest_first: bool
+            Sort guild cases from the newest to the oldest. Member cases are always sorted from
+            the oldest to the newest.
+        resolve: bool
+            If :py:obj:`False`, guild cases are returned as stored, with the ID of the member
+            in ``member``, for callers that don't need the users.
+
+        Returns
+        -------
+        list
+            A list of cases.
         """
         if user:
-            return await self.data.custom("MODLOGS", guild.id, user.id).x()
-        logs = await self.data.custom("MODLOGS", guild.id).all()
-        all_cases = []
-        for member, content in logs.items():
-            if member == "x":
-                continue
-            for log in content["x"]:
-                time = log["time"]
-                if time:
-                    log["time"] = self._get_datetime(time)
-                # gotta get that state somehow
-                log["member"] = self.bot.get_user(int(member)) or UnavailableMember(
-                    self.bot, self.bot.user._state, member
-                )
-                log["author"] = self.bot.get_user(int(log["author"])) or UnavailableMember(
-                    self.bot, self.bot.user._state, log["author"]
-                )
-                all_cases.append(log)
-        return sorted(all_cases, key=lambda x: x["time"])  # sorted from oldest to newest
+            return await self.modlogs.get_member_cases(
+                guild.id, user.id, offset=offset, limit=limit
+            )
+        guild_cases = await self.modlogs.get_guild_cases(
+            guild.id, offset=offset, limit=limit, newest_first=newest_first
+        )
+        if not resolve:
+            return [dict(log, member=int(member)) for member, log in guild_cases]
+        # gotta get that state somehow
+        memo = UserMemo(self.bot, lambda x: UnavailableMember(self.bot, self.bot.user._state, x))
+        return [CaseRecord(log, int(member), memo) for member, log in guild_cases]
+
+    def get_guild_cases_pager(
+        self, guild: discord.Guild, *, newest_first: bool = False
+    ) -> Callable[[int, int], Awaitable[list]]:
+        """
+        Get a function returning pages of the cases of a guild, for menus.
+
+        Unlike calling :func:`~warnsystem.api.API.get_cases_page` for each page, the Config
+        backend only loads the cases of the guild once, on the first page. The SQLite backend
+        still reads one page at a time.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to get the cases from.
+        newest_first: bool
+            Sort the cases from the newest to the oldest.
+
+        Returns
+        -------
+        Callable[[int, int], Awaitable[list]]
+            An async function taking the offset and the limit, and returning the cases with
+            the same format as :func:`~warnsystem.api.API.get_all_cases`.
+        """
+        read = self.modlogs.guild_cases_reader(guild.id, newest_first=newest_first)
+        memo = UserMemo(self.bot, lambda x: UnavailableMember(self.bot, self.bot.user._state, x))
+
+        async def fetch(offset: int, limit: int) -> list:
+            cases = await read(offset, limit)
+            return [CaseRecord(log, int(member), memo) for member, log in cases]
+
+        return fetch
+
+    async def count_cases(
+        self, guild: discord.Guild, user: Optional[Union[discord.User, discord.Member]] = None
+    ) -> int:
+        """
+        Get the number of cases of a member or a guild, from the guild's rollup.
+        """
+        return sum((await self.count_levels(guild, user)).values())
+
+    async def count_levels(
+        self, guild: discord.Guild, user: Optional[Union[discord.User, discord.Member]] = None
+    ) -> Dict[int, int]:
+        """
+        Get the number of cases of a member or a guild for each level, from the guild's rollup.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild where you want to count the cases.
+        user: Optional[Union[discord.User, discord.Member]]
+            The user you want to count the cases of. If this arguments is omitted, cases of
+            the guild are counted.
+
+        Returns
+        -------
+        Dict[int, int]
+            A dict of level -> number of cases. Levels without cases may be missing.
+        """
+        rollup = await self.get_warn_stats(guild)
+        if user:
+            return dict(rollup.members.get(user.id, {}))
+        return dict(rollup.levels)
+
+    async def get_warn_stats(self, guild: discord.Guild) -> GuildRollup:
+        """
+        Get the rollup of the cases of a guild, by level, by member and by day.
+
+        It is built on first use from the counts of the modlog, which the SQLite backend
+        computes without loading the cases, then kept up to date when cases are created or
+        deleted.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild you want to get the stats of.
+
+        Returns
+        -------
+        ~warnsystem.stats.GuildRollup
+            The rollup of the guild.
+        """
+        return await self.warn_stats.get(
+            guild.id, lambda: self.modlogs.count_guild_levels(guild.id)
+        )
 
     async def edit_case(
         self,
@@ -467,7 +674,9 @@ class API:
             The case requested doesn't exist.
         """
 
-        async def edit_message(channel_id: int, message_id: int, new_reason: str):
+        async def edit_message(
+            channel_id: int, message_id: int, new_reason: str, embed_index: Optional[int] = None
+        ):
             channel: discord.TextChannel = guild.get_channel(channel_id)
             if channel is None:
                 log.warn(
@@ -496,7 +705,8 @@ class API:
                 )
                 return False
             try:
-                embed: discord.Embed = message.embeds[0]
+                embeds = message.embeds
+                embed: discord.Embed = embeds[embed_index or 0]
                 embed.set_field_at(
                     len(embed.fields) - 2, name=_("Reason"), value=new_reason, inline=False
                 )
@@ -507,7 +717,7 @@ class API:
                 )
                 return False
             try:
-                await message.edit(embed=embed)
+                await message.edit(embeds=embeds)
             except discord.errors.HTTPException as e:
                 log.error(
                     f"[Guild {guild.id}] Failed to edit modlog message. "
@@ -522,14 +732,16 @@ class API:
         case = await self.get_case(guild, user, index)
         case["reason"] = new_reason
         case["time"] = int(case["time"].timestamp())
-        try:
-            channel_id, message_id = case["modlog_message"].values()
-        except KeyError:
-            pass
-        else:
-            await edit_message(channel_id, message_id, new_reason)
-        async with self.data.custom("MODLOGS", guild.id, user.id).x() as logs:
-            logs[index - 1] = case
+        modlog_message = case.get("modlog_message")
+        if modlog_message:
+            await edit_message(
+                modlog_message["channel_id"],
+                modlog_message["message_id"],
+                new_reason,
+                modlog_message.get("embed_index"),
+            )
+        async with self.modlog_gate.write():
+            await self.modlogs.set_case(guild.id, user.id, index, case)
         log.debug(
             f"[Guild {guild.id}] Edited case #{index} from member {user} (ID: {user.id}). "
             f"New reason: {new_reason}"
@@ -542,7 +754,9 @@ class API:
         user: Union[discord.Member, UnavailableMember],
         index: int,
     ):
-        async def delete_message(channel_id: int, message_id: int):
+        async def delete_message(
+            channel_id: int, message_id: int, embed_index: Optional[int] = None
+        ):
             channel: discord.TextChannel = guild.get_channel(channel_id)
             if channel is None:
                 log.warn(
@@ -570,8 +784,18 @@ class API:
                     exc_info=e,
                 )
                 return False
+            deleted = _("Case deleted.")
+            embeds = message.embeds
+            if embed_index is not None and embed_index < len(embeds):
+                # the message is shared with other cases, keep their embeds at the same index
+                embeds[embed_index] = discord.Embed(description=deleted)
             try:
-                await message.delete()
+                if embed_index is not None and any(
+                    x.fields or x.description != deleted for x in embeds
+                ):
+                    await message.edit(embeds=embeds)
+                else:
+                    await message.delete()
             except discord.errors.HTTPException as e:
                 log.error(
                     f"[Guild {guild.id}] Failed to delete modlog message. "
@@ -593,18 +817,18 @@ class API:
                 add_roles = await self.data.guild(guild).remove_roles()
         if can_unmute:
             await member.remove_roles(mute_role, reason=_("Warning deleted."))
-        async with self.data.custom("MODLOGS", guild.id, user.id).x() as logs:
-            try:
-                roles = logs[index - 1]["roles"]
-            except KeyError:
-                roles = []
-            try:
-                channel_id, message_id = logs[index - 1]["modlog_message"].values()
-            except KeyError:
-                pass
-            else:
-                await delete_message(channel_id, message_id)
-            logs.remove(logs[index - 1])
+        roles = case.get("roles", [])
+        modlog_message = case.get("modlog_message")
+        if modlog_message:
+            await delete_message(
+                modlog_message["channel_id"],
+                modlog_message["message_id"],
+                modlog_message.get("embed_index"),
+            )
+        async with self.modlog_gate.write():
+            removed = await self.modlogs.remove_case(guild.id, user.id, index)
+            self.autowarn_counters.remove_case(guild.id, user.id, removed["time"])
+            self.warn_stats.remove_case(guild.id, user.id, removed)
         if add_roles and roles:
             roles = [guild.get_role(x) for x in roles]
             await member.add_roles(*roles, reason=_("Adding removed roles back after unmute."))
@@ -748,12 +972,10 @@ class API:
         if not reason:
             reason = _("No reason was provided.")
             mod_message = _("\nEdit this with `[p]warnings {id}`").format(id=member.id)
-        logs = await self.data.custom("MODLOGS", guild.id, member.id).x()
-
         # prepare the status field
-        total_warns = len(logs) + 1
+        total_warns = await self.modlogs.count_member_cases(guild.id, member.id) + 1
         total_type_warns = (
-            len([x for x in logs if x["level"] == level]) + 1
+            await self.modlogs.count_member_cases(guild.id, member.id, level=level) + 1
         )  # number of warns of the received type
 
         # a lambda that returns a string; if True is given, a third person sentence is returned
@@ -854,7 +1076,11 @@ class API:
 
         return (log_embed, user_embed)
 
-    async def maybe_create_mute_role(self, guild: discord.Guild) -> bool:
+    async def maybe_create_mute_role(
+        self,
+        guild: discord.Guild,
+        progress: Optional[Callable[[int, int], Awaitable]] = None,
+    ) -> bool:
         """
         Create the mod role for WarnSystem if it doesn't exist.
         This will also edit all channels to deny the following permissions to this role:
@@ -867,6 +1093,9 @@ class API:
         ----------
         guild: discord.Guild
             The guild you want to set up the mute in.
+        progress: Optional[Callable[[int, int], Awaitable]]
+            A coroutine function called from time to time with the number of channels edited
+            and the total number of channels, while the permissions are applied.
 
         Returns
         -------
@@ -909,47 +1138,40 @@ class API:
             ),
         )
         perms = discord.PermissionOverwrite(send_messages=False, add_reactions=False, speak=False)
+        reason = _(
+            "Setting up WarnSystem mute. All muted members will have this role, "
+            "feel free to edit its permissions."
+        )
+        failed = await self.overwrite_queue.apply(
+            guild.id, [(x, role, perms, reason) for x in guild.channels], progress
+        )
         errors = []
-        for channel in guild.channels:
-            try:
-                await channel.set_permissions(
-                    target=role,
-                    overwrite=perms,
-                    reason=_(
-                        "Setting up WarnSystem mute. All muted members will have this role, "
-                        "feel free to edit its permissions."
-                    ),
-                )
-            except discord.errors.Forbidden:
+        for channel, error in failed:
+            if isinstance(error, discord.errors.Forbidden):
                 errors.append(
                     _(
                         "Cannot edit permissions of the channel {channel} because of a "
                         "permission error (probably enforced permission for `Manage channel`)."
                     ).format(channel=channel.mention)
                 )
-            except discord.errors.HTTPException as e:
-                errors.append(
-                    _(
-                        "Cannot edit permissions of the channel {channel} because of "
-                        "an unknown error."
-                    ).format(channel=channel.mention)
-                )
+                continue
+            errors.append(
+                _(
+                    "Cannot edit permissions of the channel {channel} because of "
+                    "an unknown error."
+                ).format(channel=channel.mention)
+            )
+            if isinstance(error, discord.errors.HTTPException):
                 log.warn(
                     f"[Guild {guild.id}] Couldn't edit permissions of {channel} (ID: "
                     f"{channel.id}) for setting up the mute role because of an HTTPException.",
-                    exc_info=e,
-                )
-            except Exception as e:
-                errors.append(
-                    _(
-                        "Cannot edit permissions of the channel {channel} because of "
-                        "an unknown error."
-                    ).format(channel=channel.mention)
+                    exc_info=error,
                 )
+            else:
                 log.error(
                     f"[Guild {guild.id}] Couldn't edit permissions of {channel} (ID: "
                     f"{channel.id}) for setting up the mute role because of an unknwon error.",
-                    exc_info=e,
+                    exc_info=error,
                 )
         await self.cache.update_mute_role(guild, role)
         return errors
@@ -992,6 +1214,7 @@ class API:
         take_action: Optional[bool] = True,
         automod: Optional[bool] = True,
         progress_tracker: Optional[Callable[[int], Awaitable[None]]] = None,
+        concurrency: Optional[int] = None,
     ) -> bool:
         """
         Set a warning on a member of a Discord guild and log it with the WarnSystem system.
@@ -1060,6 +1283,13 @@ class API:
                     await asyncio.sleep(1)
 
                 await api.warn(guild, members, ctx.author, 1, progress_tracker=update_count)
+        concurrency: Optional[int]
+            Number of members warned at the same time. By default, members are warned one after
+            another. With a higher value, requests receiving a 429 are retried after the delay
+            given by Discord. The returned failures are the same, in the same order.
+
+            In both cases, modlog embeds are posted in background and grouped up to 10 per
+            message with the other warns of the channel.
 
         Returns
         -------
@@ -1136,7 +1366,7 @@ class API:
                 )
             if log_dm:
                 try:
-                    await member.send(embed=user_e)
+                    await self.route_backoff.call(("dm",), member.send, embed=user_e)
                 except (discord.errors.Forbidden, errors.UserNotFound):
                     modlog_e = (
                         await self.get_embeds(
@@ -1161,11 +1391,17 @@ class API:
                 audit_reason = audit_reason.format(member=member)
                 try:
                     if level == 2:
-                        roles = await self._mute(member, audit_reason)
+                        roles = await self.route_backoff.call(
+                            ("roles", guild.id), self._mute, member, audit_reason
+                        )
                     elif level == 3:
-                        await guild.kick(member, reason=audit_reason)
+                        await self.route_backoff.call(
+                            ("kick", guild.id), guild.kick, member, reason=audit_reason
+                        )
                     elif level == 4:
-                        await guild.ban(
+                        await self.route_backoff.call(
+                            ("ban", guild.id),
+                            guild.ban,
                             member,
                             reason=audit_reason,
                             delete_message_seconds=(
@@ -1174,14 +1410,18 @@ class API:
                             * 24
                             * 3600,
                         )
-                        await guild.unban(
+                        await self.route_backoff.call(
+                            ("ban", guild.id),
+                            guild.unban,
                             member,
                             reason=_(
                                 "Unbanning the softbanned member after cleaning up the messages."
                             ),
                         )
                     elif level == 5:
-                        await guild.ban(
+                        await self.route_backoff.call(
+                            ("ban", guild.id),
+                            guild.ban,
                             member,
                             reason=audit_reason,
                             delete_message_seconds=(
@@ -1197,13 +1437,20 @@ class API:
                         exc_info=e,
                     )
                     return e
-            # actions were taken, time to log
+            # actions were taken, time to log, without waiting for the modlog message
+            modlog_future = None
             if log_modlog:
-                modlog_message = await mod_channel.send(embed=modlog_e)
-            else:
-                modlog_message = None
+                modlog_future = self.modlog_dispatcher.dispatch(mod_channel, modlog_e)
             data = await self._create_case(
-                guild, member, author, level, date, reason, time, roles, modlog_message
+                guild,
+                member,
+                author,
+                level,
+                date,
+                reason,
+                time,
+                roles,
+                modlog_future=modlog_future,
             )
             # start timer if there is a temporary warning
             if time and (level == 2 or level == 5):
@@ -1292,140 +1539,215 @@ class API:
             date = datetime.now(timezone.utc)
 
         i = 0
-        fails = [await warn_member(x, audit_reason) for x in members if x]
+        members = [x for x in members if x]
+        if not concurrency or concurrency <= 1 or len(members) <= 1:
+            fails = [await warn_member(x, audit_reason) for x in members]
+            # all good!
+            return list(filter(None, fails))
+
+        # concurrent mode, results must be the same as above
+        semaphore = asyncio.Semaphore(concurrency)
+        aborted = False
+
+        async def worker(member: Union[discord.Member, UnavailableMember]):
+            nonlocal aborted
+            async with semaphore:
+                if aborted:
+                    # a previous member raised, the sequential path would have stopped there
+                    return None
+                try:
+                    return await warn_member(member, audit_reason)
+                except Exception as e:
+                    aborted = True
+                    # failures are returned as exception instances, keep raised ones apart
+                    return _Raised(e)
+
+        results = await asyncio.gather(*[worker(x) for x in members])
+        for result in results:
+            if isinstance(result, _Raised):
+                raise result.exception
         # all good!
-        return list(filter(None, fails))
+        return list(filter(None, results))
+
+    async def _reinvite(self, guild: discord.Guild, member, reason: str, duration: str):
+        channel = next(
+            (
+                c  # guild.text_channels is already sorted by position
+                for c in guild.text_channels
+                if c.permissions_for(guild.me).create_instant_invite
+            ),
+            None,
+        )
+        if channel is None:
+            # can't find a valid channel
+            log.info(
+                f"[Guild {guild.id}] Can't find a text channel where I can create an invite "
+                f"when reinviting {member} (ID: {member.id}) after its unban."
+            )
+            return
 
-    async def _check_endwarn(self):
-        async def reinvite(guild, user, reason, duration):
-            channel = next(
-                (
-                    c  # guild.text_channels is already sorted by position
-                    for c in guild.text_channels
-                    if c.permissions_for(guild.me).create_instant_invite
-                ),
-                None,
+        try:
+            invite = await channel.create_invite(max_uses=1)
+        except Exception as e:
+            log.warn(
+                f"[Guild {guild.id}] Couldn't create an invite to reinvite "
+                f"{member} (ID: {member.id}) after its unban.",
+                exc_info=e,
             )
-            if channel is None:
-                # can't find a valid channel
+        else:
+            try:
+                await member.send(
+                    _(
+                        "You were unbanned from {guild}, your temporary ban (reason: "
+                        "{reason}) just ended after {duration}.\nYou can join back using this "
+                        "invite: {invite}"
+                    ).format(guild=guild.name, reason=reason, duration=duration, invite=invite)
+                )
+            except discord.errors.Forbidden:
+                # couldn't send message to the user, quite common
                 log.info(
-                    f"[Guild {guild.id}] Can't find a text channel where I can create an invite "
-                    f"when reinviting {member} (ID: {member.id}) after its unban."
+                    f"[Guild {guild.id}] Couldn't reinvite member {member} "
+                    f"(ID: {member.id}) after its temporary ban."
                 )
-                return
 
-            try:
-                invite = await channel.create_invite(max_uses=1)
-            except Exception as e:
-                log.warn(
-                    f"[Guild {guild.id}] Couldn't create an invite to reinvite "
-                    f"{member} (ID: {member.id}) after its unban.",
-                    exc_info=e,
-                )
-            else:
-                try:
-                    await member.send(
-                        _(
-                            "You were unbanned from {guild}, your temporary ban (reason: "
-                            "{reason}) just ended after {duration}.\nYou can join back using this "
-                            "invite: {invite}"
-                        ).format(guild=guild.name, reason=reason, duration=duration, invite=invite)
-                    )
-                except discord.errors.Forbidden:
-                    # couldn't send message to the user, quite common
-                    log.info(
-                        f"[Guild {guild.id}] Couldn't reinvite member {member} "
-                        f"(ID: {member.id}) after its temporary ban."
-                    )
+    async def _end_temp_action(self, guild: discord.Guild, member_id: int, action: dict):
+        """
+        End a single expired temporary mute or ban.
 
+        Returns the member object to remove from the temporary actions. Like before, the action
+        is removed even if Discord refuses the unmute/unban.
+        """
         now = datetime.now(timezone.utc)
-        for guild in self.bot.guilds:
-            data = await self.cache.get_temp_action(guild)
-            if not data:
-                continue
-            to_remove = []
-            for member_id, action in data.items():
-                member_id = int(member_id)
+        try:
+            taken_on = self._get_datetime(action["time"])
+            duration = self._get_timedelta(action["duration"])
+        except (ValueError, TypeError, KeyError) as e:
+            log.error(
+                f"[Guild {guild.id}] Time or duration cannot be fetched. This is "
+                "probably leftovers from the conversion of post 1.3 data. Removing the "
+                f"temp warning, not taking actions... Member: {member_id}, data: {action}",
+                exc_info=e,
+            )
+            return UnavailableMember(self.bot, guild._state, member_id)
+        author = guild.get_member(action["author"])
+        member = guild.get_member(member_id)
+        case_reason = action["reason"]
+        level = action["level"]
+        action_str = _("mute") if level == 2 else _("ban")
+        if not member:
+            member = UnavailableMember(self.bot, guild._state, member_id)
+            if level == 2:
+                return member
+        roles = list(filter(None, [guild.get_role(x) for x in action.get("roles") or []]))
+
+        reason = _(
+            "End of timed {action} of {member} requested by {author} that lasted "
+            "for {time}. Reason of the {action}: {reason}"
+        ).format(
+            action=action_str,
+            member=member,
+            author=author if author else action["author"],
+            time=self._format_timedelta(duration),
+            reason=case_reason,
+        )
+        try:
+            if level == 2:
+                await self._unmute(member, reason=reason, old_roles=roles)
+            if level == 5:
+                await guild.unban(member, reason=reason)
+                if await self.data.guild(guild).reinvite():
+                    await self._reinvite(
+                        guild,
+                        member,
+                        case_reason,
+                        self._format_timedelta(timedelta(seconds=action["duration"])),
+                    )
+        except discord.errors.Forbidden:
+            log.warn(
+                f"[Guild {guild.id}] I lost required permissions for "
+                f"ending the timed {action_str}. Member {member} (ID: {member_id}) "
+                "will stay as it is now."
+            )
+        except discord.errors.HTTPException as e:
+            log.warn(
+                f"[Guild {guild.id}] Couldn't end the timed {action_str} of {member} "
+                f"(ID: {member_id}). He will stay as it is now.",
+                exc_info=e,
+            )
+        else:
+            log.debug(
+                f"[Guild {guild.id}] Ended timed {action_str} of {member} (ID: "
+                f"{member_id}) taken on {self._format_datetime(taken_on)} requested "
+                f"by {author} (ID: {author.id if author else action['author']}) "
+                f"that lasted for {self._format_timedelta(duration)} for the "
+                f"reason {case_reason}\n"
+                f"Current time: {now}\nExpected end time of warn: "
+                f"{self._format_datetime(taken_on + duration)}"
+            )
+        return member
+
+    async def _end_guild_temp_actions(self, guild: discord.Guild, member_ids: list):
+        semaphore = asyncio.Semaphore(self.temp_action_guild_concurrency)
+        actions = await self.cache.get_temp_action(guild)
+
+        async def end(member_id: int):
+            # keys are ints when added during this session, strings when loaded from Config
+            action = actions.get(member_id) or actions.get(str(member_id))
+            if action is None:
+                return None  # removed in the meantime
+            async with semaphore:
                 try:
-                    taken_on = self._get_datetime(action["time"])
-                    duration = self._get_timedelta(action["duration"])
-                except ValueError as e:
+                    return await self._end_temp_action(guild, member_id, action)
+                except Exception as e:
                     log.error(
-                        f"[Guild {guild.id}] Time or duration cannot be fetched. This is "
-                        "probably leftovers from the conversion of post 1.3 data. Removing the "
-                        f"temp warning, not taking actions... Member: {member_id}, data: {action}",
+                        f"[Guild {guild.id}] Error while ending the temporary action of "
+                        f"member {member_id}.",
                         exc_info=e,
                     )
-                    to_remove.append(UnavailableMember(self.bot, guild._state, member_id))
-                    continue
-                author = guild.get_member(action["author"])
-                member = guild.get_member(member_id)
-                case_reason = action["reason"]
-                level = action["level"]
-                action_str = _("mute") if level == 2 else _("ban")
-                if not member:
-                    member = UnavailableMember(self.bot, guild._state, member_id)
-                    if level == 2:
-                        to_remove.append(member)
-                        continue
-                roles = list(filter(None, [guild.get_role(x) for x in action.get("roles") or []]))
-
-                reason = _(
-                    "End of timed {action} of {member} requested by {author} that lasted "
-                    "for {time}. Reason of the {action}: {reason}"
-                ).format(
-                    action=action_str,
-                    member=member,
-                    author=author if author else action["author"],
-                    time=self._format_timedelta(duration),
-                    reason=case_reason,
+                    return UnavailableMember(self.bot, guild._state, member_id)
+
+        to_remove = await asyncio.gather(*(end(x) for x in member_ids))
+        to_remove = list(filter(None, to_remove))
+        if to_remove:
+            await self.cache.bulk_remove_temp_action(guild, to_remove)
+
+    async def _check_endwarn(self):
+        """
+        End every temporary action that expired. Guilds are processed concurrently, with at
+        most ``temp_action_guild_concurrency`` Discord calls per guild at once.
+        """
+        timers = self.cache.temp_action_timers
+        per_guild = {}
+        for guild_id, member_id in timers.pop_due():
+            per_guild.setdefault(guild_id, []).append(member_id)
+        if not per_guild:
+            return
+        jobs = []
+        for guild_id, member_ids in per_guild.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                # the loop starts once the bot is ready, the bot left the guild
+                log.info(
+                    f"[Guild {guild_id}] The bot left the guild, dropping its {len(member_ids)} "
+                    "expired temporary actions and the pending ones."
                 )
-                if (taken_on + duration) < now:
-                    # end of warn
-                    try:
-                        if level == 2:
-                            await self._unmute(member, reason=reason, old_roles=roles)
-                        if level == 5:
-                            await guild.unban(member, reason=reason)
-                            if await self.data.guild(guild).reinvite():
-                                await reinvite(
-                                    guild,
-                                    member,
-                                    case_reason,
-                                    self._format_timedelta(timedelta(seconds=action["duration"])),
-                                )
-                    except discord.errors.Forbidden:
-                        log.warn(
-                            f"[Guild {guild.id}] I lost required permissions for "
-                            f"ending the timed {action_str}. Member {member} (ID: {member_id}) "
-                            "will stay as it is now."
-                        )
-                    except discord.errors.HTTPException as e:
-                        log.warn(
-                            f"[Guild {guild.id}] Couldn't end the timed {action_str} of {member} "
-                            f"(ID: {member_id}). He will stay as it is now.",
-                            exc_info=e,
-                        )
-                    else:
-                        log.debug(
-                            f"[Guild {guild.id}] Ended timed {action_str} of {member} (ID: "
-                            f"{member_id}) taken on {self._format_datetime(taken_on)} requested "
-                            f"by {author} (ID: {author.id if author else action['author']}) "
-                            f"that lasted for {self._format_timedelta(duration)} for the "
-                            f"reason {case_reason}\n"
-                            f"Current time: {now}\nExpected end time of warn: "
-                            f"{self._format_datetime(taken_on + duration)}"
-                        )
-                    to_remove.append(member)
-            if to_remove:
-                await self.cache.bulk_remove_temp_action(guild, to_remove)
+                jobs.append(self.cache.clear_guild_temp_actions(guild_id))
+                continue
+            if guild.unavailable:
+                # Discord outage, retry later
+                retry = {"time": int(datetime.now(timezone.utc).timestamp()), "duration": 60}
+                for member_id in member_ids:
+                    timers.schedule(guild_id, member_id, retry)
+                continue
+            jobs.append(self._end_guild_temp_actions(guild, member_ids))
+        await asyncio.gather(*jobs)
 
     async def _loop_task(self):
         """
         This is an infinite loop task started with the cog that will check\
         if a temporary warn (mute or ban) is over, and cancel the action if it's true.
 
-        The loop runs every 10 seconds.
+        The loop sleeps until the next temporary action expires.
         """
         await self.bot.wait_until_ready()
         log.debug(
@@ -1434,6 +1756,7 @@ class API:
         )
         errors = 0
         while True:
+            await self.cache.temp_action_timers.wait()
             try:
                 await self._check_endwarn()
             except Exception as e:
@@ -1451,7 +1774,55 @@ class API:
                 log.error(
                     "Error in loop for unmutes and unbans. The loop will be resumed.", exc_info=e
                 )
-            await asyncio.sleep(10)
+
+    async def init_modlog_store(self):
+        """
+        Open the modlog backend selected with ``[p]warnset modlogbackend``.
+        """
+        if await self.data.modlog_backend() == "sqlite":
+            store = SQLiteModlogStore(cog_data_path(raw_name="WarnSystem") / "modlogs.db")
+            await store.open()
+            self.modlogs = store
+        else:
+            await self.modlogs.open()
+
+    async def set_modlog_backend(self, backend: str) -> int:
+        """
+        Copy all cases to a new backend then start using it.
+
+        The cases in the previous backend are kept, switching back overwrites them.
+
+        Parameters
+        ----------
+        backend: str
+            ``"config"`` or ``"sqlite"``.
+
+        Returns
+        -------
+        int
+            The number of cases copied.
+        """
+        # writes wait for the switch to end, or cases created during the copy would be lost
+        async with self.modlog_gate.switch():
+            if backend == self.modlogs.name:
+                return 0
+            if backend == "sqlite":
+                store = SQLiteModlogStore(cog_data_path(raw_name="WarnSystem") / "modlogs.db")
+                await store.open()
+            else:
+                store = ConfigModlogStore(self.data)
+            try:
+                total = await migrate_modlogs(self.modlogs, store)
+            except Exception:
+                await store.close()
+                raise
+            old_store, self.modlogs = self.modlogs, store
+            self.autowarn_counters.invalidate()
+            self.warn_stats.invalidate()
+            await self.data.modlog_backend.set(backend)
+            await old_store.close()
+        log.info(f"Switched the modlog backend to {backend}, {total} cases copied.")
+        return total
 
     # automod stuff
     def enable_automod(self):
@@ -1460,7 +1831,9 @@ class API:
         """
         log.info("Enabling automod listeners and event loops.")
         self.bot.add_listener(self.automod_on_message, name="on_message")
+        self.bot.add_listener(self.automod_on_message_edit, name="on_message_edit")
         self.automod_warn_task = self.bot.loop.create_task(self.automod_warn_loop())
+        self.antispam_sweep_task = self.bot.loop.create_task(self.antispam_sweep_loop())
 
     def disable_automod(self):
         """
@@ -1468,8 +1841,12 @@ class API:
         """
         log.info("Disabling automod listeners and event loops.")
         self.bot.remove_listener(self.automod_on_message, name="on_message")
+        self.bot.remove_listener(self.automod_on_message_edit, name="on_message_edit")
+        self.cache.message_digests.clear()
         if hasattr(self, "automod_warn_task"):
             self.automod_warn_task.cancel()
+        if hasattr(self, "antispam_sweep_task"):
+            self.antispam_sweep_task.cancel()
 
     async def _check_if_automod_valid(self, message: discord.Message):
         guild = message.guild
@@ -1493,15 +1870,20 @@ class API:
             return
         # we run all tasks concurrently
         # results are returned in the same order (either None or an exception)
-        regex_exception, antispam_exception = await asyncio.gather(
+        regex_result, antispam_exception = await asyncio.gather(
             self.automod_process_regex(message),
             self.automod_process_antispam(message),
             return_exceptions=True,
         )
-        if regex_exception:
+        if isinstance(regex_result, Exception):
             log.error(
                 f"[Guild {message.guild.id}] Error while processing message for regex automod.",
-                exc_info=regex_exception,
+                exc_info=regex_result,
+            )
+        elif self.cache.is_automod_regex_edited_enabled(message.guild):
+            # remember the content, edits of the message will only be checked if it changes
+            self.cache.message_digests.set(
+                message.id, content_digest(message.content), regex_result
             )
         if antispam_exception:
             log.error(
@@ -1510,10 +1892,22 @@ class API:
             )
 
     async def automod_on_message_edit(self, before: discord.Message, after: discord.Message):
+        # embeds unfurled and pins also trigger edits, without changing the content
+        if before.content == after.content or not after.guild:
+            return
+        if not self.cache.is_automod_regex_edited_enabled(after.guild):
+            return
+        digest = content_digest(after.content)
+        entry = self.cache.message_digests.get(after.id)
+        if entry is not None and entry[0] == digest:
+            return  # back to a content already checked
         if not await self._check_if_automod_valid(after):
             return
+        # triggers that matched the previous content were already applied
+        already_matched = entry[1] if entry is not None else frozenset()
         try:
-            await self.automod_process_regex(after)
+            matched = await self.automod_process_regex(after, skip=already_matched)
+            self.cache.message_digests.set(after.id, digest, already_matched | matched)
         except Exception as e:
             log.error(
                 f"[Guild {after.guild.id}] Error while "
@@ -1521,7 +1915,9 @@ class API:
                 exc_info=e,
             )
 
-    async def _safe_regex_search(self, regex: re.Pattern, message: discord.Message):
+    async def _safe_regex_search(
+        self, regex: re.Pattern, message: discord.Message, name: Optional[str] = None
+    ):
         """
         Mostly safe regex search to prevent reDOS from user defined regex patterns
 
@@ -1535,11 +1931,16 @@ class API:
         """
         guild = message.guild
         try:
-            process = self.re_pool.apply_async(regex.findall, (message.content,))
-            task = functools.partial(process.get, timeout=self.regex_timeout)
-            new_task = self.bot.loop.run_in_executor(None, task)
-            search = await asyncio.wait_for(new_task, timeout=self.regex_timeout + 5)
-        except TimeoutError:
+            search = await self.regex_engine.findall(
+                guild.id, name or regex.pattern, regex, message.content
+            )
+        except RegexTimeout as e:
+            if e.pattern is None:
+                log.warning(
+                    f"[Guild {guild.id}] Automod: regex job couldn't run in time, "
+                    f"skipping {name or regex.pattern} on this message."
+                )
+                return (True, [])
             error_msg = (
                 f"[Guild {guild.id}] Automod: regex process took too long. "
                 f"Removing from memory. Offending regex: {regex.pattern}"
@@ -1547,13 +1948,6 @@ class API:
             log.warning(error_msg)
             return (False, [])
             # we certainly don't want to be performing multiple triggers if this happens
-        except asyncio.TimeoutError:
-            error_msg = (
-                f"[Guild {guild.id}] Automod: regex asyncio timed out. "
-                f"Removing from memory. Offending regex: {regex.pattern}"
-            )
-            log.warning(error_msg)
-            return (False, [])
         except Exception:
             log.error(
                 f"[Guild {guild.id}] Automod regex encountered an error with {regex.pattern}",
@@ -1563,16 +1957,111 @@ class API:
         else:
             return (True, search)
 
-    async def automod_process_regex(self, message: discord.Message):
+    async def _safe_regex_search_many(
+        self, guild: discord.Guild, patterns: dict, content: str
+    ) -> Optional[dict]:
+        """
+        Run all of a guild's patterns on a message in a single process pool job.
+
+        The whole set shares one timeout (:attr:`RegexEngine.timeout`), counted from when a
+        worker starts the job. The message content is sent to a worker once instead of once
+        per pattern.
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild of the message, for logging.
+        patterns: dict
+            A dict of pattern name -> compiled :class:`re.Pattern`.
+        content: str
+            The message content.
+
+        If the job takes too long, the pattern running at that time is quarantined and the job
+        runs again without it. The pattern is never submitted again, the stuck worker is killed
+        with the pool.
+
+        Returns
+        -------
+        Optional[dict]
+            A dict of pattern name -> (first match or :py:obj:`None`, seconds spent), or
+            :py:obj:`None` if the job failed for another reason. In that case, the caller
+            should run the patterns individually to find the faulty one.
+        """
+        patterns = dict(patterns)
+        while patterns:
+            try:
+                return await self.regex_engine.search_many(guild.id, patterns, content)
+            except RegexTimeout as e:
+                if e.pattern is None:
+                    log.warning(
+                        f"[Guild {guild.id}] Automod: batched regex job took too long on an "
+                        "unknown pattern, skipping the message."
+                    )
+                    return {}
+                self.cache.quarantine_automod_regex(guild, e.pattern)
+                del patterns[e.pattern]
+            except Exception:
+                log.error(
+                    f"[Guild {guild.id}] Automod: batched regex job failed, "
+                    "running the patterns individually.",
+                    exc_info=True,
+                )
+                return None
+        return {}
+
+    async def _automod_regex_matches(self, message: discord.Message, all_regex: dict) -> list:
+        """
+        Return the names of the patterns matching the message, quarantining slow patterns.
+        """
+        guild = message.guild
+        patterns = {name: regex["regex"] for name, regex in all_regex.items()}
+        prefilter = await self.cache.get_automod_prefilter(guild)
+        # only patterns whose required literals appear in the message can match
+        patterns = {
+            name: patterns[name] for name in prefilter.candidates(message.content, patterns)
+        }
+        if not patterns:
+            return []
+        results = await self._safe_regex_search_many(guild, patterns, message.content)
+        if results is not None:
+            slowest = max(results.items(), key=lambda x: x[1][1], default=None)
+            if slowest:
+                log.debug(
+                    f"[Guild {guild.id}] Automod: {len(results)} regex evaluated, slowest is "
+                    f"{slowest[0]} ({slowest[1][1] * 1000:.2f}ms)"
+                )
+            return [name for name, (match, timing) in results.items() if match is not None]
+        # the batch failed, identify the culprit pattern by pattern
+        matches = []
+        for name, pattern in patterns.items():
+            success, search = await self._safe_regex_search(pattern, message, name)
+            if success is False:
+                self.cache.quarantine_automod_regex(guild, name)
+                continue
+            if search:
+                matches.append(name)
+        return matches
+
+    async def automod_process_regex(
+        self, message: discord.Message, skip: FrozenSet[str] = frozenset()
+    ) -> FrozenSet[str]:
+        """
+        Warn the author for each trigger matching the message, except the ones in ``skip``.
+
+        Returns the names of the matching triggers.
+        """
         guild = message.guild
         member = message.author
         all_regex = await self.cache.get_automod_regex(guild)
-        for name, regex in all_regex.items():
-            result = await self._safe_regex_search(regex["regex"], message)
-            if not result[1]:
-                if result[0] is False:
-                    await self.cache.remove_automod_regex(guild, name)
-                continue
+        if skip:
+            all_regex = {name: x for name, x in all_regex.items() if name not in skip}
+        if not all_regex:
+            return frozenset()
+        matches = await self._automod_regex_matches(message, all_regex)
+        for name in matches:
+            regex = all_regex.get(name)
+            if regex is None:
+                continue  # quarantined or removed meanwhile
             time = None
             if regex["time"]:
                 time = self._get_timedelta(regex["time"])
@@ -1593,11 +2082,11 @@ class API:
                     f"Level: {level}. Time: {time}. Reason: {reason}\n"
                     f"Original message: {message.content}"
                 )
+        return frozenset(matches)
 
     async def automod_process_antispam(self, message: discord.Message):
-        # we store the data in self.antispam
-        # keys are as follow: GUILD_ID > CHANNEL_ID > MEMBER_ID = tuple
-        # tuple contains list timestamps of recent messages + check if the member was warned
+        # we store the data in self.antispam, one record per (guild, channel, member)
+        # a record holds the timestamps of the recent messages + when the member was warned
         # if the antispam is triggered once, we send a message in the chat (refered as text warn)
         # if it's triggered a second time, an actual warn is given
         guild = message.guild
@@ -1606,61 +2095,37 @@ class API:
         antispam_data = await self.cache.get_automod_antispam(guild)
         if antispam_data is False:
             return
-        for word in antispam_data["whitelist"]:
-            if word in message.content:
-                return
-
-        # we slowly go across each key, if it doesn't exist, data is created then the
-        # function ends since there's no data to check
-        InitialData = namedtuple("InitialData", ["messages", "warned"])
-        data = InitialData(messages=[], warned=False)
-        try:
-            guild_data = self.antispam[guild.id]
-        except KeyError:
-            self.antispam[guild.id] = {channel.id: {member.id: data}}
-            return
-        else:
-            pass
-        try:
-            channel_data = guild_data[channel.id]
-        except KeyError:
-            self.antispam[guild.id][channel.id] = {member.id: data}
+        prefilter = await self.cache.get_automod_prefilter(guild)
+        if prefilter.whitelisted(message.content):
             return
-        else:
-            del guild_data
-        try:
-            data = channel_data[member.id]
-        except KeyError:
-            pass
-        del channel_data
 
-        data.messages.append(message.created_at)
-        # now we've got our list of timestamps, just gotta clean the old ones
-        data = data._replace(
-            messages=self._automod_clean_old_messages(
-                antispam_data["delay"], message.created_at, data.messages
-            )
+        now = message.created_at.timestamp()
+        delay_before_action = antispam_data["delay_before_action"]
+        record = self.antispam.add_message(
+            (guild.id, channel.id, member.id),
+            now,
+            max_messages=antispam_data["max_messages"],
+            delay=antispam_data["delay"],
+            delay_before_action=delay_before_action,
         )
-        if len(data.messages) <= antispam_data["max_messages"]:
+        if record is None:
             # antispam not triggered, we can exit now
-            self.antispam[guild.id][channel.id][member.id] = data
             return
         # at this point, user is considered to be spamming
         # we cleanup their x last messages (max_messages + 1), then either send a text warn
         # or perform an actual warnsystem warn (I'm confusing ik)
-        if (
-            data.warned is False
-            or (datetime.now() - data.warned).total_seconds()
-            < antispam_data["delay_before_action"]
+        if delay_before_action and (
+            not record.warned or now - record.warned > delay_before_action
         ):
-            bot_message = await channel.send(
+            record.reset(warned=now)
+            await channel.send(
                 _("{member} you're sending messages too fast!").format(member=member.mention),
                 delete_after=5,
             )
-            data = InitialData(messages=[], warned=bot_message.created_at)
         else:
             # already warned once within delay_before_action, gotta take actions
-            warn_data = antispam_data["warn"]
+            record.reset(warned=now)
+            warn_data = dict(antispam_data["warn"])
             warn_data["author"] = guild.me
             if warn_data["time"]:
                 warn_data["time"] = self._get_timedelta(warn_data["time"])
@@ -1668,45 +2133,39 @@ class API:
                 self.antispam_warn_queue[guild.id][member] = warn_data
             except KeyError:
                 self.antispam_warn_queue[guild.id] = {member: warn_data}
-            # also reset the data
-            data = InitialData(messages=[], warned=message.created_at)
-        self.antispam[guild.id][channel.id][member.id] = data
 
-    def _automod_clean_old_messages(self, delay: int, current_time: datetime, messages: list):
-        """
-        We don't keep messages older than the delay in the cache
-        """
-        message: datetime
-        delta: timedelta
-        new_list = []
-        for message in messages:
-            delta = current_time - message
-            if delta.total_seconds() <= delay:
-                new_list.append(message)
-        return new_list
-
-    def _automod_clean_cache(
-        self, guild: discord.Guild, channel: discord.TextChannel, member: discord.Member
-    ):
+    async def antispam_sweep_loop(self):
         """
-        We quickly end up with a dict filled with empty values, we gotta clean that.
+        Periodically evict antispam records of members who stopped talking, and autowarn
+        counters of members who weren't warned recently.
         """
-        del self.automod[guild.id][channel.id][member.id]
-        if not self.automod[guild.id][channel.id]:
-            del self.automod[guild.id][channel.id]
-            if not self.automod[guild.id]:
-                del self.automod[guild.id]
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            now = datetime.now(timezone.utc).timestamp()
+            evicted = self.antispam.sweep(now)
+            if evicted:
+                log.debug(
+                    f"Antispam: evicted {evicted} idle entries, {len(self.antispam)} remaining "
+                    f"({self.antispam.memory_usage() / 1024:.1f} KiB)."
+                )
+            evicted = self.autowarn_counters.sweep(now)
+            if evicted:
+                log.debug(
+                    f"Autowarn: evicted {evicted} idle counters, "
+                    f"{len(self.autowarn_counters)} remaining."
+                )
 
     async def automod_check_for_autowarn(
         self, guild: discord.Guild, member: discord.Member, author: discord.Member, level: int
     ):
         """
-        Iterate through member's modlog, looking for possible automatic warns.
+        Check the member's warning counters, looking for possible automatic warns.
 
         Level is the last warning's level, which will filter a lot of possible autowarns and,
         therefore, save performances.
 
-        This can be a heavy call if there are a lot of possible autowarns and a long modlog.
+        Counters are built from the modlog on the first check of a member, which can be a
+        heavy call with a long modlog. Following checks are cheap.
         """
         t = datetime.now()
         try:
@@ -1735,10 +2194,7 @@ class API:
         # so we look for conditions that confirms the member cannot be affected by automod
         if await self.bot.is_automod_immune(member):
             return
-        warns = await self.get_all_cases(guild, member)
-        if len(warns) < 2:
-            return  # autowarn can't be triggered with a single warning in the modlog
-        autowarns = await self.data.guild(guild).automod.warnings()
+        autowarns = await self.cache.get_automod_warnings(guild)
         # remove all autowarns that are locked to a specific level
         # where the last warning's level doesn't correspond
         # also remove autowarns that are automod only if warn author isn't the bot
@@ -1751,41 +2207,25 @@ class API:
         autowarns = list(filter(is_autowarn_valid, autowarns))
         if not autowarns:
             return  # no autowarn to iterate through
-        for i, autowarn in enumerate(autowarns):
-            # prepare for iteration
-            autowarns[i]["count"] = 0
-            # if the condition is met (within the specified time? not an automatic warn?)
-            # we increase this value until reaching the given limit
-            time = autowarn["time"]
-            if time:
-                until = datetime.now(timezone.utc) - timedelta(seconds=time)
-                autowarns[i]["until"] = until
-        del time
-        found_warnings = {}  # we fill this list with the valid autowarns, there can be more than 1
-        for warn in warns[::-1]:
-            to_remove = []  # list of autowarns to remove during the iteration (duration expired)
-            taken_on = datetime.fromtimestamp(warn["time"], timezone.utc)
-            for i, autowarn in enumerate(autowarns):
-                try:
-                    if autowarn["until"] >= taken_on:
-                        to_remove.append(i)
-                        continue
-                except KeyError:
-                    pass
-                autowarns[i]["count"] += 1
-                if autowarns[i]["count"] == autowarn["number"]:
-                    found_warnings[i] = autowarn["warn"]
-                if autowarns[i]["count"] > autowarn["number"]:
-                    # value exceeded, no need to continue, it's already done for this one warn
-                    to_remove.append(i)
-                    del found_warnings[i]
-            for index in reversed(to_remove):
-                autowarns.pop(index)
-            if not autowarns:
-                # we could be out of autowarns to check after a certain time
-                # no need to continue the iteration
-                break
-        del to_remove, taken_on, autowarns
+        now = datetime.now(timezone.utc).timestamp()
+        counter = await self.autowarn_counters.get(
+            guild.id,
+            member.id,
+            autowarns,
+            lambda: self.modlogs.count_member_cases(guild.id, member.id),
+            lambda since: self.modlogs.get_member_cases(guild.id, member.id, since=since),
+            now,
+        )
+        if counter.total < 2:
+            return  # autowarn can't be triggered with a single warning in the modlog
+        # an autowarn triggers when the member has exactly the required number of warnings
+        # within its duration (or in the entire modlog if there is no duration)
+        found_warnings = {
+            i: autowarn["warn"]
+            for i, autowarn in enumerate(autowarns)
+            if counter.count(autowarn["time"] and int(autowarn["time"]), now)
+            == autowarn["number"]
+        }
         for i, warn in found_warnings.items():
             try:
                 await self.warn(
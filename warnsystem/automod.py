@@ -14,6 +14,7 @@ from datetime import timedelta
 
 from .abc import MixinMeta
 from .converters import ValidRegex
+from .regex_engine import HISTOGRAM_LABELS
 
 _ = Translator("WarnSystem", __file__)
 
@@ -189,10 +190,14 @@ class AutomodMixin(MixinMeta):
         Delete a Regex trigger.
         """
         guild = ctx.guild
-        if name not in await self.cache.get_automod_regex(guild):
+        if (
+            name not in await self.cache.get_automod_regex(guild)
+            and name not in self.cache.get_quarantined_automod_regex(guild)
+        ):
             await ctx.send(_("That Regex trigger doesn't exist."))
             return
         await self.cache.remove_automod_regex(guild, name)
+        self.api.regex_engine.forget(guild.id, name)
         await ctx.send(_("Regex trigger removed."))
 
     @automod_regex.command(name="list")
@@ -202,14 +207,19 @@ class AutomodMixin(MixinMeta):
         """
         guild = ctx.guild
         automod_regex = await self.cache.get_automod_regex(guild)
+        quarantined = self.cache.get_quarantined_automod_regex(guild)
         text = ""
-        if not automod_regex:
+        if not automod_regex and not quarantined:
             await ctx.send(_("Nothing registered."))
             return
         for name, value in automod_regex.items():
             text += (
                 f"+ {name}\nLevel {value['level']} warning. Reason: {value['reason'][:40]}...\n\n"
             )
+        for name, value in quarantined.items():
+            text += _(
+                "- {name}\nQuarantined (timed out). Add it again or reload the cog to enable it.\n\n"
+            ).format(name=name)
         messages = []
         pages = list(pagify(text, delims=["\n\n", "\n"], priority=True, page_length=1900))
         for i, page in enumerate(pages):
@@ -274,6 +284,53 @@ class AutomodMixin(MixinMeta):
                 )
             )
 
+    @automod_regex.command(name="slow")
+    async def automod_regex_slow(self, ctx: commands.Context):
+        """
+        List the Regex triggers flagged as slow.
+
+        A trigger is flagged when evaluating it on a message takes longer than the slow \
+threshold, before it reaches the timeout and gets quarantined.
+        """
+        guild = ctx.guild
+        engine = self.api.regex_engine
+        slow = engine.slow_patterns(guild.id)
+        if not slow:
+            await ctx.send(
+                _("No slow Regex trigger (threshold: {threshold}ms).").format(
+                    threshold=int(engine.slow_threshold * 1000)
+                )
+            )
+            return
+        text = ""
+        for name, stats in slow:
+            text += _(
+                "- {name}\n"
+                "Runs: {runs}, slow: {slow}, timeouts: {timeouts}, match rate: {rate:.1%}\n"
+                "Mean: {mean:.2f}ms, max: {max:.2f}ms\n"
+                "Histogram: {histogram}\n\n"
+            ).format(
+                name=name,
+                runs=stats.runs,
+                slow=stats.slow,
+                timeouts=stats.timeouts,
+                rate=stats.match_rate,
+                mean=stats.mean * 1000,
+                max=stats.max * 1000,
+                histogram=" ".join(
+                    f"{label}:{count}"
+                    for label, count in zip(HISTOGRAM_LABELS, stats.histogram)
+                    if count
+                ),
+            )
+        messages = []
+        pages = list(pagify(text, delims=["\n\n", "\n"], priority=True, page_length=1900))
+        for i, page in enumerate(pages):
+            messages.append(
+                _("Page {i}/{total}").format(i=i + 1, total=len(pages)) + box(page, "diff")
+            )
+        await menus.menu(ctx, pages=messages, controls=menus.DEFAULT_CONTROLS)
+
     @automod.group(name="warn")
     async def automod_warn(self, ctx: commands.Context):
         """
@@ -426,6 +483,7 @@ set them a level 3 warning with the given reason.
                     },
                 }
             )
+        await self.cache.update_automod_warnings(guild)
         await ctx.send(_("The new automatic warn was successfully saved!"))
 
     @automod_warn.command(name="delete", aliases=["del", "remove"])
@@ -470,6 +528,7 @@ set them a level 3 warning with the given reason.
                 await ctx.send(_("The auto warn wasn't deleted."))
                 return
             warnings.pop(index)
+        await self.cache.update_automod_warnings(guild)
         await ctx.send(_("Automated warning successfully deleted."))
 
     @automod_warn.command(name="list")
@@ -702,7 +761,7 @@ automod infractions, like a mute after 3 warns.
                     await ctx.send(_("`{word}` is already in the whitelist.").format(word=word))
                     return
             whitelist.extend(words)
-        await self.cache.update_automod_antispam()
+        await self.cache.update_automod_antispam(guild)
         if len(words) == 1:
             await ctx.send(_("Added one word to the whitelist."))
         else:
@@ -724,8 +783,8 @@ automod infractions, like a mute after 3 warns.
                 if word not in whitelist:
                     await ctx.send(_("`{word}` isn't in the whitelist.").format(word=word))
                     return
-            whitelist = [x for x in whitelist if x not in words]
-        await self.cache.update_automod_antispam()
+            whitelist[:] = [x for x in whitelist if x not in words]
+        await self.cache.update_automod_antispam(guild)
         if len(words) == 1:
             await ctx.send(_("Removed one word from the whitelist."))
         else:
@@ -754,7 +813,7 @@ automod infractions, like a mute after 3 warns.
         """
         guild = ctx.guild
         await self.data.guild(guild).automod.antispam.whitelist.set([])
-        await self.cache.update_automod_antispam()
+        await self.cache.update_automod_antispam(guild)
         await ctx.tick()
 
     @automod_antispam.command(name="info")
@@ -817,5 +876,14 @@ automod infractions, like a mute after 3 warns.
                 "Reason: {reason}"
             ).format(level=level, reason=reason, time=time),
         )
+        embed.set_footer(
+            text=_(
+                "{members} members tracked here. Antispam cache: {entries} entries, {size} KiB."
+            ).format(
+                members=self.api.antispam.guild_count(guild.id),
+                entries=len(self.api.antispam),
+                size=round(self.api.antispam.memory_usage() / 1024, 1),
+            )
+        )
         embed.color = await self.bot.get_embed_color(ctx)
         await ctx.send(embed=embed)
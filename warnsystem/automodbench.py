@@ -0,0 +1,332 @@
+"""
+Replay synthetic message streams through the automod and measure its throughput.
+
+Run with ``python -m warnsystem.automodbench`` in an environment where Red is installed.
+Discord objects, Config and warns are stubbed; the regexes still run in the real process pool.
+"""
+
+import asyncio
+import copy
+import random
+import re
+import time
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .antispam import SWEEP_INTERVAL
+from .api import API
+from .cache import MemoryCache
+
+DEFAULT_PATTERNS = {
+    "invite": r"(?:discord\.gg|discord(?:app)?\.com/invite)/\w+",
+    "shortener": r"https?://(?:bit\.ly|tinyurl\.com)/\S+",
+    "scam": r"\b(?:free nitro|steam gift|claim your prize)\b",
+    "mass_mention": r"(?:<@!?\d+>\s*){5,}",
+    "caps": r"\b[A-Z]{15,}\b",
+}
+DEFAULT_ANTISPAM = {
+    "enabled": True,
+    "max_messages": 5,
+    "delay": 2,
+    "delay_before_action": 60,
+    "warn": {"level": 1, "reason": "Sending messages too fast!", "time": None},
+    "whitelist": [],
+}
+WORDS = (
+    "hello there how are you doing today the game was great last night anyone up for a match "
+    "I think we should check the patch notes first lol that build is broken again gg wp"
+).split()
+TRIGGERS = (
+    "join discord.gg/abcdef now",
+    "free nitro here https://bit.ly/3xYz",
+    "<@1> <@2> <@3> <@4> <@5> <@6>",
+    "WHYISNOBODYANSWERINGME",
+)
+STAGES = ("immunity", "regex", "antispam", "total")
+
+
+class _Bot:
+    def get_user(self, user_id: int):
+        return None
+
+    async def is_automod_immune(self, message) -> bool:
+        return False
+
+    async def is_mod(self, member) -> bool:
+        return False
+
+
+class _Value:
+    """
+    Read-only stand-in for a Config group or value, over a dict.
+    """
+
+    def __init__(self, value):
+        self._value = value
+
+    def __getattr__(self, name: str) -> "_Value":
+        return _Value(self._value[name])
+
+    async def __call__(self):
+        return copy.deepcopy(self._value)
+
+    async def all(self):
+        return copy.deepcopy(self._value)
+
+
+class _Config:
+    """
+    Answer the reads the cache falls back to, such as the regexes once one is quarantined.
+    """
+
+    def __init__(self, guild_data: dict):
+        self._guild_data = guild_data
+
+    def guild(self, guild) -> _Value:
+        return _Value(self._guild_data)
+
+
+class _Guild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = "Benchmark"
+        self.owner_id = 0
+        self.me = _Member(1, self)
+
+
+class _Member:
+    __slots__ = ("id", "guild", "bot", "name", "mention")
+
+    def __init__(self, member_id: int, guild: _Guild):
+        self.id = member_id
+        self.guild = guild
+        self.bot = False
+        self.name = f"member{member_id}"
+        self.mention = f"<@{member_id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class _Channel:
+    def __init__(self, channel_id: int, guild: _Guild):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class _Message:
+    __slots__ = ("id", "guild", "channel", "author", "content", "created_at")
+
+    def __init__(self, message_id, channel, author, content, created_at):
+        self.id = message_id
+        self.guild = channel.guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+
+
+def synthetic_messages(
+    count: int,
+    *,
+    authors: int = 500,
+    channels: int = 20,
+    rate: float = 50.0,
+    spam_rate: float = 0.01,
+    burst: int = 8,
+    burst_interval: float = 0.2,
+    trigger_rate: float = 0.01,
+    seed: int = 0,
+) -> List[_Message]:
+    """
+    Generate a stream of messages sorted by date.
+
+    Messages arrive at ``rate`` per second on average. ``spam_rate`` is the chance for each
+    message to start a burst of ``burst`` messages from the same author in the same channel,
+    ``trigger_rate`` the chance for a message to match one of :data:`DEFAULT_PATTERNS`.
+    """
+    rng = random.Random(seed)
+    guild = _Guild(10**17)
+    members = [_Member(10**17 + i, guild) for i in range(2, authors + 2)]
+    all_channels = [_Channel(10**17 + i, guild) for i in range(channels)]
+
+    def content():
+        if rng.random() < trigger_rate:
+            return rng.choice(TRIGGERS)
+        return " ".join(rng.choices(WORDS, k=rng.randint(1, 20)))
+
+    events = []
+    now = datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp()
+    while len(events) < count:
+        now += rng.expovariate(rate)
+        author, channel = rng.choice(members), rng.choice(all_channels)
+        if rng.random() < spam_rate:
+            for i in range(burst):
+                events.append((now + i * burst_interval, channel, author, content()))
+        else:
+            events.append((now, channel, author, content()))
+    events.sort(key=lambda x: x[0])
+    return [
+        _Message(10**18 + i, channel, author, text, datetime.fromtimestamp(ts, tz=timezone.utc))
+        for i, (ts, channel, author, text) in enumerate(events[:count])
+    ]
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def _replay(
+    messages: List[_Message],
+    patterns: Dict[str, str],
+    antispam: Optional[dict],
+    sample_every: int,
+) -> Dict[str, Any]:
+    bot = _Bot()
+    guild = messages[0].guild
+    config = _Config(
+        {
+            "automod": {
+                "regex": {
+                    name: {"regex": x, "level": 1, "time": None, "reason": name}
+                    for name, x in patterns.items()
+                },
+                "antispam": antispam or dict(DEFAULT_ANTISPAM, enabled=False),
+            }
+        }
+    )
+    cache = MemoryCache(bot, config)
+    cache.automod_enabled.append(guild.id)
+    cache.automod_antispam[guild.id] = antispam or False
+    cache.automod_regex[guild.id] = {
+        name: {"regex": re.compile(x), "level": 1, "time": None, "reason": name}
+        for name, x in patterns.items()
+    }
+    api = API(bot, config, cache)
+    warns = defaultdict(int)
+
+    async def warn(guild, members, author, level, reason=None, *args, **kwargs):
+        warns[reason] += len(members)
+        return False
+
+    api.warn = warn
+    timings = {x: [] for x in STAGES}
+    # automod_on_message only logs the errors of its stages, the benchmark must not time them
+    errors = []
+
+    def timed(stage, func):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                errors.append((stage, e))
+                raise
+            finally:
+                timings[stage].append(time.perf_counter() - start)
+
+        return wrapper
+
+    # instance attributes shadow the methods called by automod_on_message
+    api._check_if_automod_valid = timed("immunity", api._check_if_automod_valid)
+    api.automod_process_regex = timed("regex", api.automod_process_regex)
+    api.automod_process_antispam = timed("antispam", api.automod_process_antispam)
+    on_message = timed("total", api.automod_on_message)
+
+    memory = []
+    queued = 0
+    last_sweep = messages[0].created_at.timestamp()
+    start = time.perf_counter()
+    try:
+        for i, message in enumerate(messages):
+            await on_message(message)
+            if errors:
+                stage, error = errors[0]
+                raise RuntimeError(f"The {stage} stage failed on message {i}.") from error
+            now = message.created_at.timestamp()
+            if now - last_sweep >= SWEEP_INTERVAL:
+                # what antispam_sweep_loop does, on the synthetic clock
+                api.antispam.sweep(now)
+                last_sweep = now
+            if api.antispam_warn_queue:
+                # automod_warn_loop isn't running, count and drop the queued warns
+                queued += sum(len(x) for x in api.antispam_warn_queue.values())
+                api.antispam_warn_queue.clear()
+            if i % sample_every == 0:
+                memory.append((i, len(api.antispam), api.antispam.memory_usage()))
+        elapsed = time.perf_counter() - start
+    finally:
+        api.regex_engine.close()
+    memory.append((len(messages), len(api.antispam), api.antispam.memory_usage()))
+    return {
+        "messages": len(messages),
+        "seconds": elapsed,
+        "per_second": len(messages) / elapsed if elapsed else 0.0,
+        "stages": {
+            stage: {
+                "calls": len(values),
+                "total_ms": sum(values) * 1000,
+                "p50_ms": _percentile(values, 50) * 1000,
+                "p99_ms": _percentile(values, 99) * 1000,
+                "max_ms": max(values, default=0.0) * 1000,
+            }
+            for stage, values in timings.items()
+        },
+        "regex_warns": sum(warns.values()),
+        "antispam_text_warns": sum(x.sent for x in {m.channel for m in messages}),
+        "antispam_warns": queued,
+        "antispam_memory": memory,
+        "antispam_peak_bytes": max(x[2] for x in memory),
+    }
+
+
+def benchmark(
+    count: int = 10_000,
+    *,
+    patterns: Optional[Dict[str, str]] = None,
+    antispam: Optional[dict] = DEFAULT_ANTISPAM,
+    sample_every: int = 1000,
+    **stream,
+) -> Dict[str, Any]:
+    """
+    Replay ``count`` synthetic messages through :meth:`~warnsystem.api.API.automod_on_message`.
+
+    ``stream`` is passed to :func:`synthetic_messages`. Pass ``antispam=None`` to disable the
+    antispam. Returns the throughput, the time spent in each stage and samples of the antispam
+    state size as ``(messages processed, entries, bytes)``.
+    """
+    messages = synthetic_messages(count, **stream)
+    if patterns is None:
+        patterns = DEFAULT_PATTERNS
+    return asyncio.run(_replay(messages, patterns, antispam, sample_every))
+
+
+if __name__ == "__main__":
+    result = benchmark()
+    print(
+        "{messages} messages in {seconds:.2f}s, {per_second:.0f} messages/s\n"
+        "{regex_warns} regex warns, {antispam_text_warns} antispam text warns, "
+        "{antispam_warns} antispam warns".format(**result)
+    )
+    for stage, stats in result["stages"].items():
+        print(
+            f"{stage:>9}: {stats['calls']:>7} calls, {stats['total_ms']:10.2f}ms total, "
+            f"p50 {stats['p50_ms']:7.3f}ms, p99 {stats['p99_ms']:7.3f}ms, "
+            f"max {stats['max_ms']:7.3f}ms"
+        )
+    for processed, entries, size in result["antispam_memory"]:
+        print(
+            f"antispam after {processed:>7} messages: {entries:>6} entries, "
+            f"{size / 1024:.1f} KiB"
+        )
@@ -0,0 +1,144 @@
+import bisect
+
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class MemberCounter:
+    """
+    Number of warnings of a member, in total and within each autowarn duration.
+
+    ``windows`` maps a duration in seconds to the sorted timestamps of the member's warnings
+    issued within that duration. Expired timestamps are dropped when counting.
+    """
+
+    __slots__ = ("total", "windows")
+
+    def __init__(self, durations: Iterable[int]):
+        self.total = 0
+        self.windows: Dict[int, Deque[int]] = {x: deque() for x in durations}
+
+    def add(self, timestamp: int):
+        self.total += 1
+        for times in self.windows.values():
+            if not times or times[-1] <= timestamp:
+                times.append(timestamp)
+            else:
+                times.insert(bisect.bisect_right(times, timestamp), timestamp)
+
+    def remove(self, timestamp: int):
+        self.total = max(0, self.total - 1)
+        for times in self.windows.values():
+            try:
+                times.remove(timestamp)
+            except ValueError:
+                pass  # already expired
+
+    def count(self, duration: Optional[int], now: float) -> int:
+        if not duration:
+            return self.total
+        times = self.windows[duration]
+        until = now - duration
+        while times and times[0] <= until:
+            times.popleft()
+        return len(times)
+
+    def idle(self, now: float) -> bool:
+        # no warning within any window, only the total is left and it's cheap to rebuild
+        return all(not times or times[-1] <= now - x for x, times in self.windows.items())
+
+
+class AutowarnCounters:
+    """
+    Per member warning counters used by the automatic warnings, so the modlog doesn't have to
+    be read and walked after every warn.
+
+    Counters are built from the modlog the first time a member is checked, then updated when
+    cases are created or deleted. Bulk edits of the modlog invalidate them.
+    """
+
+    def __init__(self):
+        self.members: Dict[Tuple[int, int], MemberCounter] = {}
+        # keys being built and whether a case was edited meanwhile
+        self._building: Dict[Tuple[int, int], bool] = {}
+
+    def __len__(self):
+        return len(self.members)
+
+    @staticmethod
+    def durations(autowarns: List[dict]) -> Set[int]:
+        return {int(x["time"]) for x in autowarns if x["time"]}
+
+    async def get(
+        self,
+        guild_id: int,
+        member_id: int,
+        autowarns: List[dict],
+        count_cases: Callable[[], Awaitable[int]],
+        load_cases: Callable[[int], Awaitable[List[dict]]],
+        now: float,
+    ) -> MemberCounter:
+        """
+        Return the counter of a member, building it if needed.
+
+        ``count_cases()`` returns the total number of cases of the member and
+        ``load_cases(since)`` the cases issued after the given timestamp.
+        """
+        key = (guild_id, member_id)
+        durations = self.durations(autowarns)
+        counter = self.members.get(key)
+        if counter is not None and durations.issubset(counter.windows):
+            return counter
+        while True:
+            self._building[key] = False
+            counter = MemberCounter(durations)
+            counter.total = await count_cases()
+            if durations:
+                cases = await load_cases(int(now) - max(durations))
+                for timestamp in sorted(x["time"] for x in cases if x["time"] is not None):
+                    for duration, times in counter.windows.items():
+                        if timestamp > now - duration:
+                            times.append(timestamp)
+            if self._building.pop(key, False) is False:
+                break
+            # the modlog was edited during the build, start over
+        self.members[key] = counter
+        return counter
+
+    def add_case(self, guild_id: int, member_id: int, timestamp: int):
+        key = (guild_id, member_id)
+        if key in self._building:
+            self._building[key] = True
+        counter = self.members.get(key)
+        if counter is not None:
+            counter.add(timestamp)
+
+    def remove_case(self, guild_id: int, member_id: int, timestamp: int):
+        key = (guild_id, member_id)
+        if key in self._building:
+            self._building[key] = True
+        counter = self.members.get(key)
+        if counter is not None:
+            counter.remove(timestamp)
+
+    def invalidate(self, guild_id: Optional[int] = None):
+        """
+        Drop the counters of a guild, or all counters. They are rebuilt on next use.
+        """
+        for key in self._building:
+            self._building[key] = True
+        if guild_id is None:
+            self.members.clear()
+            return
+        for key in [x for x in self.members if x[0] == guild_id]:
+            del self.members[key]
+
+    def sweep(self, now: float) -> int:
+        """
+        Drop the counters of members without warnings within their longest autowarn duration.
+        Returns the number of dropped counters.
+        """
+        idle = [key for key, counter in self.members.items() if counter.idle(now)]
+        for key in idle:
+            del self.members[key]
+        return len(idle)
@@ -0,0 +1,271 @@
+import asyncio
+import discord
+import logging
+
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+log = logging.getLogger("red.laggron.warnsystem")
+
+# Discord allows up to 10 embeds in a single message
+MAX_EMBEDS_PER_MESSAGE = 10
+
+
+def get_retry_after(exception: discord.errors.HTTPException, default: float) -> float:
+    """
+    Read the delay sent by Discord with a 429 response, fall back to ``default``.
+    """
+    retry_after = getattr(exception, "retry_after", None)
+    if retry_after is None:
+        response = getattr(exception, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        retry_after = headers.get("Retry-After")
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return default
+
+
+class RouteBackoff:
+    """
+    Pause calls made on a route after Discord answers with a 429.
+
+    discord.py already waits for the rate limits it knows about, but when many members are
+    warned at once some requests still end up with a 429. Workers then wait for the route to be
+    free again instead of hammering it, while other routes keep going.
+    """
+
+    def __init__(self, retries: int = 3):
+        self.retries = retries
+        self._blocked_until: Dict[Hashable, float] = {}
+
+    async def wait(self, route: Hashable):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self._blocked_until.get(route, 0) - loop.time()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def call(self, route: Hashable, func: Callable[..., Awaitable], *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)``, retrying with a backoff if it is rate limited.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            await self.wait(route)
+            try:
+                return await func(*args, **kwargs)
+            except discord.errors.HTTPException as e:
+                if e.status != 429 or attempt >= self.retries:
+                    raise
+                delay = get_retry_after(e, default=2**attempt)
+                self._blocked_until[route] = max(
+                    self._blocked_until.get(route, 0), loop.time() + delay
+                )
+                log.warning(f"Rate limited on route {route}, retrying in {delay:.2f}s.")
+
+
+class ModlogBatch:
+    """
+    Group the modlog embeds sent in a channel, up to 10 per message.
+
+    :py:meth:`add` returns a future resolved with the message and the index of the embed in
+    it, once the message is sent.
+    """
+
+    def __init__(
+        self,
+        channel: discord.TextChannel,
+        backoff: Optional[RouteBackoff] = None,
+        *,
+        delay: float = 0.5,
+    ):
+        self.channel = channel
+        self.backoff = backoff or RouteBackoff()
+        self.delay = delay
+        self._pending: List[Tuple[discord.Embed, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, embed: discord.Embed) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((embed, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if len(self._pending) >= MAX_EMBEDS_PER_MESSAGE:
+            self._full.set()
+        return future
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < MAX_EMBEDS_PER_MESSAGE:
+                # give other members some time to fill the message
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._pending[:MAX_EMBEDS_PER_MESSAGE]
+            del self._pending[:MAX_EMBEDS_PER_MESSAGE]
+            await self._send(batch)
+
+    async def _send(self, batch: List[Tuple[discord.Embed, asyncio.Future]]):
+        try:
+            message = await self.backoff.call(
+                ("modlog", self.channel.id), self.channel.send, embeds=[x[0] for x in batch]
+            )
+        except Exception as e:
+            for _embed, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for index, (_embed, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((message, index))
+
+
+class ModlogDispatcher:
+    """
+    Queue the modlog embeds of all warns, with one :class:`ModlogBatch` per modlog channel.
+
+    Warns enqueue their embed and go on, the embeds sent within the same short delay in a
+    channel are packed in the same message. Rate limits are handled per channel.
+    """
+
+    def __init__(self, backoff: Optional[RouteBackoff] = None, *, delay: float = 0.25):
+        self.backoff = backoff or RouteBackoff()
+        self.delay = delay
+        self.batches: Dict[int, ModlogBatch] = {}
+
+    def dispatch(self, channel: discord.TextChannel, embed: discord.Embed) -> asyncio.Future:
+        """
+        Enqueue an embed. Returns a future resolved with the message and the index of the embed
+        in it, or with the exception raised when sending it.
+        """
+        batch = self.batches.get(channel.id)
+        if batch is None or batch.channel is not channel:
+            batch = self.batches[channel.id] = ModlogBatch(
+                channel, self.backoff, delay=self.delay
+            )
+        return batch.add(embed)
+
+    def pending(self) -> int:
+        return sum(len(x._pending) for x in self.batches.values())
+
+
+# (channel, role, overwrite, reason)
+OverwriteJob = Tuple[discord.abc.GuildChannel, discord.Role, discord.PermissionOverwrite, str]
+
+
+class OverwriteQueue:
+    """
+    Apply the mute role's permission overwrites on channels, per guild.
+
+    Channels enqueued within ``delay`` seconds in a guild are edited together, with at most
+    ``concurrency`` requests at once. A 429 pauses the whole guild, since its channels share
+    the rate limits of the permissions route.
+    """
+
+    def __init__(
+        self,
+        backoff: Optional[RouteBackoff] = None,
+        *,
+        concurrency: int = 4,
+        delay: float = 1.0,
+        progress_interval: float = 2.0,
+    ):
+        self.backoff = backoff or RouteBackoff()
+        self.concurrency = concurrency
+        self.delay = delay
+        self.progress_interval = progress_interval
+        self.pending: Dict[int, Dict[int, OverwriteJob]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def enqueue(
+        self,
+        channel: discord.abc.GuildChannel,
+        role: discord.Role,
+        overwrite: discord.PermissionOverwrite,
+        reason: str,
+    ):
+        """
+        Queue an overwrite, applied with the other channels of the guild after a short delay.
+        A channel enqueued twice is only edited once, with the last overwrite.
+        """
+        guild_id = channel.guild.id
+        self.pending.setdefault(guild_id, {})[channel.id] = (channel, role, overwrite, reason)
+        task = self._tasks.get(guild_id)
+        if task is None or task.done():
+            self._tasks[guild_id] = asyncio.create_task(self._flush(guild_id))
+
+    async def _flush(self, guild_id: int):
+        while self.pending.get(guild_id):
+            await asyncio.sleep(self.delay)
+            jobs = list(self.pending.pop(guild_id, {}).values())
+            failed = await self.apply(guild_id, jobs)
+            for channel, error in failed:
+                if isinstance(error, discord.errors.Forbidden):
+                    log.warning(
+                        f"[Guild {guild_id}] Couldn't update permissions of new channel "
+                        f"{channel.name} (ID: {channel.id}) due to a permission error."
+                    )
+                elif not isinstance(error, discord.errors.NotFound):  # channel deleted since
+                    log.error(
+                        f"[Guild {guild_id}] Couldn't update permissions of new channel "
+                        f"{channel.name} (ID: {channel.id}) due to an unknown error.",
+                        exc_info=error,
+                    )
+
+    async def apply(
+        self,
+        guild_id: int,
+        jobs: List[OverwriteJob],
+        progress: Optional[Callable[[int, int], Awaitable]] = None,
+    ) -> List[Tuple[discord.abc.GuildChannel, Exception]]:
+        """
+        Apply the overwrites now and return the channels that failed with their exception.
+
+        ``progress(done, total)`` is awaited every ``progress_interval`` seconds and once at
+        the end.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed = []
+        total = len(jobs)
+        done = 0
+        last_report = loop.time()
+
+        async def report():
+            try:
+                await progress(done, total)
+            except Exception as e:
+                log.debug(f"[Guild {guild_id}] Failed to report progress.", exc_info=e)
+
+        async def edit(channel, role, overwrite, reason):
+            nonlocal done, last_report
+            async with semaphore:
+                try:
+                    await self.backoff.call(
+                        ("permissions", guild_id),
+                        channel.set_permissions,
+                        role,
+                        overwrite=overwrite,
+                        reason=reason,
+                    )
+                except Exception as e:
+                    failed.append((channel, e))
+            done += 1
+            if progress is not None and loop.time() - last_report >= self.progress_interval:
+                last_report = loop.time()
+                await report()
+
+        await asyncio.gather(*(edit(*x) for x in jobs))
+        if progress is not None:
+            await report()
+        return failed
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self.pending.clear()
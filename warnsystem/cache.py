@@ -1,6 +1,5 @@
 import discord
 import logging
-import contextlib
 import re
 
 from redbot.core import Config
@@ -8,6 +7,10 @@ from redbot.core.bot import Red
 
 from typing import Mapping, Optional
 
+from .digests import MessageDigests
+from .prefilter import LiteralPrefilter
+from .timers import TempActionTimers
+
 log = logging.getLogger("red.laggron.warnsystem")
 
 
@@ -22,11 +25,17 @@ class MemoryCache:
         self.data = config
 
         self.mute_roles = {}
+        self.update_mute = {}
         self.temp_actions = {}
+        self.temp_action_timers = TempActionTimers()
         self.automod_enabled = []
         self.automod_antispam = {}
         self.automod_regex = {}
+        self.automod_regex_quarantine = {}
         self.automod_regex_edited = []
+        self.automod_prefilter = {}
+        self.automod_warnings = {}
+        self.message_digests = MessageDigests()  # see API.automod_on_message_edit
 
     async def init_automod_enabled(self):
         for guild_id, data in (await self.data.all_guilds()).items():
@@ -38,6 +47,17 @@ class MemoryCache:
             except KeyError:
                 pass
 
+    async def init_temp_actions(self):
+        """
+        Load every temporary action in the cache and schedule their end.
+        """
+        for guild_id, data in (await self.data.all_guilds()).items():
+            actions = data.get("temporary_warns")
+            if not actions:
+                continue
+            self.temp_actions[guild_id] = actions
+            self.temp_action_timers.schedule_guild(guild_id, actions)
+
     async def _debug_info(self) -> str:
         """
         Compare the cached data to the Config data. Text is logged (INFO) then returned.
@@ -55,7 +75,8 @@ class MemoryCache:
             f"Debug info requested\n"
             f"{mute_roles_cached}/{mute_roles} mute roles loaded in cache.\n"
             f"{guild_temp_actions_cached}/{guild_temp_actions} guilds with temp actions loaded in cache.\n"
-            f"{temp_actions_cached}/{temp_actions} temporary actions loaded in cache."
+            f"{temp_actions_cached}/{temp_actions} temporary actions loaded in cache.\n"
+            f"{len(self.temp_action_timers)} temporary actions scheduled."
         )
         log.info(text)
         return text
@@ -72,15 +93,26 @@ class MemoryCache:
         await self.data.guild(guild).mute_role.set(role.id)
         self.mute_roles[guild.id] = role.id
 
+    async def get_update_mute(self, guild: discord.Guild) -> bool:
+        enabled = self.update_mute.get(guild.id)
+        if enabled is None:
+            enabled = self.update_mute[guild.id] = await self.data.guild(guild).update_mute()
+        return enabled
+
+    async def set_update_mute(self, guild: discord.Guild, enable: bool):
+        await self.data.guild(guild).update_mute.set(enable)
+        self.update_mute[guild.id] = enable
+
     async def get_temp_action(self, guild: discord.Guild, member: Optional[discord.Member] = None):
         guild_temp_actions = self.temp_actions.get(guild.id, {})
         if not guild_temp_actions:
             guild_temp_actions = await self.data.guild(guild).temporary_warns.all()
             if guild_temp_actions:
                 self.temp_actions[guild.id] = guild_temp_actions
+                self.temp_action_timers.schedule_guild(guild.id, guild_temp_actions)
         if member is None:
             return guild_temp_actions
-        return guild_temp_actions.get(member.id)
+        return guild_temp_actions.get(member.id) or guild_temp_actions.get(str(member.id))
 
     async def add_temp_action(self, guild: discord.Guild, member: discord.Member, data: dict):
         await self.data.guild(guild).temporary_warns.set_raw(member.id, value=data)
@@ -90,11 +122,15 @@ class MemoryCache:
             self.temp_actions[guild.id] = {member.id: data}
         else:
             guild_temp_actions[member.id] = data
+        self.temp_action_timers.schedule(guild.id, member.id, data)
 
     async def remove_temp_action(self, guild: discord.Guild, member: discord.Member):
         await self.data.guild(guild).temporary_warns.clear_raw(member.id)
-        with contextlib.suppress(KeyError):
-            del self.temp_actions[guild.id][member.id]
+        self.temp_action_timers.cancel(guild.id, member.id)
+        guild_temp_actions = self.temp_actions.get(guild.id, {})
+        # keys are ints when added during this session, strings when loaded from Config
+        for key in (member.id, str(member.id)):
+            guild_temp_actions.pop(key, None)
 
     async def bulk_remove_temp_action(self, guild: discord.Guild, members: list):
         members = [x.id for x in members]
@@ -102,6 +138,16 @@ class MemoryCache:
         warns = {x: y for x, y in warns.items() if int(x) not in members}
         await self.data.guild(guild).temporary_warns.set(warns)
         self.temp_actions[guild.id] = warns
+        for member_id in members:
+            self.temp_action_timers.cancel(guild.id, member_id)
+
+    async def clear_guild_temp_actions(self, guild_id: int):
+        """
+        Drop the temporary actions of a guild the bot isn't in anymore.
+        """
+        await self.data.guild_from_id(guild_id).temporary_warns.clear()
+        self.temp_actions.pop(guild_id, None)
+        self.temp_action_timers.cancel_guild(guild_id)
 
     def is_automod_enabled(self, guild: discord.Guild):
         return guild.id in self.automod_enabled
@@ -123,7 +169,7 @@ class MemoryCache:
             self.automod_antispam[guild.id] = False
         else:
             self.automod_antispam[guild.id] = automod_antispam
-        return automod_antispam
+        return self.automod_antispam[guild.id]
 
     async def update_automod_antispam(self, guild: discord.Guild):
         data = await self.data.guild(guild).automod.antispam.all()
@@ -132,12 +178,16 @@ class MemoryCache:
             self.automod_antispam[guild.id] = False
         else:
             self.automod_antispam[guild.id] = data
+        self.automod_prefilter.pop(guild.id, None)
 
     async def get_automod_regex(self, guild: discord.Guild):
         automod_regex = self.automod_regex.get(guild.id, {})
         if automod_regex:
             return automod_regex
         automod_regex = await self.data.guild(guild).automod.regex()
+        quarantined = self.automod_regex_quarantine.get(guild.id, {})
+        for name in quarantined:
+            automod_regex.pop(name, None)
         for name, regex in automod_regex.items():
             pattern = re.compile(regex["regex"])
             automod_regex[name]["regex"] = pattern
@@ -156,17 +206,70 @@ class MemoryCache:
         data = {"regex": regex.pattern, "level": level, "time": time, "reason": reason}
         await self.data.guild(guild).automod.regex.set_raw(name, value=data)
         data["regex"] = regex
+        self.automod_regex_quarantine.get(guild.id, {}).pop(name, None)
         if guild.id not in self.automod_regex:
             self.automod_regex[guild.id] = {name: data}
         else:
             self.automod_regex[guild.id][name] = data
+        self.automod_prefilter.pop(guild.id, None)
 
     async def remove_automod_regex(self, guild: discord.Guild, name: str):
         await self.data.guild(guild).automod.regex.clear_raw(name)
+        self.automod_regex_quarantine.get(guild.id, {}).pop(name, None)
         try:
             del self.automod_regex[guild.id][name]
         except KeyError:
             pass
+        self.automod_prefilter.pop(guild.id, None)
+
+    def quarantine_automod_regex(self, guild: discord.Guild, name: str):
+        """
+        Stop running a pattern that timed out, without deleting it from Config.
+
+        The pattern stays disabled until the cog is reloaded or the trigger is added again.
+        """
+        pattern = self.automod_regex.get(guild.id, {}).pop(name, None)
+        if pattern is None:
+            return
+        quarantined = self.automod_regex_quarantine.setdefault(guild.id, {})
+        quarantined[name] = pattern
+        self.automod_prefilter.pop(guild.id, None)
+        log.warning(
+            f"[Guild {guild.id}] Automod: regex {name} quarantined after timing out. "
+            f"Offending regex: {pattern['regex'].pattern}"
+        )
+
+    def get_quarantined_automod_regex(self, guild: discord.Guild) -> dict:
+        return self.automod_regex_quarantine.get(guild.id, {})
+
+    async def get_automod_prefilter(self, guild: discord.Guild) -> LiteralPrefilter:
+        """
+        Return the literal index of the guild's regexes and antispam whitelist.
+
+        It is built on first use and dropped whenever one of them is modified.
+        """
+        prefilter = self.automod_prefilter.get(guild.id)
+        if prefilter is not None:
+            return prefilter
+        all_regex = await self.get_automod_regex(guild)
+        antispam = await self.get_automod_antispam(guild)
+        prefilter = LiteralPrefilter(
+            {name: regex["regex"] for name, regex in all_regex.items()},
+            antispam["whitelist"] if antispam else [],
+        )
+        self.automod_prefilter[guild.id] = prefilter
+        return prefilter
+
+    async def get_automod_warnings(self, guild: discord.Guild) -> list:
+        automod_warnings = self.automod_warnings.get(guild.id, None)
+        if automod_warnings is not None:
+            return automod_warnings
+        automod_warnings = await self.data.guild(guild).automod.warnings()
+        self.automod_warnings[guild.id] = automod_warnings
+        return automod_warnings
+
+    async def update_automod_warnings(self, guild: discord.Guild):
+        self.automod_warnings[guild.id] = await self.data.guild(guild).automod.warnings()
 
     async def set_automod_regex_edited(self, guild: discord.Guild, enable: bool):
         await self.data.guild(guild).automod.regex_edited_messages.set(enable)
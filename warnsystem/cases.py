@@ -0,0 +1,78 @@
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+class UserMemo:
+    """
+    Resolve user IDs once, for all the cases returned by a single call.
+
+    ``missing(user_id)`` builds the object used for users not found in the bot's cache.
+    """
+
+    __slots__ = ("bot", "missing", "users")
+
+    def __init__(self, bot, missing: Callable[[int], Any]):
+        self.bot = bot
+        self.missing = missing
+        self.users: Dict[int, Any] = {}
+
+    def get(self, user_id: int):
+        user_id = int(user_id)
+        try:
+            return self.users[user_id]
+        except KeyError:
+            user = self.users[user_id] = self.bot.get_user(user_id) or self.missing(user_id)
+            return user
+
+
+class CaseRecord(Mapping):
+    """
+    Read-only view of a stored case, as returned by
+    :func:`~warnsystem.api.API.get_all_cases` for a guild.
+
+    ``member`` and ``author`` are resolved to users and ``time`` converted to a datetime the
+    first time they are read, other keys come straight from the stored case.
+    """
+
+    __slots__ = ("data", "member_id", "memo", "_time")
+
+    def __init__(self, data: dict, member_id: Optional[int], memo: UserMemo):
+        self.data = data
+        self.member_id = member_id
+        self.memo = memo
+        self._time = None
+
+    def __getitem__(self, key: str):
+        if key == "member":
+            if self.member_id is None:
+                raise KeyError(key)
+            return self.memo.get(self.member_id)
+        if key == "author":
+            return self.memo.get(self.data["author"])
+        if key == "time":
+            time = self.data["time"]
+            if not time:
+                return time
+            if self._time is None:
+                self._time = datetime.fromtimestamp(int(time), tz=timezone.utc)
+            return self._time
+        return self.data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.data
+        if self.member_id is not None and "member" not in self.data:
+            yield "member"
+
+    def __len__(self) -> int:
+        return len(self.data) + (self.member_id is not None and "member" not in self.data)
+
+    def __repr__(self) -> str:
+        return f"<CaseRecord member_id={self.member_id} data={self.data!r}>"
+
+    def to_dict(self) -> dict:
+        """
+        Return a resolved copy of the case, like the dictionaries returned before.
+        """
+        return dict(self)
+
@@ -12,10 +12,9 @@ from typing import Optional, Union, List, Tuple, TYPE_CHECKING, cast
 from redbot.core.i18n import Translator
 from redbot.core.utils import mod
 from redbot.core.commands import Context
-from redbot.vendored.discord.ext import menus
 
 from .api import UnavailableMember
-from .paginator import Pages
+from .paginator import LazyListPageSource, Pages, StreamedTextPageSource
 
 if TYPE_CHECKING:
     from redbot.core.bot import Red
@@ -252,25 +251,42 @@ class WarningEditionView(View):
         )
 
 
-class WarningsSource(menus.ListPageSource):
-    def __init__(self, entries: List[dict]):
-        super().__init__(entries, per_page=25)
+class WarnlistSource(StreamedTextPageSource):
+    async def format_page(self, menu: Pages, content: str):
+        max_pages = self.get_max_pages()
+        if max_pages is None:
+            footer = _("{total} warnings. Page {i}").format(
+                total=self.total, i=menu.current_page + 1
+            )
+        else:
+            footer = _("{total} warnings. Page {i}/{pages}").format(
+                total=self.total, i=menu.current_page + 1, pages=max_pages
+            )
+        return f"```yml\n{content}```\n" + footer
+
+
+class WarningsSource(LazyListPageSource):
+    def __init__(self, api: "API", guild: discord.Guild, user, total: int, deleted: List[int]):
+        async def fetch(offset: int, limit: int) -> List[dict]:
+            # cases deleted from the menu are gone from the modlog, shift the next pages
+            offset -= len([x for x in deleted if x < offset])
+            return await api.get_cases_page(guild, user, offset=offset, limit=limit)
+
+        super().__init__(fetch, total, per_page=25)
 
     async def format_page(self, menu: WarningsSelector, balls: List[dict]):
         menu.set_options(balls)
         return True  # signal to edit the page
 
 
-class WarningsSelector(Pages[menus.ListPageSource]):
-    def __init__(
-        self, ctx: Context, user: Union[discord.Member, UnavailableMember], warnings: List[dict]
-    ):
+class WarningsSelector(Pages[LazyListPageSource]):
+    def __init__(self, ctx: Context, user: Union[discord.Member, UnavailableMember], total: int):
         self.user = user
         self.ws = cast("WarnSystem", ctx.bot.get_cog("WarnSystem"))
         self.api: "API" = self.ws.api
-        source = WarningsSource(warnings)
-        super().__init__(source, ctx=ctx)
         self.deleted_cases: list[int] = []  # to prevent referencing deleted cases
+        source = WarningsSource(self.api, ctx.guild, user, total, self.deleted_cases)
+        super().__init__(source, ctx=ctx)
         self.add_item(self.select_warning_menu)
 
     async def interaction_check(self, interaction: Interaction[discord.Client]) -> bool:
@@ -325,7 +341,7 @@ class WarningsSelector(Pages[menus.ListPageSource]):
         if i in self.deleted_cases:
             await interaction.response.send_message("This case was deleted.", ephemeral=True)
             return
-        case = self.source.entries[i]
+        case = self.source.get_entry(i)
         level = case["level"]
         moderator = guild.get_member(case["author"])
         moderator = "ID: " + str(case["author"]) if not moderator else moderator.mention
@@ -1,5 +1,6 @@
 import argparse
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Optional, Set
 import discord
 import re
 import logging
@@ -12,6 +13,25 @@ from redbot.core.commands.converter import TimedeltaConverter
 from redbot.core.i18n import Translator
 
 from .api import UnavailableMember
+from .memberselect import (
+    COST_DATE,
+    COST_FLAG,
+    COST_ID,
+    COST_PERMISSIONS,
+    COST_REGEX,
+    COST_ROLES,
+    MemberSelection,
+    activity_filter,
+    attribute_filter,
+    bot_filter,
+    exclude_filter,
+    has_join_date,
+    joined_filter,
+    nroles_filter,
+    permissions_filter,
+    position_filter,
+    roles_filter,
+)
 
 _ = Translator("WarnSystem", __file__)
 log = logging.getLogger("red.laggron.warnsystem")
@@ -84,11 +104,6 @@ class AdvancedMemberSelect:
     --below <role>
     """
 
-    def non_lurker_members(self, members: List[discord.Member]):
-        if not self._non_lurker_members:
-            self._non_lurker_members = [x for x in members if x.joined_at]
-        return self._non_lurker_members
-
     def parse_arguments(self, arguments: str):
         parser = NoExitParser(
             description="Mass member selection in a server for WarnSystem.", add_help=False
@@ -158,107 +173,112 @@ class AdvancedMemberSelect:
 
         if args.everyone:
             return guild.members, []
-        members = guild.members
+
+        # all filters are compiled first, then evaluated in a single pass over the members
+        selection = MemberSelection()
         if args.name:
-            members = self._name_regex(members, args.name, "name")
+            selection.add_filter(self._regex(args.name, "name"), COST_REGEX)
         if args.nickname:
-            members = self._name_regex(members, args.nickname, "nickname")
+            selection.add_filter(self._regex(args.nickname, "nickname", "nick"), COST_REGEX)
         if args.display_name:
-            members = self._name_regex(members, args.display_name, "display_name")
+            selection.add_filter(
+                self._regex(args.display_name, "display-name", "display_name"), COST_REGEX
+            )
         if args.activity:
-            members = self._status_regex(members, args.activity)
+            selection.add_filter(self._regex(args.activity, "activity"), COST_REGEX)
         if args.only_humans:
-            members = list(filter(lambda x: not x.bot, members))
+            selection.add_filter(bot_filter(False), COST_FLAG)
         if args.only_bots:
-            members = list(filter(lambda x: x.bot, members))
+            selection.add_filter(bot_filter(True), COST_FLAG)
+        if args.joined_before or args.joined_after or args.last_njoins or args.first_njoins:
+            selection.add_filter(has_join_date, COST_FLAG)  # ignore lurkers
         if args.joined_before:
-            members = self._join(
-                self.non_lurker_members(members), " ".join(args.joined_before), "before"
-            )
+            date = self._join_date(" ".join(args.joined_before), "before")
+            selection.add_filter(joined_filter(date, before=True), COST_DATE)
         if args.joined_after:
-            members = self._join(
-                self.non_lurker_members(members), " ".join(args.joined_after), "after"
-            )
+            date = self._join_date(" ".join(args.joined_after), "after")
+            selection.add_filter(joined_filter(date, before=False), COST_DATE)
         if args.last_njoins:
-            members = self._last_njoins(self.non_lurker_members(members), args.last_njoins)
+            selection.add_rank(args.last_njoins, newest=True)
         if args.first_njoins:
-            members = self._first_njoins(self.non_lurker_members(members), args.first_njoins)
+            selection.add_rank(args.first_njoins, newest=False)
 
+        permissions = []
         if args.has_perm:
-            members = self._perms(members, [args.has_perm], "perm")
+            permissions.append(("all", self._perms_mask([args.has_perm], "perm")))
         if args.has_any_perm:
-            members = self._perms(members, args.has_any_perm, "any-perm")
+            permissions.append(("any", self._perms_mask(args.has_any_perm, "any-perm")))
         if args.has_all_perms:
-            members = self._perms(members, args.has_all_perms, "all-perms")
+            permissions.append(("all", self._perms_mask(args.has_all_perms, "all-perms")))
         if args.has_none_perms:
-            members = self._perms(members, args.has_none_perms, "none-perms")
+            permissions.append(("none", self._perms_mask(args.has_none_perms, "none-perms")))
         if args.has_perm_int:
-            members = self._perm_int(members, args.has_perm_int)
+            permissions.append(("exactly", args.has_perm_int))
+        if permissions:
+            selection.add_filter(permissions_filter(permissions), COST_PERMISSIONS)
 
+        default_role_id = guild.default_role.id
         if args.has_role:
-            members = await self._role(members, [args.has_role], "has-role")
+            roles = await self._roles([args.has_role], "has-role")
+            selection.add_filter(roles_filter("all", roles, default_role_id), COST_ROLES)
         if args.has_any_role:
-            members = await self._role(members, args.has_any_role, "has-any-role")
+            roles = await self._roles(args.has_any_role, "has-any-role")
+            selection.add_filter(roles_filter("any", roles, default_role_id), COST_ROLES)
         if args.has_all_roles:
-            members = await self._role(members, args.has_all_roles, "has-all-roles")
+            roles = await self._roles(args.has_all_roles, "has-all-roles")
+            selection.add_filter(roles_filter("all", roles, default_role_id), COST_ROLES)
         if args.has_none_roles:
-            members = await self._role(members, args.has_none_roles, "has-none-roles")
+            roles = await self._roles(args.has_none_roles, "has-none-roles")
+            selection.add_filter(roles_filter("none", roles, default_role_id), COST_ROLES)
         if args.has_no_roles:
-            members = await self._role(members, None, "has-no-roles")
+            selection.add_filter(nroles_filter("exactly", 0), COST_ROLES)
         if args.has_exactly_nroles:
-            members = self._nroles(members, args.has_exactly_nroles[0], "exactly")
+            selection.add_filter(nroles_filter("exactly", args.has_exactly_nroles[0]), COST_ROLES)
         if args.has_more_than_nroles:
-            members = self._nroles(members, args.has_more_than_nroles[0], "more")
+            selection.add_filter(nroles_filter("more", args.has_more_than_nroles[0]), COST_ROLES)
         if args.has_less_than_nroles:
-            members = self._nroles(members, args.has_less_than_nroles[0], "less")
+            selection.add_filter(nroles_filter("less", args.has_less_than_nroles[0]), COST_ROLES)
         if args.above:
-            members = await self._role(members, [args.above], "above")
+            role = (await self._convert_roles([args.above], "above"))[0]
+            selection.add_filter(position_filter(role.position, above=True), COST_PERMISSIONS)
         if args.below:
-            members = await self._role(members, [args.below], "below")
+            role = (await self._convert_roles([args.below], "below"))[0]
+            selection.add_filter(position_filter(role.position, above=False), COST_PERMISSIONS)
 
         if args.exclude:
-            members = await self._selection(members, args.exclude, "exclude")
+            excluded = await self._selection(args.exclude, "exclude")
+            selection.add_filter(exclude_filter({x.id for x in excluded}), COST_ID)
+
+        if selection.filtered:
+            members = await selection.select(guild.members)
+        elif args.select or args.hackban_select:
+            members = []
+        else:
+            members = list(guild.members)
         if args.select:
-            if members == guild.members:
-                members = []
-            members = await self._selection(members, args.select, "select")
+            members.extend(await self._selection(args.select, "select"))
         if args.hackban_select:
-            if members == guild.members:
-                members = []
             unavailable_members = await self._unavailable_selection(args.hackban_select)
 
         if not members and not unavailable_members:
             raise BadArgument(_("The search could't find any member."))
         return members, unavailable_members
 
-    def _name_regex(self, members: List[discord.Member], pattern: str, attribute: str):
-        pattern = re.compile(pattern)
-
-        def member_filter(member: discord.Member):
-            if pattern.search(getattr(member, attribute)):
-                return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    def _status_regex(self, members: List[discord.Member], pattern: str):
-        pattern = re.compile(pattern)
-
-        def member_filter(member: discord.Member):
-            # credit to mikeshardmind for this part of code
-            # https://github.com/mikeshardmind/SinbadCogs/blob/4d265a9819fd25be44bc7422e6e60c44624624da/statuswarn/statuswarn.py#L27
-            maybe_custom = next(filter(lambda a: a.type == 4, member.activities), None)
-            if not maybe_custom:
-                return False
-            if pattern.search(maybe_custom.state or ""):
-                return True
-            return False
-
-        return list(filter(member_filter, members))
+    def _regex(self, pattern: str, state: str, attribute: Optional[str] = None):
+        try:
+            if state == "activity":
+                return activity_filter(pattern)
+            return attribute_filter(pattern, attribute or state)
+        except re.error as e:
+            raise BadArgument(
+                _("`{arg}` from `--{state}` is not a valid regex pattern. {e}").format(
+                    arg=pattern, state=state, e=e
+                )
+            ) from e
 
-    def _join(self, members: List[discord.Member], date: str, when: str):
+    def _join_date(self, date: str, when: str) -> datetime:
         try:
-            date = parse_time(date)
+            parsed = parse_time(date)
         except Exception:
             raise BadArgument(
                 _(
@@ -269,133 +289,39 @@ class AdvancedMemberSelect:
                     "- `jan 4 16:09`"
                 ).format(arg=date, state=when)
             )
+        # join dates are aware datetimes in UTC
+        return parsed.replace(tzinfo=timezone.utc)
 
-        def member_filter(member: discord.Member):
-            if when == "before" and member.joined_at < date:
-                return True
-            if when == "after" and member.joined_at > date:
-                return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    def _last_njoins(self, members: List[discord.Member], number: int):
-        try:
-            last_member = sorted(members, key=lambda x: x.joined_at, reverse=True)[number]
-        except IndexError:
-            last_member = sorted(members, key=lambda x: x.joined_at, reverse=True)[
-                len(members) - 1
-            ]
-
-        def member_filter(member: discord.Member):
-            if member.joined_at > last_member.joined_at:
-                return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    def _first_njoins(self, members: List[discord.Member], number: int):
-        try:
-            last_member = sorted(members, key=lambda x: x.joined_at)[number]
-        except IndexError:
-            last_member = sorted(members, key=lambda x: x.joined_at)[len(members) - 1]
-
-        def member_filter(member: discord.Member):
-            if member.joined_at < last_member.joined_at:
-                return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    def _perms(self, members: List[discord.Member], permissions: list, requires: str):
-        allowed_permissions = dir(discord.Permissions)
+    def _perms_mask(self, permissions: List[str], requires: str) -> int:
         for permission in permissions:
-            if permission not in allowed_permissions:
+            if permission not in discord.Permissions.VALID_FLAGS:
                 raise BadArgument(
                     _(
                         "Can't convert `{arg}` from `--has-{state}` into a valid "
                         "permission object. Please provide something like this: `send_messages`"
                     ).format(arg=permission, state=requires)
                 )
+        return discord.Permissions(**{x: True for x in permissions}).value
 
-        def member_filter(member: discord.Member):
-            if requires == "perm":
-                if getattr(member.guild_permissions, permissions[0]):
-                    return True
-            elif requires == "any-perm":
-                if set([x[0] for x in member.guild_permissions if x[1]]).intersection(permissions):
-                    return True
-            elif requires == "all-perms":
-                if set(permissions).issubset([x[0] for x in member.guild_permissions if x[1]]):
-                    return True
-            elif requires == "none-perms":
-                if not set([x[0] for x in member.guild_permissions if x[1]]).intersection(
-                    permissions
-                ):
-                    return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    def _perm_int(self, members: List[discord.Member], permissions: int):
-        def member_filter(member: discord.Member):
-            if member.guild_permissions.value == permissions:
-                return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    async def _role(
-        self, members: List[discord.Member], _roles: List[discord.Role], requires: str
-    ):
-        if _roles:
-            roles: List[discord.Role] = []
-            for role in _roles:
-                try:
-                    roles.append(await RoleConverter().convert(self.ctx, role))
-                except (discord.errors.NotFound, discord.ext.commands.errors.BadArgument):
-                    raise BadArgument(
-                        _(
-                            "Can't convert `{arg}` from `--{state}` into a "
-                            "valid role object. Please provide the exact role "
-                            "name (in quotes if it has spaces) or an ID."
-                        ).format(arg=role, state=requires)
-                    )
-
-        def member_filter(member: discord.Member):
-            if requires == "has-role" and roles[0] in member.roles:
-                return True
-            elif requires == "has-any-roles" and set(member.roles).intersection(roles):
-                return True
-            elif requires == "has-all-roles" and set(roles).issubset(member.roles):
-                return True
-            elif requires == "has-none-roles" and not set(member.roles).intersection(roles):
-                return True
-            elif requires == "has-no-roles" and len(member.roles) == 1:
-                return True
-            elif requires == "above" and member.top_role.position > roles[0].position:
-                return True
-            elif requires == "below" and member.top_role.position < roles[0].position:
-                return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    def _nroles(self, members: List[discord.Member], number: int, condition: str):
-        number += 1  # do not count @everyone role
-
-        def member_filter(member: discord.Member):
-            if condition == "exactly" and len(member.roles) == number:
-                return True
-            elif condition == "more" and len(member.roles) > number:
-                return True
-            elif condition == "less" and len(member.roles) < number:
-                return True
-            return False
-
-        return list(filter(member_filter, members))
-
-    async def _selection(self, members: list, _selection: list, requires: str):
+    async def _convert_roles(self, _roles: List[str], requires: str) -> List[discord.Role]:
+        roles: List[discord.Role] = []
+        for role in _roles:
+            try:
+                roles.append(await RoleConverter().convert(self.ctx, role))
+            except (discord.errors.NotFound, discord.ext.commands.errors.BadArgument):
+                raise BadArgument(
+                    _(
+                        "Can't convert `{arg}` from `--{state}` into a "
+                        "valid role object. Please provide the exact role "
+                        "name (in quotes if it has spaces) or an ID."
+                    ).format(arg=role, state=requires)
+                )
+        return roles
+
+    async def _roles(self, _roles: List[str], requires: str) -> Set[int]:
+        return {x.id for x in await self._convert_roles(_roles, requires)}
+
+    async def _selection(self, _selection: list, requires: str) -> List[discord.Member]:
         selection = []
         for member in _selection:
             try:
@@ -409,11 +335,7 @@ class AdvancedMemberSelect:
                     ).format(arg=member, state=requires)
                 )
 
-        if requires == "select":
-            members.extend(selection)
-            return members
-        else:
-            return list(set(members) - set(selection))
+        return selection
 
     async def _unavailable_selection(self, _selection):
         # don't question my function names
@@ -433,7 +355,6 @@ class AdvancedMemberSelect:
 
     async def convert(self, ctx, arguments):
         self.ctx = ctx
-        self._non_lurker_members = None
         async with ctx.typing():
             args = self.parse_arguments(arguments)
             self.reason = " ".join(args.reason or "")
@@ -0,0 +1,40 @@
+import hashlib
+
+from collections import OrderedDict
+from typing import FrozenSet, Optional, Tuple
+
+
+def content_digest(content: str) -> bytes:
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+class MessageDigests:
+    """
+    Digest of the content of recent messages and the regex triggers they already matched.
+
+    Used by the automod on edited messages, to skip edits that don't change the content
+    (embeds unfurled, pins) and triggers that were already applied. This is a LRU cache
+    keyed by message ID, holding at most ``maxsize`` messages.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.messages: "OrderedDict[int, Tuple[bytes, FrozenSet[str]]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def get(self, message_id: int) -> Optional[Tuple[bytes, FrozenSet[str]]]:
+        entry = self.messages.get(message_id)
+        if entry is not None:
+            self.messages.move_to_end(message_id)
+        return entry
+
+    def set(self, message_id: int, digest: bytes, matched: FrozenSet[str]):
+        self.messages[message_id] = (digest, matched)
+        self.messages.move_to_end(message_id)
+        while len(self.messages) > self.maxsize:
+            self.messages.popitem(last=False)
+
+    def clear(self):
+        self.messages.clear()
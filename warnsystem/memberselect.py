@@ -0,0 +1,333 @@
+import asyncio
+import functools
+import heapq
+import random
+import re
+import time
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+Predicate = Callable[[Any], bool]
+
+# relative cost of each kind of check, the cheapest ones are evaluated first so that most
+# members are rejected before reaching the expensive ones
+COST_ID = 0
+COST_FLAG = 1
+COST_DATE = 2
+COST_ROLES = 3
+COST_PERMISSIONS = 4
+COST_REGEX = 5
+
+# give control back to the event loop after this number of members
+YIELD_EVERY = 2000
+
+compile_pattern = functools.lru_cache(maxsize=128)(re.compile)
+
+
+class MemberSelection:
+    """
+    Member filters of :class:`~warnsystem.converters.AdvancedMemberSelect`, evaluated in a
+    single pass over the members.
+
+    Filters added after a ``--last-njoins``/``--first-njoins`` ranking only apply to the ranked
+    members, like when the filters were applied one after another.
+    """
+
+    def __init__(self):
+        self.filters: List[Tuple[int, int, Predicate]] = []
+        self.post_filters: List[Tuple[int, int, Predicate]] = []
+        self.ranks: List[Tuple[bool, int]] = []
+
+    @property
+    def filtered(self) -> bool:
+        return bool(self.filters or self.post_filters or self.ranks)
+
+    def add_filter(self, predicate: Predicate, cost: int):
+        target = self.post_filters if self.ranks else self.filters
+        target.append((cost, len(target), predicate))
+
+    def add_rank(self, number: int, *, newest: bool):
+        """
+        Keep the ``number`` newest (or oldest) members among the ones matching the filters.
+        """
+        self.ranks.append((newest, number))
+
+    @staticmethod
+    async def _filter(
+        members: Iterable[Any], filters: List[Tuple[int, int, Predicate]], yield_every: int
+    ) -> List[Any]:
+        predicates = [x[2] for x in sorted(filters, key=lambda x: x[:2])]
+        if not predicates:
+            return list(members)
+        members = members if isinstance(members, list) else list(members)
+        result = []
+        for start in range(0, len(members), yield_every):
+            # chained filter iterators, each member goes through the checks until one fails
+            selected = members[start : start + yield_every]
+            for predicate in predicates:
+                selected = filter(predicate, selected)
+            result.extend(selected)
+            await asyncio.sleep(0)
+        return result
+
+    async def select(self, members: Iterable[Any], *, yield_every: int = YIELD_EVERY) -> List[Any]:
+        """
+        Return the members matching the selection, in their original order.
+        """
+        selected = await self._filter(members, self.filters, yield_every)
+        if not self.ranks:
+            return selected
+        for newest, number in self.ranks:
+            pick = heapq.nlargest if newest else heapq.nsmallest
+            kept = {id(x) for x in pick(number, selected, key=lambda x: x.joined_at)}
+            selected = [x for x in selected if id(x) in kept]
+        return await self._filter(selected, self.post_filters, yield_every)
+
+
+def attribute_filter(pattern: str, attribute: str) -> Predicate:
+    search = compile_pattern(pattern).search
+    return lambda member: search(getattr(member, attribute) or "") is not None
+
+
+def activity_filter(pattern: str) -> Predicate:
+    search = compile_pattern(pattern).search
+
+    def member_filter(member) -> bool:
+        # credit to mikeshardmind for this part of code
+        # https://github.com/mikeshardmind/SinbadCogs/blob/4d265a9819fd25be44bc7422e6e60c44624624da/statuswarn/statuswarn.py#L27
+        maybe_custom = next(filter(lambda a: a.type == 4, member.activities), None)
+        if not maybe_custom:
+            return False
+        return search(maybe_custom.state or "") is not None
+
+    return member_filter
+
+
+def bot_filter(bot: bool) -> Predicate:
+    return lambda member: member.bot is bot
+
+
+def has_join_date(member) -> bool:
+    return member.joined_at is not None
+
+
+def joined_filter(date: datetime, *, before: bool) -> Predicate:
+    if before:
+        return lambda member: member.joined_at < date
+    return lambda member: member.joined_at > date
+
+
+def roles_filter(condition: str, role_ids: Set[int], default_role_id: int) -> Predicate:
+    """
+    Filter on the roles of the members. ``condition`` is one of ``all``, ``any`` or ``none``.
+
+    Role IDs are compared with ``member._roles`` to avoid building the list of role objects
+    of every member. The default role is not in that list and is handled here.
+    """
+    has_default = default_role_id in role_ids
+    role_ids = role_ids - {default_role_id}
+    if condition == "all":
+        return lambda member: role_ids.issubset(member._roles)
+    if condition == "any":
+        if has_default:
+            return lambda member: True
+        return lambda member: not role_ids.isdisjoint(member._roles)
+    if has_default:
+        return lambda member: False
+    return lambda member: role_ids.isdisjoint(member._roles)
+
+
+def nroles_filter(condition: str, number: int) -> Predicate:
+    """
+    Filter on the number of roles, without counting the default role.
+    """
+    if condition == "exactly":
+        return lambda member: len(member._roles) == number
+    if condition == "more":
+        return lambda member: len(member._roles) > number
+    return lambda member: len(member._roles) < number
+
+
+def position_filter(position: int, *, above: bool) -> Predicate:
+    if above:
+        return lambda member: member.top_role.position > position
+    return lambda member: member.top_role.position < position
+
+
+def permissions_filter(checks: List[Tuple[str, int]]) -> Predicate:
+    """
+    Check the permissions of the members against bit masks. The permissions of a member are
+    computed once for all checks.
+
+    ``checks`` is a list of ``(condition, mask)`` with the condition being ``all``, ``any``,
+    ``none`` or ``exactly``.
+    """
+
+    def member_filter(member) -> bool:
+        value = member.guild_permissions.value
+        for condition, mask in checks:
+            if condition == "all" and value & mask != mask:
+                return False
+            if condition == "any" and not value & mask:
+                return False
+            if condition == "none" and value & mask:
+                return False
+            if condition == "exactly" and value != mask:
+                return False
+        return True
+
+    return member_filter
+
+
+def exclude_filter(member_ids: Set[int]) -> Predicate:
+    return lambda member: member.id not in member_ids
+
+
+# benchmark over synthetic members, run this file with Python to print the results
+# the members mimic discord.py: roles and permissions are computed on each access
+
+_PERMISSION_NAMES = [f"permission_{i}" for i in range(41)]
+
+
+class _Permissions:
+    __slots__ = ("value",)
+
+    def __init__(self, value: int):
+        self.value = value
+
+    def __iter__(self):
+        for i, name in enumerate(_PERMISSION_NAMES):
+            yield name, bool(self.value >> i & 1)
+
+
+class _Role:
+    __slots__ = ("id", "position", "permissions")
+
+    def __init__(self, id: int, position: int, permissions: int):
+        self.id = id
+        self.position = position
+        self.permissions = permissions
+
+
+class _Member:
+    __slots__ = ("id", "name", "nick", "bot", "joined_at", "_roles", "_guild_roles", "activities")
+
+    @property
+    def display_name(self) -> str:
+        return self.nick or self.name
+
+    @property
+    def roles(self) -> List[_Role]:
+        return [self._guild_roles[0]] + sorted(
+            (self._guild_roles[x] for x in self._roles), key=lambda x: x.position
+        )
+
+    @property
+    def top_role(self) -> _Role:
+        return max(self.roles, key=lambda x: x.position)
+
+    @property
+    def guild_permissions(self) -> _Permissions:
+        value = 0
+        for role in self.roles:
+            value |= role.permissions
+        return _Permissions(value)
+
+
+def synthetic_members(count: int, *, roles: int = 50, seed: int = 0) -> List[_Member]:
+    """
+    Generate members with random names, join dates and roles.
+    """
+    rng = random.Random(seed)
+    guild_roles = {i: _Role(i, i, rng.getrandbits(41) & rng.getrandbits(41)) for i in range(roles)}
+    start = datetime(2018, 1, 1, tzinfo=timezone.utc)
+    members = []
+    for i in range(count):
+        member = _Member()
+        member.id = 10**17 + i
+        member.name = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz0123456789_", k=10))
+        member.nick = member.name.upper() if rng.random() < 0.3 else None
+        member.bot = rng.random() < 0.05
+        member.joined_at = start + timedelta(seconds=rng.randrange(200_000_000))
+        member._roles = sorted(rng.sample(range(1, roles), rng.randrange(6)))
+        member._guild_roles = guild_roles
+        member.activities = ()
+        members.append(member)
+    return members
+
+
+def _benchmark_selection(date: datetime) -> MemberSelection:
+    # --name "^[a-m]" --only-humans --joined-after <date> --last-njoins 1000
+    # --has-any-perm permission_11 --has-any-role 1 2 3
+    selection = MemberSelection()
+    selection.add_filter(attribute_filter("^[a-m]", "name"), COST_REGEX)
+    selection.add_filter(bot_filter(False), COST_FLAG)
+    selection.add_filter(has_join_date, COST_FLAG)
+    selection.add_filter(joined_filter(date, before=False), COST_DATE)
+    selection.add_rank(1000, newest=True)
+    selection.add_filter(permissions_filter([("any", 1 << 11)]), COST_PERMISSIONS)
+    selection.add_filter(roles_filter("any", {1, 2, 3}, 0), COST_ROLES)
+    return selection
+
+
+def _multipass_select(members: List[_Member], date: datetime) -> List[_Member]:
+    # same selection as above, one full pass per filter like before
+    pattern = re.compile("^[a-m]")
+    members = list(filter(lambda x: pattern.search(x.name), members))
+    members = list(filter(lambda x: not x.bot, members))
+    members = [x for x in members if x.joined_at]
+    members = list(filter(lambda x: x.joined_at > date, members))
+    try:
+        last_member = sorted(members, key=lambda x: x.joined_at, reverse=True)[1000]
+    except IndexError:
+        last_member = sorted(members, key=lambda x: x.joined_at, reverse=True)[len(members) - 1]
+    members = list(filter(lambda x: x.joined_at > last_member.joined_at, members))
+    members = list(
+        filter(
+            lambda x: set([y[0] for y in x.guild_permissions if y[1]]).intersection(
+                ["permission_11"]
+            ),
+            members,
+        )
+    )
+    roles = [x._guild_roles[y] for x in members[:1] for y in (1, 2, 3)]
+    return list(filter(lambda x: set(x.roles).intersection(roles), members))
+
+
+def benchmark(
+    sizes: Iterable[int] = (1_000, 10_000, 100_000), *, repeat: int = 3
+) -> List[Dict[str, Any]]:
+    """
+    Time the single pass selection against one pass per filter on synthetic members.
+    """
+    date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    results = []
+    for size in sizes:
+        members = synthetic_members(size)
+        selection = _benchmark_selection(date)
+        single, multi = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            selected = asyncio.run(selection.select(members))
+            single.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            _multipass_select(members, date)
+            multi.append(time.perf_counter() - start)
+        results.append(
+            {
+                "members": size,
+                "selected": len(selected),
+                "single_pass_ms": min(single) * 1000,
+                "multi_pass_ms": min(multi) * 1000,
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark():
+        print(
+            "{members:>7} members, {selected:>5} selected: single pass {single_pass_ms:8.2f}ms, "
+            "multi pass {multi_pass_ms:8.2f}ms".format(**result)
+        )
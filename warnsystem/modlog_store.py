@@ -0,0 +1,637 @@
+import asyncio
+import contextlib
+import json
+import logging
+import secrets
+import sqlite3
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from redbot.core import Config
+
+from .stats import DAY
+
+log = logging.getLogger("red.laggron.warnsystem")
+
+BACKENDS = ("config", "sqlite")
+
+# (offset, limit) -> (member_id, case) tuples, see guild_cases_reader
+CasesReader = Callable[[int, int], Awaitable[List[Tuple[int, dict]]]]
+# (member_id, level, day since the epoch or None, number of cases), see count_guild_levels
+LevelCount = Tuple[int, int, Optional[int], int]
+
+# key of the Config cases waiting for their modlog message, see add_pending_case
+PENDING_KEY = "pending_modlog"
+
+
+def _strip_pending(cases: List[dict]) -> List[dict]:
+    # the token is internal to the store, callers and data exports must not see it
+    return [
+        {x: y for x, y in case.items() if x != PENDING_KEY} if PENDING_KEY in case else case
+        for case in cases
+    ]
+
+
+class StoreGate:
+    """
+    Let modlog writes run concurrently, but not while the backend is being switched.
+
+    :meth:`switch` waits for the running writes to end and holds the new ones until the
+    switch is done, so no case is written to the old store after it was copied.
+    """
+
+    def __init__(self):
+        self._writes = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._open = asyncio.Event()
+        self._open.set()
+        self._lock = asyncio.Lock()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        await self._open.wait()
+        self.hold()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def hold(self):
+        """
+        Take one more write without waiting, only call this inside :meth:`write`.
+
+        Each call must be matched by a call to :meth:`release`.
+        """
+        self._writes += 1
+        self._idle.clear()
+
+    def release(self):
+        self._writes -= 1
+        if not self._writes:
+            self._idle.set()
+
+    @contextlib.asynccontextmanager
+    async def switch(self):
+        async with self._lock:
+            self._open.clear()
+            try:
+                await self._idle.wait()
+                yield
+            finally:
+                self._open.set()
+
+
+class ConfigModlogStore:
+    """
+    Cases stored in the ``MODLOGS`` custom group of Config, one list per member.
+
+    This is the default backend. Reading the cases of a guild loads every member of the guild.
+
+    The ``USER_INDEX`` custom group lists, for each user, the guilds where they have cases
+    (``member``), so data requests only read the affected guilds.
+    """
+
+    name = "config"
+
+    def __init__(self, config: Config):
+        self.data = config
+
+    async def open(self):
+        if not await self.data.user_index_built():
+            await self.build_user_index()
+        await self._clear_pending()
+
+    async def close(self):
+        pass
+
+    async def _clear_pending(self):
+        # cases still pending come from a previous session, their modlog message will never be
+        # attached. Only called on load, before any warn
+        cleared = 0
+        for guild_id, modlogs in (await self.data.custom("MODLOGS").all()).items():
+            for member_id, content in modlogs.items():
+                if member_id == "x" or not any(PENDING_KEY in x for x in content.get("x", [])):
+                    continue
+                async with self.data.custom("MODLOGS", guild_id, member_id).x() as logs:
+                    for case in logs:
+                        if case.pop(PENDING_KEY, None) is not None:
+                            cleared += 1
+        if cleared:
+            log.info(f"Cleared {cleared} cases left waiting for their modlog message.")
+
+    async def build_user_index(self):
+        """
+        Build the user index from all the modlogs. Only done once, on first load.
+        """
+        index: Dict[str, Dict[str, List[int]]] = {}
+        async for guild_id, member_id, _cases in self.iter_members():
+            index.setdefault(str(member_id), {"member": []})["member"].append(guild_id)
+        async with self.data.custom("USER_INDEX").all() as user_index:
+            user_index.clear()
+            user_index.update(index)
+        await self.data.user_index_built.set(True)
+        log.info(f"User index of the modlogs built, {len(index)} users.")
+
+    async def _index_add(self, user_id: int, guild_id: int):
+        value = self.data.custom("USER_INDEX", user_id).member
+        if guild_id not in await value():
+            async with value() as guilds:
+                guilds.append(guild_id)
+
+    async def _index_remove(self, user_id: int, guild_id: int):
+        value = self.data.custom("USER_INDEX", user_id).member
+        if guild_id in await value():
+            async with value() as guilds:
+                guilds.remove(guild_id)
+
+    async def get_user_guilds(self, user_id: int) -> List[int]:
+        """
+        Return the guilds where the user has cases.
+        """
+        return await self.data.custom("USER_INDEX", user_id).member()
+
+    async def add_case(self, guild_id: int, member_id: int, case: dict):
+        async with self.data.custom("MODLOGS", guild_id, member_id).x() as logs:
+            logs.append(case)
+        await self._index_add(member_id, guild_id)
+
+    async def add_pending_case(self, guild_id: int, member_id: int, case: dict) -> Hashable:
+        """
+        Add a case whose modlog message isn't posted yet. Returns a reference for
+        :meth:`set_case_modlog`.
+
+        The case is tagged with a random token until then, indexes can't be used since other
+        cases of the member may be deleted meanwhile.
+        """
+        token = secrets.token_hex(8)
+        await self.add_case(guild_id, member_id, dict(case, **{PENDING_KEY: token}))
+        return token
+
+    async def set_case_modlog(
+        self, guild_id: int, member_id: int, ref: Hashable, modlog: Optional[dict]
+    ) -> bool:
+        """
+        Set the modlog message of a pending case, or only mark it done if ``modlog`` is
+        :py:obj:`None`. Returns :py:obj:`False` if the case was deleted meanwhile.
+        """
+        async with self.data.custom("MODLOGS", guild_id, member_id).x() as logs:
+            for case in reversed(logs):
+                if case.get(PENDING_KEY) == ref:
+                    del case[PENDING_KEY]
+                    if modlog is not None:
+                        case["modlog_message"] = modlog
+                    return True
+        return False
+
+    async def get_member_cases(
+        self,
+        guild_id: int,
+        member_id: int,
+        *,
+        since: Optional[int] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[dict]:
+        cases = await self.data.custom("MODLOGS", guild_id, member_id).x()
+        if since is not None:
+            cases = [x for x in cases if x["time"] is not None and x["time"] > since]
+        if limit is None:
+            return _strip_pending(cases[offset:])
+        return _strip_pending(cases[offset : offset + limit])
+
+    async def count_member_cases(
+        self, guild_id: int, member_id: int, *, level: Optional[int] = None
+    ) -> int:
+        cases = await self.data.custom("MODLOGS", guild_id, member_id).x()
+        if level is None:
+            return len(cases)
+        return sum(1 for x in cases if x["level"] == level)
+
+    async def count_member_levels(self, guild_id: int, member_id: int) -> Dict[int, int]:
+        """
+        Return the number of cases of the member for each level.
+        """
+        levels = {}
+        for case in await self.data.custom("MODLOGS", guild_id, member_id).x():
+            levels[case["level"]] = levels.get(case["level"], 0) + 1
+        return levels
+
+    async def get_case(self, guild_id: int, member_id: int, index: int) -> dict:
+        """Raises :py:class:`IndexError` if the case doesn't exist."""
+        if index < 1:
+            raise IndexError(index)
+        case = (await self.data.custom("MODLOGS", guild_id, member_id).x())[index - 1]
+        return _strip_pending([case])[0]
+
+    async def set_case(self, guild_id: int, member_id: int, index: int, case: dict):
+        async with self.data.custom("MODLOGS", guild_id, member_id).x() as logs:
+            token = logs[index - 1].get(PENDING_KEY)
+            if token is not None:
+                # edited before its modlog message was posted, keep it findable
+                case = dict(case, **{PENDING_KEY: token})
+            logs[index - 1] = case
+
+    async def remove_case(self, guild_id: int, member_id: int, index: int) -> dict:
+        async with self.data.custom("MODLOGS", guild_id, member_id).x() as logs:
+            case = logs.pop(index - 1)
+            empty = not logs
+        if empty:
+            await self._index_remove(member_id, guild_id)
+        return _strip_pending([case])[0]
+
+    async def add_cases(self, guild_id: int, member_id: int, cases: List[dict]):
+        async with self.data.custom("MODLOGS", guild_id, member_id).x() as logs:
+            logs.extend(cases)
+        if cases:
+            await self._index_add(member_id, guild_id)
+
+    async def get_guild_cases(
+        self, guild_id: int, *, limit: Optional[int] = None, offset: int = 0, newest_first=False
+    ) -> List[Tuple[int, dict]]:
+        """
+        Return ``(member_id, case)`` tuples sorted by date.
+        """
+        cases = await self._sorted_guild_cases(guild_id, newest_first)
+        if limit is None:
+            return cases[offset:]
+        return cases[offset : offset + limit]
+
+    async def _sorted_guild_cases(self, guild_id: int, newest_first) -> List[Tuple[int, dict]]:
+        logs = await self.data.custom("MODLOGS", guild_id).all()
+        cases = []
+        for member_id, content in logs.items():
+            if member_id == "x":
+                continue
+            cases.extend((int(member_id), x) for x in _strip_pending(content["x"]))
+        cases.sort(key=lambda x: x[1]["time"] or 0, reverse=newest_first)
+        return cases
+
+    def guild_cases_reader(self, guild_id: int, *, newest_first=False) -> CasesReader:
+        """
+        Return a function reading pages of :meth:`get_guild_cases`.
+
+        Config can only load the whole guild, so the cases are loaded and sorted on the first
+        read, then the next pages are sliced from that copy. Cases created or deleted after
+        the first read are not seen.
+        """
+        cases: Optional[List[Tuple[int, dict]]] = None
+
+        async def read(offset: int, limit: int) -> List[Tuple[int, dict]]:
+            nonlocal cases
+            if cases is None:
+                cases = await self._sorted_guild_cases(guild_id, newest_first)
+            return cases[offset : offset + limit]
+
+        return read
+
+    async def count_guild_cases(self, guild_id: int) -> int:
+        logs = await self.data.custom("MODLOGS", guild_id).all()
+        return sum(len(y["x"]) for x, y in logs.items() if x != "x")
+
+    async def count_guild_levels(self, guild_id: int) -> List[LevelCount]:
+        """
+        Return the number of cases of the guild per member, level and day.
+        """
+        logs = await self.data.custom("MODLOGS", guild_id).all()
+        counts = Counter()
+        for member_id, content in logs.items():
+            if member_id == "x":
+                continue
+            for case in content["x"]:
+                day = None if case["time"] is None else int(case["time"]) // DAY
+                counts[(int(member_id), case["level"], day)] += 1
+        return [key + (count,) for key, count in counts.items()]
+
+    async def clear_guild(self, guild_id: int):
+        logs = await self.data.custom("MODLOGS", guild_id).all()
+        await self.data.custom("MODLOGS", guild_id).clear()
+        for member_id in logs:
+            if member_id == "x":
+                continue
+            await self._index_remove(int(member_id), guild_id)
+
+    async def get_user_cases(self, user_id: int) -> Dict[int, List[dict]]:
+        """
+        Return the cases of a user in every guild.
+        """
+        result = {}
+        for guild_id in await self.get_user_guilds(user_id):
+            cases = await self.data.custom("MODLOGS", guild_id, user_id).x()
+            if cases:
+                result[int(guild_id)] = _strip_pending(cases)
+        return result
+
+    async def delete_user(self, user_id: int):
+        for guild_id in await self.get_user_guilds(user_id):
+            await self.data.custom("MODLOGS", guild_id, user_id).clear()
+        await self.data.custom("USER_INDEX", user_id).member.clear()
+
+    async def iter_members(self) -> AsyncIterator[Tuple[int, int, List[dict]]]:
+        for guild_id, modlogs in (await self.data.custom("MODLOGS").all()).items():
+            for member_id, content in modlogs.items():
+                if member_id == "x" or not content.get("x"):
+                    continue
+                yield int(guild_id), int(member_id), _strip_pending(content["x"])
+
+    async def clear_all(self):
+        await self.data.custom("MODLOGS").clear()
+        await self.data.custom("USER_INDEX").clear()
+        await self.data.user_index_built.set(True)
+
+
+class SQLiteModlogStore:
+    """
+    Cases stored in a SQLite database, indexed by member, date and author.
+
+    The full case is kept as JSON, the indexed values are copied in their own columns. Queries
+    run in a dedicated thread, one at a time.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS cases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            level INTEGER NOT NULL,
+            author,
+            time INTEGER,
+            data TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS cases_member ON cases (guild_id, member_id, time)",
+        "CREATE INDEX IF NOT EXISTS cases_guild ON cases (guild_id, time)",
+        "CREATE INDEX IF NOT EXISTS cases_author ON cases (author)",
+        # for data requests, which look for a user in every guild
+        "CREATE INDEX IF NOT EXISTS cases_user ON cases (member_id)",
+    )
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warnsystem-db")
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self):
+        db = sqlite3.connect(str(self.path), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            db.execute(statement)
+        db.commit()
+        self._db = db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        await self._run(self._connect)
+        log.info(f"Modlog database opened at {self.path}.")
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    async def _execute(self, query: str, params: tuple = (), *, many=False) -> List[tuple]:
+        def execute():
+            if many:
+                self._db.executemany(query, params)
+                return []
+            return self._db.execute(query, params).fetchall()
+
+        return await self._transaction(execute)
+
+    @staticmethod
+    def _row(guild_id: int, member_id: int, case: dict) -> tuple:
+        return (
+            guild_id,
+            member_id,
+            case["level"],
+            case.get("author"),
+            case.get("time"),
+            json.dumps(case),
+        )
+
+    async def _transaction(self, func, *args):
+        """
+        Run ``func(*args)`` in the database thread, in a single transaction.
+        """
+
+        def run():
+            with self._db:  # commit or rollback
+                return func(*args)
+
+        return await self._run(run)
+
+    def _find_case(self, guild_id: int, member_id: int, index: int) -> Tuple[int, str]:
+        # called inside a transaction, returns the row ID and the data of the case
+        if index < 1:
+            raise IndexError(index)
+        row = self._db.execute(
+            "SELECT id, data FROM cases WHERE guild_id = ? AND member_id = ? "
+            "ORDER BY id LIMIT 1 OFFSET ?",
+            (guild_id, member_id, index - 1),
+        ).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return row
+
+    async def add_case(self, guild_id: int, member_id: int, case: dict):
+        await self.add_cases(guild_id, member_id, [case])
+
+    async def add_pending_case(self, guild_id: int, member_id: int, case: dict) -> Hashable:
+        """
+        Add a case whose modlog message isn't posted yet. Returns its row ID.
+        """
+
+        def insert():
+            return self._db.execute(
+                "INSERT INTO cases (guild_id, member_id, level, author, time, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._row(guild_id, member_id, case),
+            ).lastrowid
+
+        return await self._transaction(insert)
+
+    async def set_case_modlog(
+        self, guild_id: int, member_id: int, ref: Hashable, modlog: Optional[dict]
+    ) -> bool:
+        if modlog is None:
+            return True
+
+        def update():
+            row = self._db.execute("SELECT data FROM cases WHERE id = ?", (ref,)).fetchone()
+            if row is None:
+                return False
+            case = json.loads(row[0])
+            case["modlog_message"] = modlog
+            self._db.execute("UPDATE cases SET data = ? WHERE id = ?", (json.dumps(case), ref))
+            return True
+
+        return await self._transaction(update)
+
+    async def add_cases(self, guild_id: int, member_id: int, cases: List[dict]):
+        await self._execute(
+            "INSERT INTO cases (guild_id, member_id, level, author, time, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [self._row(guild_id, member_id, x) for x in cases],
+            many=True,
+        )
+
+    async def get_member_cases(
+        self,
+        guild_id: int,
+        member_id: int,
+        *,
+        since: Optional[int] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[dict]:
+        page = (-1 if limit is None else limit, offset)
+        if since is None:
+            rows = await self._execute(
+                "SELECT data FROM cases WHERE guild_id = ? AND member_id = ? "
+                "ORDER BY id LIMIT ? OFFSET ?",
+                (guild_id, member_id) + page,
+            )
+        else:
+            rows = await self._execute(
+                "SELECT data FROM cases WHERE guild_id = ? AND member_id = ? AND time > ? "
+                "ORDER BY id LIMIT ? OFFSET ?",
+                (guild_id, member_id, since) + page,
+            )
+        return [json.loads(x[0]) for x in rows]
+
+    async def count_member_cases(
+        self, guild_id: int, member_id: int, *, level: Optional[int] = None
+    ) -> int:
+        if level is None:
+            rows = await self._execute(
+                "SELECT COUNT(*) FROM cases WHERE guild_id = ? AND member_id = ?",
+                (guild_id, member_id),
+            )
+        else:
+            rows = await self._execute(
+                "SELECT COUNT(*) FROM cases WHERE guild_id = ? AND member_id = ? AND level = ?",
+                (guild_id, member_id, level),
+            )
+        return rows[0][0]
+
+    async def count_member_levels(self, guild_id: int, member_id: int) -> Dict[int, int]:
+        rows = await self._execute(
+            "SELECT level, COUNT(*) FROM cases WHERE guild_id = ? AND member_id = ? "
+            "GROUP BY level",
+            (guild_id, member_id),
+        )
+        return dict(rows)
+
+    async def get_case(self, guild_id: int, member_id: int, index: int) -> dict:
+        _case_id, data = await self._transaction(self._find_case, guild_id, member_id, index)
+        return json.loads(data)
+
+    async def set_case(self, guild_id: int, member_id: int, index: int, case: dict):
+        def update():
+            case_id, _data = self._find_case(guild_id, member_id, index)
+            self._db.execute(
+                "UPDATE cases SET level = ?, author = ?, time = ?, data = ? WHERE id = ?",
+                self._row(guild_id, member_id, case)[2:] + (case_id,),
+            )
+
+        await self._transaction(update)
+
+    async def remove_case(self, guild_id: int, member_id: int, index: int) -> dict:
+        def remove():
+            case_id, data = self._find_case(guild_id, member_id, index)
+            self._db.execute("DELETE FROM cases WHERE id = ?", (case_id,))
+            return data
+
+        return json.loads(await self._transaction(remove))
+
+    async def get_guild_cases(
+        self, guild_id: int, *, limit: Optional[int] = None, offset: int = 0, newest_first=False
+    ) -> List[Tuple[int, dict]]:
+        order = "DESC" if newest_first else "ASC"
+        rows = await self._execute(
+            f"SELECT member_id, data FROM cases WHERE guild_id = ? "
+            f"ORDER BY time {order}, id {order} LIMIT ? OFFSET ?",
+            (guild_id, -1 if limit is None else limit, offset),
+        )
+        return [(x[0], json.loads(x[1])) for x in rows]
+
+    def guild_cases_reader(self, guild_id: int, *, newest_first=False) -> CasesReader:
+        """
+        Return a function reading pages of :meth:`get_guild_cases`, one query per page.
+        """
+
+        async def read(offset: int, limit: int) -> List[Tuple[int, dict]]:
+            return await self.get_guild_cases(
+                guild_id, offset=offset, limit=limit, newest_first=newest_first
+            )
+
+        return read
+
+    async def count_guild_cases(self, guild_id: int) -> int:
+        rows = await self._execute("SELECT COUNT(*) FROM cases WHERE guild_id = ?", (guild_id,))
+        return rows[0][0]
+
+    async def count_guild_levels(self, guild_id: int) -> List[LevelCount]:
+        # counted by SQLite, the cases are not loaded
+        rows = await self._execute(
+            "SELECT member_id, level, CAST(time AS INTEGER) / ?, COUNT(*) FROM cases "
+            "WHERE guild_id = ? GROUP BY 1, 2, 3",
+            (DAY, guild_id),
+        )
+        return [tuple(x) for x in rows]
+
+    async def clear_guild(self, guild_id: int):
+        await self._execute("DELETE FROM cases WHERE guild_id = ?", (guild_id,))
+
+    async def get_user_cases(self, user_id: int) -> Dict[int, List[dict]]:
+        rows = await self._execute(
+            "SELECT guild_id, data FROM cases WHERE member_id = ? ORDER BY id", (user_id,)
+        )
+        result = {}
+        for guild_id, data in rows:
+            result.setdefault(guild_id, []).append(json.loads(data))
+        return result
+
+    async def delete_user(self, user_id: int):
+        await self._execute("DELETE FROM cases WHERE member_id = ?", (user_id,))
+
+    async def iter_members(self) -> AsyncIterator[Tuple[int, int, List[dict]]]:
+        rows = await self._execute(
+            "SELECT guild_id, member_id, data FROM cases ORDER BY guild_id, member_id, id"
+        )
+        current, cases = None, []
+        for guild_id, member_id, data in rows:
+            if (guild_id, member_id) != current:
+                if cases:
+                    yield current[0], current[1], cases
+                current, cases = (guild_id, member_id), []
+            cases.append(json.loads(data))
+        if cases:
+            yield current[0], current[1], cases
+
+    async def clear_all(self):
+        await self._execute("DELETE FROM cases")
+
+
+async def migrate_modlogs(source, destination) -> int:
+    """
+    Replace the content of ``destination`` with the cases of ``source``.
+
+    The source is left untouched. Returns the number of cases copied.
+    """
+    await destination.clear_all()
+    total = 0
+    async for guild_id, member_id, cases in source.iter_members():
+        await destination.add_cases(guild_id, member_id, cases)
+        total += len(cases)
+    return total
@@ -8,8 +8,9 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Dict, Optional, Generic, TypeVar
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Generic, TypeVar
 import discord
+import math
 import logging
 from discord.ext.commands import Paginator as CommandPaginator
 
@@ -313,6 +314,106 @@ class TextPageSource(menus.ListPageSource):
         return content
 
 
+class LazyListPageSource(menus.PageSource):
+    """
+    Like :class:`menus.ListPageSource`, but the entries are fetched page by page.
+
+    ``fetch(offset, limit)`` returns the entries of a page, ``total`` is the number of entries
+    (from a count query). Fetched pages are kept.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[int, int], Awaitable[List[Any]]],
+        total: int,
+        *,
+        per_page: int,
+    ) -> None:
+        self.fetch = fetch
+        self.total = total
+        self.per_page = per_page
+        self.pages: Dict[int, List[Any]] = {}
+
+    def is_paginating(self) -> bool:
+        return self.total > self.per_page
+
+    def get_max_pages(self) -> int:
+        return max(1, math.ceil(self.total / self.per_page))
+
+    async def get_page(self, page_number: int) -> List[Any]:
+        if not 0 <= page_number < self.get_max_pages():
+            raise IndexError(page_number)
+        page = self.pages.get(page_number)
+        if page is None:
+            page = await self.fetch(page_number * self.per_page, self.per_page)
+            self.pages[page_number] = page
+        return page
+
+    def get_entry(self, index: int) -> Any:
+        """Return an entry from a page already fetched."""
+        return self.pages[index // self.per_page][index % self.per_page]
+
+
+class StreamedTextPageSource(menus.PageSource):
+    """
+    Text pages built on demand from entries fetched in chunks.
+
+    Each entry is formatted with ``format_entry(index, entry)`` and entries are packed in pages
+    of ``page_length`` characters, like :func:`redbot.core.utils.chat_formatting.pagify`. Only
+    the entries needed to show the requested page are fetched, so the number of pages is
+    unknown until the last entry is reached.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[int, int], Awaitable[List[Any]]],
+        format_entry: Callable[[int, Any], str],
+        total: int,
+        *,
+        chunk_size: int = 25,
+        page_length: int = 1900,
+    ) -> None:
+        self.fetch = fetch
+        self.format_entry = format_entry
+        self.total = total
+        self.chunk_size = chunk_size
+        self.page_length = page_length
+        self.pages: List[str] = []
+        self._current = ""
+        self._offset = 0
+        self.exhausted = total == 0
+
+    def is_paginating(self) -> bool:
+        return self.get_max_pages() != 1
+
+    def get_max_pages(self) -> Optional[int]:
+        return len(self.pages) if self.exhausted else None
+
+    def _add(self, text: str):
+        if self._current and len(self._current) + len(text) > self.page_length:
+            self.pages.append(self._current)
+            self._current = ""
+        self._current += text
+
+    async def _fill(self):
+        entries = await self.fetch(self._offset, self.chunk_size)
+        for entry in entries:
+            self._add(self.format_entry(self._offset, entry))
+            self._offset += 1
+        if len(entries) < self.chunk_size or self._offset >= self.total:
+            self.exhausted = True
+            if self._current:
+                self.pages.append(self._current)
+                self._current = ""
+
+    async def get_page(self, page_number: int) -> str:
+        if page_number < 0:
+            raise IndexError(page_number)
+        while len(self.pages) <= page_number and not self.exhausted:
+            await self._fill()
+        return self.pages[page_number]
+
+
 class SimplePageSource(menus.ListPageSource):
     async def format_page(self, menu: SimplePages, entries):
         pages = []
@@ -0,0 +1,167 @@
+import re
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # python < 3.11
+    import sre_parse
+    import sre_constants
+
+# literals shorter than this match too many messages to be worth filtering on
+MIN_LITERAL_LENGTH = 2
+
+_REPEATS = {
+    sre_constants.MAX_REPEAT,
+    sre_constants.MIN_REPEAT,
+    getattr(sre_constants, "POSSESSIVE_REPEAT", sre_constants.MAX_REPEAT),
+}
+_ATOMIC_GROUP = getattr(sre_constants, "ATOMIC_GROUP", None)
+
+
+def _required_literals(parsed) -> List[Set[str]]:
+    """
+    Walk a parsed pattern and return its requirements.
+
+    Each requirement is a set of literal strings, and at least one of them must appear in any
+    text matched by the pattern. Literals are casefolded, so the check is case insensitive.
+    """
+    requirements = []
+    current = []
+
+    def flush():
+        if current:
+            requirements.append({"".join(current).casefold()})
+            current.clear()
+
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            current.append(chr(av))
+        elif op is sre_constants.AT:
+            continue  # zero-width anchors don't split literals
+        elif op is sre_constants.SUBPATTERN:
+            flush()
+            requirements.extend(_required_literals(av[-1]))
+        elif op in _REPEATS:
+            flush()
+            min_repeat, _max_repeat, item = av
+            if min_repeat >= 1:
+                requirements.extend(_required_literals(item))
+        elif op is _ATOMIC_GROUP:
+            flush()
+            requirements.extend(_required_literals(av))
+        elif op is sre_constants.BRANCH:
+            flush()
+            alternatives = set()
+            for branch in av[1]:
+                best = _best_requirement(_required_literals(branch))
+                if best is None:
+                    alternatives = None
+                    break
+                alternatives |= best
+            if alternatives:
+                requirements.append(alternatives)
+        else:
+            # character classes, wildcards, lookarounds, backreferences...
+            flush()
+    flush()
+    return requirements
+
+
+def _best_requirement(requirements: List[Set[str]]) -> Optional[Set[str]]:
+    """Pick the most selective requirement: the one whose shortest alternative is the longest."""
+    best = None
+    best_length = 0
+    for requirement in requirements:
+        length = min(len(x) for x in requirement)
+        if length >= MIN_LITERAL_LENGTH and length > best_length:
+            best, best_length = requirement, length
+    return best
+
+
+def extract_literals(pattern: re.Pattern) -> Optional[Set[str]]:
+    """
+    Return a set of casefolded literals, one of which must appear for the pattern to match,
+    or :py:obj:`None` if no useful literal can be extracted (the pattern must always run).
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    return _best_requirement(_required_literals(parsed))
+
+
+class LiteralPrefilter:
+    """
+    Per-guild index of the literals required by the automod regexes and of the antispam
+    whitelist.
+
+    All literals are searched with one combined alternation in a single pass over the
+    casefolded message. Patterns are only dispatched to the process pool if one of their
+    literals appears; patterns without an extractable literal always run.
+    """
+
+    def __init__(self, patterns: Dict[str, re.Pattern], whitelist: Iterable[str] = ()):
+        self.requirements: Dict[str, Tuple[str, Set[str]]] = {}
+        self.always_run = set()
+        for name, pattern in patterns.items():
+            literals = extract_literals(pattern)
+            if literals is None:
+                self.always_run.add(name)
+            else:
+                self.requirements[name] = (pattern.pattern, literals)
+
+        self.whitelist = [x for x in whitelist if x]
+        self.whitelist_empty_word = any(not x for x in whitelist)
+        self._whitelist_folded = {x.casefold() for x in self.whitelist}
+
+        literals = set(self._whitelist_folded)
+        for _pattern, requirement in self.requirements.values():
+            literals |= requirement
+        # longest first, so a hit at a given position is the longest literal starting there;
+        # shorter literals starting at the same position are substrings of it
+        ordered = sorted(literals, key=len, reverse=True)
+        self._search = (
+            re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))") if ordered else None
+        )
+        self._contained = {x: {y for y in ordered if y in x} for x in ordered}
+        self._last: Tuple[Optional[str], Set[str]] = (None, set())
+
+    def __len__(self):
+        return len(self._contained)
+
+    def scan(self, content: str) -> Set[str]:
+        """Return every indexed literal found in the content. The last result is memoized."""
+        if self._last[0] == content:
+            return self._last[1]
+        found = set()
+        if self._search is not None:
+            for hit in set(self._search.findall(content.casefold())):
+                found |= self._contained[hit]
+        self._last = (content, found)
+        return found
+
+    def candidates(self, content: str, patterns: Dict[str, re.Pattern]) -> List[str]:
+        """Names of the patterns that may match the content and need to be evaluated."""
+        found = self.scan(content)
+        names = []
+        for name, pattern in patterns.items():
+            indexed = self.requirements.get(name)
+            if indexed is None or indexed[0] != pattern.pattern:
+                names.append(name)  # always run, or the index is outdated for this pattern
+            elif indexed[1] & found:
+                names.append(name)
+        return names
+
+    def whitelisted(self, content: str) -> bool:
+        """Same result as ``any(word in content for word in whitelist)``."""
+        if self.whitelist_empty_word:
+            return True
+        if not self.whitelist:
+            return False
+        found = self.scan(content)
+        if not found & self._whitelist_folded:
+            return False
+        # the scan is case insensitive, the whitelist isn't
+        return any(word in content for word in self.whitelist if word.casefold() in found)
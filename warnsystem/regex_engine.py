@@ -0,0 +1,337 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import multiprocessing
+import re
+import time
+
+from multiprocessing.pool import Pool
+from typing import Dict, List, Optional, Tuple
+
+from .regex_worker import PROGRESS_SLOTS, findall_pattern, init_worker, search_patterns
+
+log = logging.getLogger("red.laggron.warnsystem")
+
+# upper bounds of the histogram buckets, in seconds
+HISTOGRAM_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 0.5)
+HISTOGRAM_LABELS = ("<0.1ms", "<1ms", "<10ms", "<100ms", "<500ms", ">500ms")
+
+
+class RegexTimeout(asyncio.TimeoutError):
+    """
+    A job took too long. ``pattern`` is the name of the pattern it was stuck on, or
+    :py:obj:`None` if it is unknown.
+    """
+
+    def __init__(self, pattern: Optional[str] = None):
+        super().__init__(pattern)
+        self.pattern = pattern
+
+
+class PoolTerminated(Exception):
+    """
+    The pool running a job was terminated because of another job. The job is not to blame.
+    """
+
+
+def _resolve(future: asyncio.Future, result=None, exception: Optional[BaseException] = None):
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+def _threadsafe(loop: asyncio.AbstractEventLoop, *args, **kwargs):
+    # called from the result handler thread of the pool
+    try:
+        loop.call_soon_threadsafe(lambda: _resolve(*args, **kwargs))
+    except RuntimeError:
+        pass  # loop closed
+
+
+class PatternStats:
+    """
+    Evaluation times and match rate of a pattern.
+
+    ``histogram`` counts the evaluations per bucket of :data:`HISTOGRAM_BUCKETS`, the last slot
+    is for the evaluations slower than the last bucket.
+    """
+
+    __slots__ = ("source", "runs", "matches", "total", "max", "slow", "timeouts", "histogram")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.runs = 0
+        self.matches = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.timeouts = 0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.runs if self.runs else 0.0
+
+    @property
+    def match_rate(self) -> float:
+        return self.matches / self.runs if self.runs else 0.0
+
+    def add(self, seconds: float, matched: bool, slow_threshold: float):
+        self.runs += 1
+        self.matches += matched
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+        if seconds >= slow_threshold:
+            self.slow += 1
+
+
+class RegexEngine:
+    """
+    Run user defined patterns in a process pool, with a timeout and per pattern telemetry.
+
+    Workers keep the patterns compiled, jobs only carry their source. The pool is replaced
+    every ``recycle_interval`` seconds, and killed after a timeout since the worker is still
+    stuck on the pattern.
+
+    The timeout is shared by all the patterns of a job and counts from when a worker starts
+    the job, so jobs waiting in the queue behind a stuck worker don't time out. The pattern
+    running when the time is up is blamed. Jobs killed with a pool because of another job are
+    retried up to ``retries`` times on the new pool.
+
+    Patterns taking more than ``slow_threshold`` seconds are flagged as slow before they
+    reach the timeout.
+    """
+
+    def __init__(
+        self,
+        *,
+        timeout: float = 1,
+        slow_threshold: float = 0.1,
+        recycle_interval: float = 3600,
+        maxtasksperchild: int = 1000,
+        retries: int = 2,
+        queue_timeout: float = 30,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.queue_timeout = queue_timeout
+        self.slow_threshold = slow_threshold
+        self.recycle_interval = recycle_interval
+        self.maxtasksperchild = maxtasksperchild
+        self.stats: Dict[Tuple[int, str], PatternStats] = {}
+        self.recycled = 0
+        self._pool: Optional[Pool] = None
+        self._pool_created = 0.0
+        self._job_ids = itertools.count(1)
+        self._progress = multiprocessing.RawArray("d", PROGRESS_SLOTS * 3)
+        # running jobs, job ID -> (pool, future)
+        self._jobs: Dict[int, Tuple[Pool, asyncio.Future]] = {}
+
+    @property
+    def pool(self) -> Pool:
+        if self._pool is None:
+            self._pool = Pool(
+                maxtasksperchild=self.maxtasksperchild,
+                initializer=init_worker,
+                initargs=(self._progress,),
+            )
+            self._pool_created = asyncio.get_event_loop().time()
+        return self._pool
+
+    def _retire(self, pool: Pool, terminate: bool):
+        if terminate:
+            # jobs still running or queued on that pool will never complete
+            for pool_, future in self._jobs.values():
+                if pool_ is pool:
+                    _resolve(future, exception=PoolTerminated())
+
+        def retire():
+            if terminate:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+        asyncio.get_event_loop().run_in_executor(None, retire)
+
+    def recycle(self, *, terminate: bool = False):
+        """
+        Replace the worker processes. The old pool finishes its jobs, unless ``terminate``.
+        """
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        self.recycled += 1
+        self._retire(pool, terminate)
+
+    def _kill(self, pool: Pool):
+        """
+        Terminate the pool a job got stuck on, which may not be the current pool anymore.
+        """
+        if self._pool is pool:
+            self.recycle(terminate=True)
+        else:
+            self._retire(pool, terminate=True)
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        for _pool, future in self._jobs.values():
+            _resolve(future, exception=PoolTerminated())
+        if pool is not None:
+            pool.terminate()
+
+    def _job_progress(self, job_id: int) -> Optional[Tuple[int, float]]:
+        """
+        Return the index of the pattern a job is running and when the job started, or
+        :py:obj:`None` if the job didn't start yet.
+        """
+        slot = (job_id % PROGRESS_SLOTS) * 3
+        if self._progress[slot] != job_id:
+            return None
+        return int(self._progress[slot + 1]), self._progress[slot + 2]
+
+    async def _wait(self, job_id: int, future: asyncio.Future):
+        queued = 0.0
+        while True:
+            progress = self._job_progress(job_id)
+            if progress is None:
+                # waiting for a worker, the timeouts of the jobs before will free one
+                if queued >= self.queue_timeout:
+                    raise RegexTimeout()
+                delay = min(self.timeout, self.queue_timeout - queued)
+                queued += delay
+            else:
+                # one deadline for the whole job, blame the pattern it is running then
+                delay = progress[1] + self.timeout - time.monotonic()
+                if delay <= 0 and not future.done():
+                    raise RegexTimeout(self._job_progress(job_id)[0])
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout=max(delay, 0))
+            except asyncio.TimeoutError:
+                if future.done():
+                    return future.result()
+
+    async def _run_once(self, func, args: tuple):
+        loop = asyncio.get_running_loop()
+        if self._pool is not None and loop.time() - self._pool_created > self.recycle_interval:
+            self.recycle()
+        pool = self.pool
+        job_id = next(self._job_ids)
+        future = loop.create_future()
+        self._jobs[job_id] = (pool, future)
+        pool.apply_async(
+            func,
+            args + (job_id,),
+            callback=lambda x: _threadsafe(loop, future, x),
+            error_callback=lambda x: _threadsafe(loop, future, exception=x),
+        )
+        try:
+            return await self._wait(job_id, future)
+        except RegexTimeout as e:
+            del self._jobs[job_id]
+            if e.pattern is not None:
+                self._kill(pool)
+            raise
+        finally:
+            self._jobs.pop(job_id, None)
+
+    async def _run(self, func, *args):
+        """
+        Run ``func(*args, job_id)`` in the pool. Raises :class:`RegexTimeout` with the index of
+        the pattern the job was stuck on as ``pattern``, or :py:obj:`None` if the job couldn't
+        run (pool saturated or killed because of other jobs).
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._run_once(func, args)
+            except PoolTerminated:
+                log.debug("Regex job killed with its pool because of another job, retrying.")
+        raise RegexTimeout()
+
+    def _get_stats(self, guild_id: int, name: str, pattern: re.Pattern) -> PatternStats:
+        stats = self.stats.get((guild_id, name))
+        if stats is None or stats.source != pattern.pattern:
+            # new pattern or edited with the same name
+            stats = self.stats[(guild_id, name)] = PatternStats(pattern.pattern)
+        return stats
+
+    def _record(self, guild_id: int, name: str, pattern: re.Pattern, seconds: float, matched):
+        stats = self._get_stats(guild_id, name, pattern)
+        was_slow = stats.slow
+        stats.add(seconds, bool(matched), self.slow_threshold)
+        if stats.slow and not was_slow:
+            log.warning(
+                f"[Guild {guild_id}] Automod: regex {name} is slow, took {seconds * 1000:.2f}ms "
+                f"on a message (timeout is {self.timeout}s). Offending regex: {pattern.pattern}"
+            )
+
+    def record_timeout(self, guild_id: int, name: str, pattern: re.Pattern):
+        self._get_stats(guild_id, name, pattern).timeouts += 1
+
+    async def search_many(
+        self, guild_id: int, patterns: Dict[str, re.Pattern], content: str
+    ) -> Dict[str, Tuple[Optional[str], float]]:
+        """
+        Search all patterns in the content in a single job.
+
+        Returns a dict of pattern name -> (first match or :py:obj:`None`, seconds spent).
+        Raises :class:`RegexTimeout` with the name of the pattern the job was stuck on if it
+        took too long.
+        """
+        jobs = [(name, x.pattern, x.flags) for name, x in patterns.items()]
+        try:
+            results = await self._run(search_patterns, jobs, content)
+        except RegexTimeout as e:
+            # replace the index by the name of the pattern, only this one is to blame
+            name = jobs[e.pattern][0] if e.pattern is not None else None
+            if name is not None:
+                self.record_timeout(guild_id, name, patterns[name])
+            raise RegexTimeout(name) from e
+        for name, (match, seconds) in results.items():
+            self._record(guild_id, name, patterns[name], seconds, match is not None)
+        return results
+
+    async def findall(self, guild_id: int, name: str, pattern: re.Pattern, content: str) -> list:
+        """
+        Return all matches of a pattern in the content.
+
+        Raises :class:`RegexTimeout` if the job took too long, with ``pattern`` set to ``name``
+        only if the pattern itself is to blame.
+        """
+        try:
+            matches, seconds = await self._run(
+                findall_pattern, pattern.pattern, pattern.flags, content
+            )
+        except RegexTimeout as e:
+            if e.pattern is None:
+                raise
+            self.record_timeout(guild_id, name, pattern)
+            raise RegexTimeout(name) from e
+        self._record(guild_id, name, pattern, seconds, matches)
+        return matches
+
+    def guild_stats(self, guild_id: int) -> Dict[str, PatternStats]:
+        return {name: stats for (gid, name), stats in self.stats.items() if gid == guild_id}
+
+    def slow_patterns(self, guild_id: int) -> List[Tuple[str, PatternStats]]:
+        """
+        Return the patterns of a guild flagged as slow or that timed out, slowest first.
+        """
+        flagged = [
+            (name, stats)
+            for name, stats in self.guild_stats(guild_id).items()
+            if stats.slow or stats.timeouts
+        ]
+        return sorted(flagged, key=lambda x: (x[1].timeouts, x[1].max), reverse=True)
+
+    def forget(self, guild_id: int, name: Optional[str] = None):
+        if name is not None:
+            self.stats.pop((guild_id, name), None)
+            return
+        for key in [x for x in self.stats if x[0] == guild_id]:
+            del self.stats[key]
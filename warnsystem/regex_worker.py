@@ -0,0 +1,78 @@
+"""
+Functions executed inside the automod regex process pool.
+
+They must stay at module level so they can be pickled by reference. Patterns are sent as
+``(source, flags)`` and compiled once per worker process.
+"""
+
+import re
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+# compiled patterns of this worker process, keyed by (source, flags)
+_compiled: Dict[Tuple[str, int], re.Pattern] = {}
+MAX_COMPILED = 1024
+
+# progress of the jobs, shared with the engine. Each job ID uses the slot
+# job_id % PROGRESS_SLOTS: (job ID, index of the pattern being run, time.monotonic() when the
+# job started), so the engine can time the job out and tell which pattern it is stuck on.
+PROGRESS_SLOTS = 1024
+_progress = None
+
+
+def init_worker(progress):
+    global _progress
+    _progress = progress
+
+
+def _report(job_id: Optional[int], index: int):
+    if _progress is None or job_id is None:
+        return
+    slot = (job_id % PROGRESS_SLOTS) * 3
+    _progress[slot + 1] = index
+    if index == 0:
+        _progress[slot + 2] = time.monotonic()
+        _progress[slot] = job_id
+
+
+def get_pattern(source: str, flags: int) -> re.Pattern:
+    try:
+        return _compiled[(source, flags)]
+    except KeyError:
+        if len(_compiled) >= MAX_COMPILED:
+            _compiled.clear()
+        pattern = _compiled[(source, flags)] = re.compile(source, flags)
+        return pattern
+
+
+def search_patterns(
+    patterns: List[Tuple[str, str, int]], content: str, job_id: Optional[int] = None
+) -> Dict[str, Tuple[Optional[str], float]]:
+    """
+    Run every pattern on the message content. ``patterns`` is a list of
+    ``(name, source, flags)``.
+
+    Returns a dict of pattern name -> (first match or None, seconds spent on that pattern).
+    """
+    results = {}
+    for index, (name, source, flags) in enumerate(patterns):
+        _report(job_id, index)
+        pattern = get_pattern(source, flags)
+        start = time.perf_counter()
+        match = pattern.search(content)
+        results[name] = (match.group(0) if match else None, time.perf_counter() - start)
+    return results
+
+
+def findall_pattern(
+    source: str, flags: int, content: str, job_id: Optional[int] = None
+) -> Tuple[list, float]:
+    """
+    Return the matches of a pattern and the seconds spent.
+    """
+    _report(job_id, 0)
+    pattern = get_pattern(source, flags)
+    start = time.perf_counter()
+    matches = pattern.findall(content)
+    return matches, time.perf_counter() - start
@@ -13,11 +13,30 @@ from redbot.core.utils import predicates, menus
 from redbot.core.utils.chat_formatting import pagify
 
 from .abc import MixinMeta
+from .modlog_store import BACKENDS
 
 log = logging.getLogger("red.laggron.warnsystem")
 _ = Translator("WarnSystem", __file__)
 
 
+def channels_progress(ctx: commands.Context):
+    """
+    Return a progress callback for :class:`~warnsystem.bulk.OverwriteQueue`, showing the
+    number of channels edited in a message. Nothing is sent if it finishes quickly.
+    """
+    message = None
+
+    async def progress(done: int, total: int):
+        nonlocal message
+        text = _("Editing channel permissions... {done}/{total}").format(done=done, total=total)
+        if message is not None:
+            await message.edit(content=text)
+        elif done < total:
+            message = await ctx.send(text)
+
+    return progress
+
+
 class SettingsMixin(MixinMeta):
     """
     All commands for setting up the bot.
@@ -49,7 +68,7 @@ class SettingsMixin(MixinMeta):
         where muted members can talk.
         """
         guild = ctx.guild
-        current = await self.data.guild(guild).update_mute()
+        current = await self.cache.get_update_mute(guild)
         if enable is None:
             await ctx.send(
                 _(
@@ -60,12 +79,12 @@ class SettingsMixin(MixinMeta):
                 )
             )
         elif enable:
-            await self.data.guild(guild).update_mute.set(True)
+            await self.cache.set_update_mute(guild, True)
             await ctx.send(
                 _("Done. New created channels will be updated to keep the mute role working.")
             )
         else:
-            await self.data.guild(guild).update_mute.set(False)
+            await self.cache.set_update_mute(guild, False)
             await ctx.send(
                 _(
                     "Done. New created channels won't be updated.\n**Make sure to update "
@@ -241,8 +260,10 @@ class SettingsMixin(MixinMeta):
                         }
                     )
                     total_cases += 1
-                async with self.data.custom("MODLOGS", guild.id, int(member)).x() as logs:
-                    logs.extend(cases)
+                async with self.api.modlog_gate.write():
+                    await self.api.modlogs.add_cases(guild.id, int(member), cases)
+                    self.api.autowarn_counters.invalidate(guild.id)
+                    self.api.warn_stats.invalidate(guild.id)
             return total_cases
 
         guild = ctx.guild
@@ -321,7 +342,10 @@ class SettingsMixin(MixinMeta):
             total = await convert(content)
         elif pred.result == 1:
             await ctx.send(_("Deleting server logs... Settings, such as channels, are kept."))
-            await self.data.custom("MODLOGS").set({})
+            async with self.api.modlog_gate.write():
+                await self.api.modlogs.clear_guild(guild.id)
+                self.api.autowarn_counters.invalidate(guild.id)
+                self.api.warn_stats.invalidate(guild.id)
             await ctx.send(_("Starting conversion... This might take a long time."))
             total = await convert(content)
         t2 = time.time()
@@ -469,6 +493,56 @@ save it, as if it was performed with WarnSystem. **However, the member will not
                 )
             )
 
+    @warnset.command(name="modlogbackend")
+    @checks.is_owner()
+    async def warnset_modlogbackend(self, ctx: commands.Context, backend: str = None):
+        """
+        Choose where the cases of all servers are stored.
+
+        `config`: Red's Config (default).
+        `sqlite`: an indexed SQLite database, faster for servers with a lot of warnings.
+
+        All cases are copied to the new backend. The previous data is kept, but switching back\
+        will overwrite it.
+        """
+        current = self.api.modlogs.name
+        if backend is None:
+            await ctx.send(
+                _("Cases are currently stored with the `{backend}` backend.").format(
+                    backend=current
+                )
+            )
+            return
+        backend = backend.lower()
+        if backend not in BACKENDS:
+            await ctx.send(
+                _("Unknown backend. Available backends: {backends}").format(
+                    backends=", ".join(f"`{x}`" for x in BACKENDS)
+                )
+            )
+            return
+        if backend == current:
+            await ctx.send(_("That backend is already used."))
+            return
+        t1 = time.time()
+        async with ctx.typing():
+            try:
+                total = await self.api.set_modlog_backend(backend)
+            except Exception as e:
+                log.error(f"Failed to switch the modlog backend to {backend}.", exc_info=e)
+                await ctx.send(
+                    _(
+                        "Couldn't copy the cases, the backend wasn't changed. "
+                        "Check your console or logs for details."
+                    )
+                )
+                return
+        await ctx.send(
+            _(
+                "Done! {number} cases were copied to the `{backend}` backend in {time} seconds."
+            ).format(number=total, backend=backend, time=round(time.time() - t1, 2))
+        )
+
     @warnset.command(name="mute")
     async def warnset_mute(self, ctx: commands.Context, *, role: discord.Role = None):
         """
@@ -486,7 +560,7 @@ save it, as if it was performed with WarnSystem. **However, the member will not
                 )
                 return
             async with ctx.typing():
-                fails = await self.api.maybe_create_mute_role(guild)
+                fails = await self.api.maybe_create_mute_role(guild, channels_progress(ctx))
                 my_position = guild.me.top_role.position
                 if fails is False:
                     await ctx.send(
@@ -565,38 +639,37 @@ channels, and prevented from talking in all voice channels.
         reason = _("WarnSystem mute role permissions refresh")
         perms_failed = []  # if it failed because of Forbidden, add to this list
         other_failed = []  # if it failed because of HTTPException, add to this one
-        count = 0
-        category: discord.CategoryChannel
+        jobs = []
+        for channel in guild.channels:  # include categories, text and voice channels
+            # we check if the perms are correct, to prevent useless API calls
+            overwrites = channel.overwrites_for(mute_role)
+            if (
+                isinstance(channel, discord.TextChannel)
+                and overwrites.send_messages is False
+                and overwrites.add_reactions is False
+            ):
+                continue
+            elif isinstance(channel, discord.VoiceChannel) and overwrites.speak is False:
+                continue
+            elif overwrites == perms:
+                continue
+            jobs.append((channel, mute_role, perms, reason))
+        count = len(jobs)
+        log.debug(
+            f"[Guild {guild.id}] Editing {count} channels for mute role permissions refresh."
+        )
         async with ctx.typing():
-            for channel in guild.channels:  # include categories, text and voice channels
-                # we check if the perms are correct, to prevent useless API calls
-                overwrites = channel.overwrites_for(mute_role)
-                if (
-                    isinstance(channel, discord.TextChannel)
-                    and overwrites.send_messages is False
-                    and overwrites.add_reactions is False
-                ):
-                    continue
-                elif isinstance(channel, discord.VoiceChannel) and overwrites.speak is False:
-                    continue
-                elif overwrites == perms:
-                    continue
-                count += 1
-                try:
-                    log.debug(
-                        f"[Guild {guild.id}] Editing channel {channel.name} for "
-                        "mute role permissions refresh."
-                    )
-                    await channel.set_permissions(target=mute_role, overwrite=perms, reason=reason)
-                except discord.errors.Forbidden:
-                    perms_failed.append(channel)
-                except discord.errors.HTTPException as e:
-                    log.error(
-                        f"[Guild {guild.id}] Failed to edit channel {channel.name} "
-                        f"({channel.id}) while refreshing the mute role's permissions.",
-                        exc_info=e,
-                    )
-                    other_failed.append(channel)
+            failed = await self.api.overwrite_queue.apply(guild.id, jobs, channels_progress(ctx))
+        for channel, error in failed:
+            if isinstance(error, discord.errors.Forbidden):
+                perms_failed.append(channel)
+            else:
+                log.error(
+                    f"[Guild {guild.id}] Failed to edit channel {channel.name} "
+                    f"({channel.id}) while refreshing the mute role's permissions.",
+                    exc_info=error,
+                )
+                other_failed.append(channel)
         if not perms_failed and not other_failed:
             await ctx.send(
                 _("Successfully checked all channels, {len} were edited.").format(len=count)
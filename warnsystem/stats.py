@@ -0,0 +1,132 @@
+import asyncio
+
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+DAY = 86400
+
+
+class GuildRollup:
+    """
+    Number of cases of a guild by level, in total, per member and per day.
+
+    Days are counted since the epoch, in UTC.
+    """
+
+    __slots__ = ("levels", "members", "days")
+
+    def __init__(self):
+        self.levels: Counter = Counter()
+        self.members: Dict[int, Counter] = {}
+        self.days: Dict[int, Counter] = {}
+
+    def add(self, member_id: int, level: int, timestamp: Optional[int], count: int = 1):
+        day = None if timestamp is None else int(timestamp) // DAY
+        self.add_day(member_id, level, day, count)
+
+    def add_day(self, member_id: int, level: int, day: Optional[int], count: int = 1):
+        self.levels[level] += count
+        self.members.setdefault(member_id, Counter())[level] += count
+        if day is not None:
+            self.days.setdefault(day, Counter())[level] += count
+
+    def remove(self, member_id: int, level: int, timestamp: Optional[int]):
+        self.add(member_id, level, timestamp, count=-1)
+        # drop empty counters so the rollup doesn't grow with deleted cases
+        for counters, key in (
+            (self.members, member_id),
+            (self.days, None if timestamp is None else int(timestamp) // DAY),
+        ):
+            counter = counters.get(key)
+            if counter is not None and not +counter:
+                del counters[key]
+        self.levels = +self.levels
+
+    def since(self, timestamp: float) -> Counter:
+        """
+        Return the number of cases by level issued since the day of the timestamp.
+        """
+        first_day = int(timestamp) // DAY
+        result = Counter()
+        for day, counter in self.days.items():
+            if day >= first_day:
+                result.update(counter)
+        return result
+
+
+class WarnStats:
+    """
+    Rollups of the cases of each guild, so summaries don't have to walk the modlog.
+
+    A guild's rollup is built from the modlog the first time it is read, then updated when cases
+    are created or deleted. Bulk edits of the modlog invalidate it. Concurrent first reads of a
+    guild share the same build.
+    """
+
+    def __init__(self):
+        self.guilds: Dict[int, GuildRollup] = {}
+        # builds in progress, and the guilds edited during their build
+        self._builds: Dict[int, asyncio.Future] = {}
+        self._edited: Set[int] = set()
+
+    async def get(
+        self,
+        guild_id: int,
+        load_counts: Callable[[], Awaitable[Iterable[Tuple[int, int, Optional[int], int]]]],
+    ) -> GuildRollup:
+        """
+        Return the rollup of a guild, building it if needed.
+
+        ``load_counts()`` returns the number of cases of the guild as
+        ``(member_id, level, day or None, count)`` tuples.
+        """
+        rollup = self.guilds.get(guild_id)
+        if rollup is not None:
+            return rollup
+        build = self._builds.get(guild_id)
+        if build is None:
+            build = self._builds[guild_id] = asyncio.ensure_future(
+                self._build(guild_id, load_counts)
+            )
+        # a cancelled reader must not cancel the build of the others
+        return await asyncio.shield(build)
+
+    async def _build(self, guild_id: int, load_counts) -> GuildRollup:
+        try:
+            while True:
+                self._edited.discard(guild_id)
+                rollup = GuildRollup()
+                for member_id, level, day, count in await load_counts():
+                    rollup.add_day(int(member_id), level, day, count)
+                if guild_id not in self._edited:
+                    break
+                # the modlog was edited during the build, start over
+            self.guilds[guild_id] = rollup
+            return rollup
+        finally:
+            self._edited.discard(guild_id)
+            del self._builds[guild_id]
+
+    def add_case(self, guild_id: int, member_id: int, case: dict):
+        if guild_id in self._builds:
+            self._edited.add(guild_id)
+        rollup = self.guilds.get(guild_id)
+        if rollup is not None:
+            rollup.add(member_id, case["level"], case["time"])
+
+    def remove_case(self, guild_id: int, member_id: int, case: dict):
+        if guild_id in self._builds:
+            self._edited.add(guild_id)
+        rollup = self.guilds.get(guild_id)
+        if rollup is not None:
+            rollup.remove(member_id, case["level"], case["time"])
+
+    def invalidate(self, guild_id: Optional[int] = None):
+        """
+        Drop the rollup of a guild, or all rollups. They are rebuilt on next use.
+        """
+        self._edited.update(self._builds)
+        if guild_id is None:
+            self.guilds.clear()
+        else:
+            self.guilds.pop(guild_id, None)
@@ -0,0 +1,104 @@
+import asyncio
+import heapq
+import logging
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("red.laggron.warnsystem")
+
+# upper bound for a single sleep, so a wall clock jump can't delay unmutes forever
+MAX_SLEEP = 3600
+
+
+class TempActionTimers:
+    """
+    Min-heap of temporary actions (mutes and bans) keyed by their expiry timestamp.
+
+    Entries are never removed from the heap directly; cancelling or rescheduling an action
+    only updates ``self.expiries`` and outdated heap entries are skipped when popped.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, int]] = []
+        self.expiries: Dict[Tuple[int, int], float] = {}
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self.expiries)
+
+    @staticmethod
+    def get_expiry(data: dict) -> float:
+        """
+        Return the UNIX timestamp when the action ends.
+
+        Broken data (leftovers from old conversions) is due immediately, so the loop can log
+        and remove it.
+        """
+        try:
+            return float(int(data["time"]) + int(data["duration"]))
+        except (KeyError, TypeError, ValueError):
+            return 0.0
+
+    def schedule(self, guild_id: int, member_id: int, data: dict):
+        key = (int(guild_id), int(member_id))
+        expiry = self.get_expiry(data)
+        if self.expiries.get(key) == expiry:
+            return
+        self.expiries[key] = expiry
+        heapq.heappush(self._heap, (expiry, key[0], key[1]))
+        if self._heap[0][0] == expiry:
+            # new earliest expiry, wake up the loop so it sleeps for the right amount of time
+            self._changed.set()
+
+    def schedule_guild(self, guild_id: int, actions: dict):
+        for member_id, data in actions.items():
+            self.schedule(guild_id, member_id, data)
+
+    def cancel(self, guild_id: int, member_id: int):
+        self.expiries.pop((int(guild_id), int(member_id)), None)
+
+    def cancel_guild(self, guild_id: int):
+        for key in [x for x in self.expiries if x[0] == guild_id]:
+            del self.expiries[key]
+
+    def _discard_stale(self):
+        while self._heap:
+            expiry, guild_id, member_id = self._heap[0]
+            if self.expiries.get((guild_id, member_id)) == expiry:
+                return
+            heapq.heappop(self._heap)
+
+    def next_expiry(self) -> Optional[float]:
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None) -> List[Tuple[int, int]]:
+        """
+        Remove and return every ``(guild_id, member_id)`` whose action has expired.
+        """
+        now = time.time() if now is None else now
+        due = []
+        while True:
+            expiry = self.next_expiry()
+            if expiry is None or expiry > now:
+                return due
+            _, guild_id, member_id = heapq.heappop(self._heap)
+            del self.expiries[(guild_id, member_id)]
+            due.append((guild_id, member_id))
+
+    async def wait(self):
+        """
+        Sleep until the next action expires. Returns early if an earlier action is scheduled.
+        """
+        while True:
+            self._changed.clear()
+            expiry = self.next_expiry()
+            delay = MAX_SLEEP if expiry is None else min(expiry - time.time(), MAX_SLEEP)
+            if delay <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                if expiry is not None:
+                    return
@@ -7,7 +7,7 @@ from io import BytesIO
 from typing import Optional, TYPE_CHECKING, List, Dict, Any, Set, Tuple
 from asyncio import TimeoutError as AsyncTimeoutError
 from abc import ABC
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from redbot.core import commands, Config, checks
 from redbot.core.commands.converter import TimedeltaConverter
@@ -15,13 +15,14 @@ from redbot.core.i18n import Translator, cog_i18n
 from redbot.core.utils import predicates, menus, mod
 from redbot.core.utils.chat_formatting import pagify, text_to_file
 
-from warnsystem.components import WarningsSelector
+from warnsystem.components import WarningsSelector, WarnlistSource
 
 from . import errors
 from .api import API, UnavailableMember
 from .automod import AutomodMixin
 from .cache import MemoryCache
 from .converters import AdvancedMemberSelect
+from .paginator import Pages
 from .settings import SettingsMixin
 
 if TYPE_CHECKING:
@@ -30,6 +31,9 @@ if TYPE_CHECKING:
 log = logging.getLogger('red.laggron.warnsystem')
 _ = Translator('WarnSystem', __file__)
 
+# eligible voters are also refreshed on member and role updates, this covers mod/admin role edits
+VOTERS_CACHE_TTL = 300
+
 EMBED_MODLOG = lambda x: _('A member got a level {} warning.').format(x)
 EMBED_USER = lambda x: _('The moderation team set you a level {} warning.').format(x)
 
@@ -63,7 +67,7 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
     __version__ = '1.5.10'
     __author__ = ['retke (El Laggron)']
 
-    default_global = {'data_version': '0.0'}
+    default_global = {'data_version': '0.0', 'modlog_backend': 'config', 'user_index_built': False}
     default_guild = {
         'delete_message': False,
         'show_mod': False,
@@ -98,6 +102,7 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         },
         'vote_channel': None,
         'result_channel': None,
+        'vote_refresh_interval': 2,
         'forbidden_roles': [],
     }
     default_custom_member = {'x': []}
@@ -112,9 +117,16 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         except AttributeError:
             pass
         self.data.register_custom('MODLOGS', **self.default_custom_member)
+        try:
+            self.data.init_custom('USER_INDEX', 1)
+        except AttributeError:
+            pass
+        self.data.register_custom('USER_INDEX', member=[])
         self.cache = MemoryCache(self.bot, self.data)
         self.api = API(self.bot, self.data, self.cache)
         self.active_votes: Dict[int, Dict] = {}
+        # guild ID: (expiration, result of _resolve_eligible_voters)
+        self.eligible_voters: Dict[int, Tuple[float, Tuple]] = {}
 
     @staticmethod
     def _is_online_status(status: discord.Status) -> bool:
@@ -215,6 +227,11 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
     async def _resolve_eligible_voters(
         self, guild: discord.Guild
     ) -> Tuple[List[discord.Member], List[discord.Member], Set[int], Set[int]]:
+        # cached member objects are updated in place by discord.py, statuses stay accurate
+        now = asyncio.get_running_loop().time()
+        cached = self.eligible_voters.get(guild.id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
         admin_roles = await self.bot.get_admin_roles(guild)
         mod_roles = await self.bot.get_mod_roles(guild)
         admin_role_ids = {role.id for role in admin_roles}
@@ -223,9 +240,8 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         mods: List[discord.Member] = []
         pure_admins: List[discord.Member] = []
         for member in guild.members:
-            role_ids = {role.id for role in member.roles}
-            is_mod = bool(role_ids & mod_role_ids)
-            is_admin = bool(role_ids & admin_role_ids)
+            is_mod = not mod_role_ids.isdisjoint(member._roles)
+            is_admin = not admin_role_ids.isdisjoint(member._roles)
             if not (is_mod or is_admin):
                 continue
             if is_mod:
@@ -237,7 +253,12 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         pure_admins.sort(key=lambda m: m.display_name.lower())
         eligible_ids = {member.id for member in mods + pure_admins}
         mod_member_ids = {member.id for member in mods}
-        return mods, pure_admins, eligible_ids, mod_member_ids
+        result = (mods, pure_admins, eligible_ids, mod_member_ids)
+        self.eligible_voters[guild.id] = (now + VOTERS_CACHE_TTL, result)
+        return result
+
+    def _invalidate_eligible_voters(self, guild: discord.Guild):
+        self.eligible_voters.pop(guild.id, None)
 
     async def _build_vote_snapshot(self, guild: discord.Guild, info: Dict[str, Any]) -> Dict[str, Any]:
         mods, pure_admins, eligible_ids, mod_member_ids = await self._resolve_eligible_voters(guild)
@@ -391,6 +412,7 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         lock = info.setdefault('lock', asyncio.Lock())
         end_vote = False
         refresh = False
+        refresh_interval = 0
         response = '投票未成功，請稍後再試。'
         guild_id = info.get('guild_id')
         channel_id = info.get('channel_id')
@@ -415,6 +437,7 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
                         info['votes'][interaction.user.id] = vote
                         response = '已登記為「贊成」。' if vote == 'approve' else '已登記為「反對」。'
                         refresh = True
+                        refresh_interval = await self.data.guild(guild).vote_refresh_interval()
                         guild_id = info.get('guild_id')
                         channel_id = info.get('channel_id')
 
@@ -423,7 +446,30 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
             await self._end_vote(message.id)
             return
         if refresh and guild_id and channel_id:
-            await self._update_vote_embed(guild_id, channel_id, message.id)
+            self._schedule_vote_refresh(guild_id, channel_id, message.id, refresh_interval)
+
+    def _schedule_vote_refresh(self, guild_id: int, channel_id: int, msg_id: int, interval: float):
+        # coalesce the edits of a vote, at most one per interval
+        info = self.active_votes.get(msg_id)
+        if info is None or info.get('refresh_pending'):
+            return  # the pending refresh will include this vote
+        info['refresh_pending'] = True
+        info['refresh_task'] = asyncio.create_task(
+            self._delayed_vote_refresh(guild_id, channel_id, msg_id, interval)
+        )
+
+    async def _delayed_vote_refresh(self, guild_id: int, channel_id: int, msg_id: int, interval: float):
+        info = self.active_votes.get(msg_id)
+        if info is None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = info.get('last_refresh', 0) + interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # votes received from now on need another refresh
+        info['refresh_pending'] = False
+        info['last_refresh'] = loop.time()
+        await self._update_vote_embed(guild_id, channel_id, msg_id)
 
     async def _update_vote_embed(self, guild_id: int, channel_id: int, msg_id: int):
         info = self.active_votes.get(msg_id)
@@ -449,15 +495,17 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
             self.active_votes.pop(msg_id, None)
             return
 
-        try:
-            vote_msg = await channel.fetch_message(msg_id)
-        except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
-            log.warning(
-                f'[Guild {guild.id}] Vote {msg_id} cannot be updated because message cannot be fetched.',
-                exc_info=e,
-            )
-            self.active_votes.pop(msg_id, None)
-            return
+        vote_msg = info.get('message')
+        if vote_msg is None:
+            try:
+                vote_msg = info['message'] = await channel.fetch_message(msg_id)
+            except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
+                log.warning(
+                    f'[Guild {guild.id}] Vote {msg_id} cannot be updated because message cannot be fetched.',
+                    exc_info=e,
+                )
+                self.active_votes.pop(msg_id, None)
+                return
 
         snapshot = await self._build_vote_snapshot(guild, info)
         embed = self._build_vote_embed(info, snapshot)
@@ -481,6 +529,9 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
             info = self.active_votes.pop(msg_id, None)
         if info is None:
             return
+        refresh_task = info.get('refresh_task')
+        if refresh_task is not None and refresh_task is not asyncio.current_task():
+            refresh_task.cancel()
 
         guild = self.bot.get_guild(info.get('guild_id'))
         if guild is None:
@@ -488,8 +539,8 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
             return
 
         vote_channel = guild.get_channel(info.get('channel_id')) or info.get('channel')
-        vote_msg = None
-        if vote_channel is not None and hasattr(vote_channel, 'fetch_message'):
+        vote_msg = info.get('message')
+        if vote_msg is None and vote_channel is not None and hasattr(vote_channel, 'fetch_message'):
             try:
                 vote_msg = await vote_channel.fetch_message(msg_id)
             except (discord.NotFound, discord.Forbidden, discord.HTTPException):
@@ -574,6 +625,15 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         await self.data.guild(ctx.guild).result_channel.set(channel.id)
         await ctx.send(f'已設定結果頻道為 {channel.mention}')
 
+    @warnset.command(name='voterefresh')
+    async def set_vote_refresh(self, ctx, seconds: float):
+        '設定表決訊息更新的最短間隔（秒）'
+        if not 0 <= seconds <= 60:
+            await ctx.send('間隔必須介於 0 到 60 秒之間。')
+            return
+        await self.data.guild(ctx.guild).vote_refresh_interval.set(seconds)
+        await ctx.send(f'表決訊息最多每 {seconds:g} 秒更新一次。')
+
     @commands.guild_only()
     @checks.mod()
     async def call_warn(
@@ -632,6 +692,7 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
                 await ctx.send('無法在投票頻道送出表決訊息，請檢查權限。')
                 return
 
+            vote_info['message'] = msg
             self.active_votes[msg.id] = vote_info
             asyncio.create_task(self._vote_timeout(msg.id))
             return
@@ -832,6 +893,7 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
                 log_dm=log_dm,
                 take_action=take_action,
                 progress_tracker=update_count if not confirm else None,
+                concurrency=self.api.masswarn_concurrency,
             )
         except errors.MissingPermissions as e:
             await ctx.send(e)
@@ -1192,15 +1254,16 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         ):
             await ctx.send(_("You are not allowed to see other's warnings!"))
             return
-        cases = await self.api.get_all_cases(ctx.guild, user)
-        if not cases:
+        levels = await self.api.count_levels(ctx.guild, user)
+        total_cases = sum(levels.values())
+        if not total_cases:
             await ctx.send(_("That member was never warned."))
             return
-        if 0 < index < len(cases):
+        if 0 < index < total_cases:
             await ctx.send(_("That case doesn't exist."))
             return
 
-        total = lambda level: len([x for x in cases if x["level"] == level])
+        total = lambda level: levels.get(level, 0)
         warning_str = lambda level, plural: {
             1: (_("Warning"), _("Warnings")),
             2: (_("Mute"), _("Mutes")),
@@ -1218,11 +1281,13 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         embed = discord.Embed(description=_("User modlog summary."))
         embed.set_author(name=f"{user} | {user.id}", icon_url=user.display_avatar.url)
         embed.add_field(
-            name=_("Total number of warnings: ") + str(len(cases)), value=warn_field, inline=False
+            name=_("Total number of warnings: ") + str(total_cases),
+            value=warn_field,
+            inline=False,
         )
         embed.colour = user.top_role.colour
 
-        paginator = WarningsSelector(ctx, user, cases)
+        paginator = WarningsSelector(ctx, user, total_cases)
         await paginator.start(embed=embed)
 
     @commands.command()
@@ -1233,12 +1298,13 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         List the latest warnings issued on the server.
         """
         guild = ctx.guild
-        full_text = ""
-        warns = await self.api.get_all_cases(guild)
-        if not warns:
+        total_warns = await self.api.count_cases(guild)
+        if not total_warns:
             await ctx.send(_("No warnings have been issued in this server yet."))
             return
-        for i, warn in enumerate(warns, start=1):
+
+        def format_warn(index: int, warn: dict) -> str:
+            # cases are fetched from the newest to the oldest
             text = _(
                 "--- Case {number} ---\n"
                 "Member:    {member} (ID: {member.id})\n"
@@ -1246,28 +1312,60 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
                 "Reason:    {reason}\n"
                 "Author:    {author} (ID: {author.id})\n"
                 "Date:      {time}\n"
-            ).format(number=i, **warn)
+            ).format(number=total_warns - index, **warn)
             if warn["duration"]:
                 duration = self.api._get_timedelta(warn["duration"])
                 text += _("Duration:  {duration}\nUntil:     {until}\n").format(
                     duration=self.api._format_timedelta(duration),
                     until=self.api._format_datetime(warn["time"] + duration),
                 )
-            text += "\n\n"
-            full_text = text + full_text
-        pages = [
-            x for x in pagify(full_text, delims=["\n\n", "\n"], priority=True, page_length=1900)
-        ]
-        total_pages = len(pages)
-        total_warns = len(warns)
-        pages = [
-            f"```yml\n{x}```\n"
-            + _("{total} warnings. Page {i}/{pages}").format(
-                total=total_warns, i=i, pages=total_pages
+            return text + "\n\n"
+
+        fetch = self.api.get_guild_cases_pager(guild, newest_first=True)
+        source = WarnlistSource(fetch, format_warn, total_warns)
+        await source.get_page(0)  # so the menu knows if there are multiple pages
+        await Pages(source, ctx=ctx, compact=True).start(embed=None)
+
+    @commands.command()
+    @commands.guild_only()
+    @checks.mod_or_permissions(kick_members=True)
+    async def warnstats(self, ctx: commands.Context, user: Optional[UnavailableMember] = None):
+        """
+        Show how many warnings were issued on the server, or to a member.
+
+        Counts are given for the last 7 days, the last 30 days and in total.
+        """
+        guild = ctx.guild
+        rollup = await self.api.get_warn_stats(guild)
+        level_names = {
+            1: _("Warnings"),
+            2: _("Mutes"),
+            3: _("Kicks"),
+            4: _("Softbans"),
+            5: _("Bans"),
+        }
+        now = datetime.now(timezone.utc).timestamp()
+        if user:
+            columns = [(_("Total"), rollup.members.get(user.id, {}))]
+            embed = discord.Embed(description=_("Warnings of the member."))
+            embed.set_author(name=f"{user} | {user.id}", icon_url=user.display_avatar.url)
+        else:
+            columns = [
+                (_("Last 7 days"), rollup.since(now - 6 * 86400)),
+                (_("Last 30 days"), rollup.since(now - 29 * 86400)),
+                (_("Total"), rollup.levels),
+            ]
+            embed = discord.Embed(description=_("Warnings issued on the server."))
+            embed.set_author(name=guild.name, icon_url=guild.icon.url if guild.icon else None)
+        for name, counts in columns:
+            embed.add_field(
+                name=name,
+                value="\n".join(
+                    f"{level_names[level]}: {counts.get(level, 0)}" for level in level_names
+                ),
+                inline=True,
             )
-            for i, x in enumerate(pages, start=1)
-        ]
-        await menus.menu(ctx=ctx, pages=pages, controls=menus.DEFAULT_CONTROLS, timeout=60)
+        await ctx.send(embed=embed)
 
     @commands.command()
     @checks.mod_or_permissions(manage_roles=True)
@@ -1399,12 +1497,14 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member):
         guild = after.guild
+        if before._roles != after._roles or before.display_name != after.display_name:
+            self._invalidate_eligible_voters(guild)
         mute_role = guild.get_role(await self.cache.get_mute_role(guild))
         if not mute_role:
             return
         if not (mute_role in before.roles and mute_role not in after.roles):
             return
-        if after.id in self.cache.temp_actions:
+        if await self.cache.get_temp_action(guild, after):
             await self.cache.remove_temp_action(guild, after)
             log.info(
                 f"[Guild {guild.id}] The temporary mute of member {after} (ID: {after.id}) "
@@ -1416,32 +1516,20 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         guild = channel.guild
         if isinstance(channel, discord.VoiceChannel):
             return
-        if not await self.data.guild(guild).update_mute():
+        if not await self.cache.get_update_mute(guild):
             return
         role = guild.get_role(await self.cache.get_mute_role(guild))
         if not role:
             return
-        try:
-            await channel.set_permissions(
-                role,
-                send_messages=False,
-                add_reactions=False,
-                reason=_(
-                    "Updating channel settings so the mute role will work here. "
-                    "Disable the auto-update with [p]warnset autoupdate"
-                ),
-            )
-        except discord.errors.Forbidden:
-            log.warn(
-                f"[Guild {guild.id}] Couldn't update permissions of new channel {channel.name} "
-                f"(ID: {channel.id}) due to a permission error."
-            )
-        except discord.errors.HTTPException as e:
-            log.error(
-                f"[Guild {guild.id}] Couldn't update permissions of new channel {channel.name} "
-                f"(ID: {channel.id}) due to an unknown error.",
-                exc_info=e,
-            )
+        self.api.overwrite_queue.enqueue(
+            channel,
+            role,
+            discord.PermissionOverwrite(send_messages=False, add_reactions=False),
+            _(
+                'Updating channel settings so the mute role will work here. '
+                'Disable the auto-update with [p]warnset autoupdate'
+            ),
+        )
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild: discord.Guild, member: discord.Member):
@@ -1449,8 +1537,17 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
+        self._invalidate_eligible_voters(member.guild)
         await self.on_manual_action(member.guild, member, 3)
 
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        self._invalidate_eligible_voters(after.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self._invalidate_eligible_voters(role.guild)
+
     async def on_manual_action(self, guild: discord.Guild, member: discord.Member, level: int):
         # most of this code is from Cog-Creators, modlog cog
         # https://github.com/Cog-Creators/Red-DiscordBot/blob/bc21f779762ec9f460aecae525fdcd634f6c2d85/redbot/core/modlog.py#L68
@@ -1543,15 +1640,13 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         file = BytesIO()
         file.write(readme.encode("utf-8"))
         files = {"README": file}
-        all_modlogs = await self.data.custom("MODLOGS").all()
+        all_modlogs = await self.api.modlogs.get_user_cases(user_id)
         for guild_id, modlogs in all_modlogs.items():
-            if str(user_id) not in modlogs:
-                files[guild_id] = BytesIO()
             guild = self.bot.get_guild(int(guild_id))
             text = "Modlogs registered for server {guild}\n".format(
                 guild=guild.name if guild else f"{guild_id} (not found)"
             )
-            for i, modlog in enumerate(modlogs[str(user_id)]["x"]):
+            for i, modlog in enumerate(modlogs):
                 text += (
                     "\n\n\n--- Case {number} ---\nLevel:     {level}\nReason:    {reason}\n"
                 ).format(number=i + 1, **modlog)
@@ -1568,7 +1663,7 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
                     text += "Roles:     {roles}\n".format(roles=", ".join(modlog["roles"]))
             file = BytesIO()
             file.write(text.encode("utf-8"))
-            files[guild_id] = file
+            files[str(guild_id)] = file
         return files
 
     async def red_get_data_for_user(self, *, user_id: int):
@@ -1589,12 +1684,10 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         allowed_requesters = ("discord_deleted_user",)
         if requester not in allowed_requesters:
             return False
-        async with self.data.custom("MODLOGS").all() as all_modlogs:
-            for guild_id, modlogs in all_modlogs.items():
-                try:
-                    del all_modlogs[guild_id][str(user_id)]
-                except KeyError:
-                    pass
+        async with self.api.modlog_gate.write():
+            await self.api.modlogs.delete_user(user_id)
+            self.api.autowarn_counters.invalidate()
+            self.api.warn_stats.invalidate()
         return True
 
     async def red_delete_data_for_user(self, *, requester: str, user_id: int):
@@ -1619,4 +1712,6 @@ class WarnSystem(SettingsMixin, AutomodMixin, commands.Cog, metaclass=CompositeM
         # stop checking for unmute and unban
         self.task.cancel()
         self.api.disable_automod()
-        self.api.re_pool.close()
+        self.api.regex_engine.close()
+        self.api.overwrite_queue.cancel()
+        asyncio.create_task(self.api.modlogs.close())